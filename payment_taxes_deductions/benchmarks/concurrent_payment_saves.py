@@ -0,0 +1,438 @@
+"""
+Concurrent Payment Entry Save Load Test
+Drive many simultaneous Payment Entry saves through the full validation path
+(ERPNext's validation and this app's deduction hooks) and report throughput,
+tail latency and lock waits
+
+Each worker (a process by default, or a thread) opens its own database
+connection, like one gunicorn worker per cashier, and saves draft receipts
+against submitted Sales Invoices of load test customers. Drafts do not consume
+invoice outstanding, so the same invoices are referenced by every save.
+
+Fixtures (customers spread over the customer group mix, a non-stock item and
+their invoices) are created once and reused by later runs. With rule_ranges,
+the company's Stamp Tax Range table is replaced by that many synthetic ranges
+for the run and restored afterwards. Only run this on a local bench.
+
+Usage:
+    bench --site <site> execute payment_taxes_deductions.benchmarks.concurrent_payment_saves.run \\
+        --kwargs "{'company': 'My Company', 'concurrency': 50, 'saves': 1000, 'references': 10}"
+
+    bench --site <site> execute payment_taxes_deductions.benchmarks.concurrent_payment_saves.cleanup
+"""
+
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import frappe
+from frappe.utils import flt, nowdate
+
+CUSTOMER_PREFIX = "Deduction Load Test Customer"
+ITEM_CODE = "Deduction Load Test Item"
+REMARKS = "Deduction load test"
+
+LOCK_STATUS = ("Innodb_row_lock_waits", "Innodb_row_lock_time", "Innodb_deadlocks")
+
+
+# ============================================================================
+# SECTION 1: FIXTURES
+# ============================================================================
+
+def parse_group_mix(company, group_mix=None):
+    """
+    Customer group weights as {group: weight}
+
+    Accepts a dict or "Group A:3,Group B:1"; defaults to every customer group
+    with a Receive profile in the company, weighted equally.
+    """
+    if isinstance(group_mix, str):
+        group_mix = dict(
+            (part.rsplit(":", 1)[0].strip(), flt(part.rsplit(":", 1)[1]))
+            if ":" in part else (part.strip(), 1)
+            for part in group_mix.split(",")
+            if part.strip()
+        )
+
+    if not group_mix:
+        groups = frappe.get_all(
+            "Payment Deductions Accounts",
+            filters={"company": company, "payment_type": "Receive"},
+            pluck="customer_group",
+        )
+        group_mix = {group: 1 for group in groups if group}
+
+    if not group_mix:
+        frappe.throw(f"No customer group mix given and no deduction profile found for {company}")
+
+    return group_mix
+
+
+def ensure_item():
+    if not frappe.db.exists("Item", ITEM_CODE):
+        frappe.get_doc({
+            "doctype": "Item",
+            "item_code": ITEM_CODE,
+            "item_name": ITEM_CODE,
+            "item_group": frappe.db.get_value("Item Group", {"is_group": 0}, "name"),
+            "stock_uom": "Nos",
+            "is_stock_item": 0,
+            "is_sales_item": 1,
+        }).insert(ignore_permissions=True)
+    return ITEM_CODE
+
+
+def ensure_customers(customers, group_mix):
+    """Create load test customers, groups assigned in proportion to the mix"""
+    groups = list(group_mix)
+    weights = [group_mix[group] for group in groups]
+    rng = random.Random(42)
+
+    names = []
+    for index in range(customers):
+        name = f"{CUSTOMER_PREFIX} {index + 1:04d}"
+        group = rng.choices(groups, weights)[0]
+        if not frappe.db.exists("Customer", name):
+            frappe.get_doc({
+                "doctype": "Customer",
+                "customer_name": name,
+                "customer_group": group,
+                "customer_type": "Company",
+            }).insert(ignore_permissions=True, set_name=name)
+        else:
+            frappe.db.set_value("Customer", name, "customer_group", group)
+        names.append(name)
+
+    frappe.db.commit()
+    return names
+
+
+def ensure_invoices(company, customers, references, amount_range):
+    """
+    Submitted invoices per customer, enough for one payment with all references
+
+    Returns:
+        dict: customer -> [invoice names]
+    """
+    item_code = ensure_item()
+    rng = random.Random(7)
+    invoices = {}
+
+    for customer in customers:
+        existing = frappe.get_all(
+            "Sales Invoice",
+            filters={
+                "customer": customer,
+                "company": company,
+                "docstatus": 1,
+                "remarks": REMARKS,
+                "outstanding_amount": [">", 0],
+            },
+            pluck="name",
+            limit=references,
+        )
+        for _i in range(references - len(existing)):
+            invoice = frappe.get_doc({
+                "doctype": "Sales Invoice",
+                "customer": customer,
+                "company": company,
+                "posting_date": nowdate(),
+                "due_date": nowdate(),
+                "remarks": REMARKS,
+                "items": [{
+                    "item_code": item_code,
+                    "qty": 1,
+                    "rate": flt(rng.uniform(*amount_range), 2),
+                }],
+            })
+            invoice.set_missing_values()
+            invoice.insert(ignore_permissions=True)
+            invoice.submit()
+            existing.append(invoice.name)
+
+        invoices[customer] = existing
+        frappe.db.commit()
+
+    return invoices
+
+
+def replace_rule_ranges(company, rule_ranges, max_amount):
+    """
+    Replace the company's Stamp Tax Range rows with rule_ranges synthetic ranges
+
+    Returns:
+        tuple: (rules document name, original rows) for restore_rule_ranges()
+    """
+    rules = frappe.get_doc("Stamp Tax Calculation Rules", {"company": company})
+    original = [row.as_dict(no_default_fields=True) for row in rules.get("stamp_tax_range")]
+
+    width = flt(max_amount) * 2 / rule_ranges
+    rules.set("stamp_tax_range", [])
+    for index in range(rule_ranges):
+        rules.append("stamp_tax_range", {
+            "from_amount": index * width,
+            "to_amount": (index + 1) * width,
+            "percentage": 0.4 + (index % 10) * 0.05,
+            "subtract_amount": index * width,
+            "add_amount": index,
+            "check_stamp_amount": 1 if index % 2 else 0,
+            "additional_stamp_multiplier": 3,
+        })
+    rules.save(ignore_permissions=True)
+    frappe.db.commit()
+
+    return rules.name, original
+
+
+def restore_rule_ranges(rules_name, original):
+    rules = frappe.get_doc("Stamp Tax Calculation Rules", rules_name)
+    rules.set("stamp_tax_range", original)
+    rules.save(ignore_permissions=True)
+    frappe.db.commit()
+
+
+# ============================================================================
+# SECTION 2: WORKERS
+# ============================================================================
+
+def _init_worker(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+
+
+def save_payment(task):
+    """
+    Build and save one draft receipt with all references of a customer
+
+    Runs in a worker with its own connection; the save is committed like a
+    desk request.
+
+    Returns:
+        dict: name, customer_group, latency_ms, error
+    """
+    from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+    started = time.perf_counter()
+    name, error = None, None
+    try:
+        payment = get_payment_entry("Sales Invoice", task["invoices"][0])
+        payment.remarks = REMARKS
+        payment.set("references", [])
+        total = 0
+        for invoice in task["invoices"]:
+            outstanding = flt(frappe.db.get_value("Sales Invoice", invoice, "outstanding_amount"))
+            payment.append("references", {
+                "reference_doctype": "Sales Invoice",
+                "reference_name": invoice,
+                "allocated_amount": outstanding,
+            })
+            total += outstanding
+        payment.paid_amount = payment.received_amount = total
+        payment.insert(ignore_permissions=True)
+        frappe.db.commit()
+        name = payment.name
+    except Exception as e:
+        frappe.db.rollback()
+        error = f"{type(e).__name__}: {str(e)[:200]}"
+
+    return {
+        "name": name,
+        "customer_group": task["customer_group"],
+        "latency_ms": (time.perf_counter() - started) * 1000,
+        "error": error,
+    }
+
+
+def save_payment_in_thread(task):
+    # Threads keep one connection each, opened on first use
+    if not getattr(frappe.local, "site", None):
+        _init_worker(task["site"], task["sites_path"])
+    return save_payment(task)
+
+
+# ============================================================================
+# SECTION 3: REPORTING
+# ============================================================================
+
+def get_lock_status():
+    return {
+        row[0]: flt(row[1])
+        for row in frappe.db.sql(
+            "show global status where Variable_name in %(names)s", {"names": LOCK_STATUS}
+        )
+    }
+
+
+def percentile(values, share):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(share * (len(values) - 1)))]
+
+
+def print_report(results, elapsed, lock_before, lock_after, settings):
+    latencies = [result["latency_ms"] for result in results if not result["error"]]
+    errors = [result["error"] for result in results if result["error"]]
+
+    print("\nConcurrent Payment Entry saves")
+    print("==============================")
+    for key, value in settings.items():
+        print(f"  {key}: {value}")
+
+    print(f"\n  saves: {len(latencies)} ok, {len(errors)} failed in {elapsed:.1f} s")
+    print(f"  throughput: {len(latencies) / elapsed if elapsed else 0:.1f} saves/s")
+    p50, p90, p95, p99 = (percentile(latencies, q) for q in (0.5, 0.9, 0.95, 0.99))
+    print(
+        f"  latency ms: p50={p50:.0f} p90={p90:.0f} p95={p95:.0f} p99={p99:.0f}"
+        f" max={max(latencies or [0]):.0f}"
+    )
+
+    waits = lock_after.get("Innodb_row_lock_waits", 0) - lock_before.get("Innodb_row_lock_waits", 0)
+    wait_time = lock_after.get("Innodb_row_lock_time", 0) - lock_before.get("Innodb_row_lock_time", 0)
+    deadlocks = lock_after.get("Innodb_deadlocks", 0) - lock_before.get("Innodb_deadlocks", 0)
+    average_wait = wait_time / waits if waits else 0
+    print(
+        f"  row lock waits: {waits:.0f} ({wait_time:.0f} ms total, {average_wait:.1f} ms avg),"
+        f" deadlocks: {deadlocks:.0f}"
+    )
+
+    by_group = {}
+    for result in results:
+        if not result["error"]:
+            by_group.setdefault(result["customer_group"], []).append(result["latency_ms"])
+    for group, values in sorted(by_group.items()):
+        print(
+            f"  {group}: {len(values)} saves,"
+            f" p50={percentile(values, 0.5):.0f} p95={percentile(values, 0.95):.0f} ms"
+        )
+
+    counts = {}
+    for error in errors:
+        counts[error.split(":", 1)[0]] = counts.get(error.split(":", 1)[0], 0) + 1
+    for error_type, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  error {error_type}: {count}")
+    if errors:
+        print(f"  first error: {errors[0]}")
+
+
+# ============================================================================
+# SECTION 4: ENTRY POINTS
+# ============================================================================
+
+def run(company=None, concurrency=20, saves=200, references=5, customers=50, group_mix=None,
+        rule_ranges=None, min_amount=100, max_amount=50000, mode="processes", keep=0):
+    """
+    Run the load test and print the report
+
+    Args:
+        company: Company (defaults to the global default company)
+        concurrency: Number of simultaneous workers (cashiers)
+        saves: Total number of Payment Entry saves
+        references: Sales Invoice references per Payment Entry
+        customers: Number of load test customers
+        group_mix: Customer group weights, dict or "Group A:3,Group B:1"
+        rule_ranges: Replace the Stamp Tax Range table with this many ranges for the run
+        min_amount: Lowest invoice amount
+        max_amount: Highest invoice amount
+        mode: "processes" (one process per worker) or "threads"
+        keep: Keep the saved draft Payment Entries instead of deleting them
+    """
+    company = company or frappe.defaults.get_global_default("company")
+    concurrency, saves, references = int(concurrency), int(saves), int(references)
+    group_mix = parse_group_mix(company, group_mix)
+
+    print("Preparing fixtures...")
+    customer_names = ensure_customers(int(customers), group_mix)
+    invoices = ensure_invoices(company, customer_names, references, (flt(min_amount), flt(max_amount)))
+    customer_groups = dict(frappe.get_all(
+        "Customer", filters={"name": ["in", customer_names]}, fields=["name", "customer_group"],
+        as_list=True,
+    ))
+
+    restore = None
+    if rule_ranges:
+        restore = replace_rule_ranges(company, int(rule_ranges), max_amount)
+
+    rng = random.Random(1)
+    tasks = []
+    for _i in range(saves):
+        customer = rng.choice(customer_names)
+        tasks.append({
+            "invoices": invoices[customer],
+            "customer_group": customer_groups.get(customer),
+            "site": frappe.local.site,
+            "sites_path": frappe.local.sites_path,
+        })
+
+    try:
+        if mode == "threads":
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            worker = save_payment_in_thread
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=concurrency,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(frappe.local.site, frappe.local.sites_path),
+            )
+            worker = save_payment
+
+        with executor:
+            # Warm every worker (imports, connection) before timing
+            list(executor.map(worker, tasks[:concurrency]))
+
+            lock_before = get_lock_status()
+            started = time.perf_counter()
+            results = list(executor.map(worker, tasks))
+            elapsed = time.perf_counter() - started
+            lock_after = get_lock_status()
+
+    finally:
+        if restore:
+            restore_rule_ranges(*restore)
+
+    print_report(results, elapsed, lock_before, lock_after, {
+        "company": company,
+        "mode": mode,
+        "concurrency": concurrency,
+        "references": references,
+        "customers": len(customer_names),
+        "group mix": group_mix,
+        "rule ranges": rule_ranges or "unchanged",
+    })
+
+    if not int(keep):
+        delete_payments()
+
+
+def delete_payments():
+    """Delete draft Payment Entries saved by the load test"""
+    names = frappe.get_all(
+        "Payment Entry", filters={"docstatus": 0, "remarks": REMARKS}, pluck="name"
+    )
+    for name in names:
+        frappe.delete_doc("Payment Entry", name, ignore_permissions=True, force=True)
+    frappe.db.commit()
+    return len(names)
+
+
+def cleanup():
+    """Remove every load test fixture (payments, invoices, customers, item)"""
+    delete_payments()
+
+    for name in frappe.get_all("Sales Invoice", filters={"remarks": REMARKS}, pluck="name"):
+        invoice = frappe.get_doc("Sales Invoice", name)
+        if invoice.docstatus == 1:
+            invoice.cancel()
+        frappe.delete_doc("Sales Invoice", name, ignore_permissions=True, force=True)
+        frappe.db.commit()
+
+    for name in frappe.get_all(
+        "Customer", filters={"name": ["like", CUSTOMER_PREFIX + "%"]}, pluck="name"
+    ):
+        frappe.delete_doc("Customer", name, ignore_permissions=True, force=True)
+
+    if frappe.db.exists("Item", ITEM_CODE):
+        frappe.delete_doc("Item", ITEM_CODE, ignore_permissions=True, force=True)
+    frappe.db.commit()
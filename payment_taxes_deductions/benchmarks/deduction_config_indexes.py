@@ -0,0 +1,92 @@
+"""
+Deduction Config Index Benchmark
+Show query plans and timings of the deduction config and register lookups
+with and without the indexes added by the v1_1 patches
+
+Indexes are never dropped: the "before" plan is produced with IGNORE INDEX,
+so the benchmark is safe to run on a live site.
+
+Usage:
+    bench --site <site> execute payment_taxes_deductions.benchmarks.deduction_config_indexes.run
+"""
+
+import time
+
+import frappe
+
+QUERIES = [
+    (
+        "Payment Deductions Accounts by company and customer group",
+        "tabPayment Deductions Accounts",
+        "unique_company_payment_type_party_group",
+        """select name from `tabPayment Deductions Accounts` {hint}
+        where company = %(company)s and payment_type = 'Receive'
+            and party_group = %(customer_group)s""",
+    ),
+    (
+        "Stamp Tax Calculation Rules by company",
+        "tabStamp Tax Calculation Rules",
+        "company",
+        """select name from `tabStamp Tax Calculation Rules` {hint}
+        where company = %(company)s""",
+    ),
+    (
+        "Deduction register on Advance Taxes and Charges",
+        "tabAdvance Taxes and Charges",
+        "deduction_register_index",
+        """select parent, sum(base_tax_amount) from `tabAdvance Taxes and Charges` {hint}
+        where account_head = %(account)s and parenttype = 'Payment Entry'
+        group by parent""",
+    ),
+]
+
+
+def run(company=None, customer_group=None, account=None, repeat=200):
+    """
+    Print EXPLAIN output and average timings before/after for each lookup
+
+    Args:
+        company: Company to look up (defaults to the first configured profile)
+        customer_group: Customer Group to look up
+        account: Deduction account for the register query
+        repeat: Number of executions timed per query
+    """
+    profile = frappe.db.get_value(
+        "Payment Deductions Accounts",
+        {"company": company} if company else {},
+        ["company", "customer_group", "regular_stamp"],
+        as_dict=True,
+    ) or frappe._dict()
+
+    values = {
+        "company": company or profile.company,
+        "customer_group": customer_group or profile.customer_group,
+        "account": account or profile.regular_stamp,
+    }
+
+    for title, table, index_name, query in QUERIES:
+        print("\n" + title)
+        print("=" * len(title))
+        for label, hint in (
+            ("before", f"ignore index (`{index_name}`)"),
+            ("after", ""),
+        ):
+            if hint and not frappe.db.has_index(table, index_name):
+                print(f"  {label}: index {index_name} not found")
+                continue
+
+            sql = query.format(hint=hint)
+            plan = frappe.db.sql("explain " + sql, values, as_dict=True)
+
+            started = time.perf_counter()
+            for _i in range(repeat):
+                frappe.db.sql(sql, values)
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+
+            print(f"  {label}: {elapsed:.3f} ms")
+            for row in plan:
+                print(
+                    "    type={type} key={key} rows={rows} extra={Extra}".format(
+                        **{k: row.get(k) for k in ("type", "key", "rows", "Extra")}
+                    )
+                )
@@ -0,0 +1,77 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-deduction-running-totals")
+@click.option("--company", help="Only rebuild this company")
+@click.option("--fiscal-year", help="Only rebuild this fiscal year")
+@pass_context
+def rebuild_deduction_running_totals(context, company=None, fiscal_year=None):
+    """Rebuild Deduction Running Total rows from submitted Payment Entries"""
+    from payment_taxes_deductions.payment_taxes_deductions.running_totals import (
+        rebuild_running_totals,
+    )
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        count = rebuild_running_totals(company, fiscal_year)
+        click.echo(f"Rebuilt {count} running totals")
+    finally:
+        frappe.destroy()
+
+
+@click.command("prewarm-deduction-cache")
+@click.option("--company", multiple=True, help="Only prewarm this company (repeatable)")
+@pass_context
+def prewarm_deduction_cache(context, company=None):
+    """Load stamp brackets and deduction profiles of all companies into the cache"""
+    from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+        prewarm_deduction_cache as prewarm,
+    )
+
+    for site in context.sites:
+        frappe.init(site=site)
+        frappe.connect()
+        try:
+            loaded = prewarm(list(company) or None)
+            click.echo(
+                "{}: {} companies, {} profiles, {} accounts".format(
+                    site, loaded["companies"], loaded["profiles"], loaded["accounts"]
+                )
+            )
+        finally:
+            frappe.destroy()
+
+
+@click.command("check-deduction-replica")
+@pass_context
+def check_deduction_replica(context):
+    """Show the database server heavy deduction reads and saves use"""
+    from payment_taxes_deductions.payment_taxes_deductions.read_replica import (
+        get_server_info,
+        is_replica_configured,
+        replica_connection,
+    )
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        primary = get_server_info()
+        with replica_connection() as db:
+            replica = get_server_info(db)
+
+        click.echo("Saves:         {hostname}:{port} (read_only={read_only})".format(**primary))
+        click.echo("Heavy reads:   {hostname}:{port} (read_only={read_only})".format(**replica))
+        if not is_replica_configured():
+            click.echo("No replica configured (read_from_replica, replica_host), reading from the primary")
+        elif replica == primary:
+            click.echo("Replica resolves to the primary server")
+    finally:
+        frappe.destroy()
+
+
+commands = [rebuild_deduction_running_totals, prewarm_deduction_cache, check_deduction_replica]
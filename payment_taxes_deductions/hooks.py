@@ -43,13 +43,11 @@ app_license = "mit"
 # page_js = {"page" : "public/js/file.js"}
 
 # include js in doctype views
-
-
-###############doctype_js = {"Payment Entry": "public/js/payment_entry.js"}
-
-
-
-# doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
+doctype_js = {"Payment Entry": "public/js/payment_entry.js"}
+doctype_list_js = {
+    "Payment Entry": "public/js/payment_entry_list.js",
+    "Sales Invoice": "public/js/sales_invoice_list.js",
+}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
 
@@ -90,6 +88,19 @@ app_license = "mit"
 # before_install = "payment_taxes_deductions.install.before_install"
 # after_install = "payment_taxes_deductions.install.after_install"
 
+# Migration
+# ------------
+
+after_migrate = [
+    "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.prewarm_deduction_cache",
+]
+
+# Boot
+# ------------
+# Enqueue a deduction cache prewarm when the first desk session finds it cold
+
+boot_session = "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.prewarm_on_boot"
+
 # Uninstallation
 # ------------
 
@@ -142,15 +153,48 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
-## doc_events = {
-##     "Payment Entry": {
-##         "before_validate": "payment_taxes_deductions.payment_taxes_deductions.payment_entry.before_validate",
-##     }
-## }
+doc_events = {
+    "Payment Entry": {
+        "before_validate": "payment_taxes_deductions.payment_taxes_deductions.payment_entry.before_validate",
+        "on_update": "payment_taxes_deductions.payment_taxes_deductions.deduction_events.on_update",
+        "on_submit": [
+            "payment_taxes_deductions.payment_taxes_deductions.running_totals.on_submit",
+            "payment_taxes_deductions.payment_taxes_deductions.deduction_events.on_submit",
+        ],
+        "on_cancel": [
+            "payment_taxes_deductions.payment_taxes_deductions.running_totals.on_cancel",
+            "payment_taxes_deductions.payment_taxes_deductions.deduction_events.on_cancel",
+        ],
+    },
+    "Sales Invoice": {
+        "on_submit": "payment_taxes_deductions.payment_taxes_deductions.sales_invoice.on_submit",
+    },
+    # Renames rewrite the links of cached deduction profiles without their controllers
+    "Company": {
+        "after_rename": "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.clear_deduction_cache",
+    },
+    "Customer Group": {
+        "after_rename": "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.clear_deduction_cache",
+    },
+    "Supplier Group": {
+        "after_rename": "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.clear_deduction_cache",
+    },
+}
 
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+    "all": [
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_errors.flush_deduction_errors",
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_events.assign_sequences",
+    ],
+    "daily": [
+        "payment_taxes_deductions.payment_taxes_deductions.consolidated_posting.post_consolidated_deductions",
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_columns.archive_deductions",
+    ],
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"payment_taxes_deductions.tasks.all"
@@ -245,6 +289,11 @@ app_license = "mit"
 # 	"Logging DocType Name": 30  # days to retain logs
 # }
 
+default_log_clearing_doctypes = {
+    "Deduction Profile Log": 30,
+    "Deduction Event": 90,
+}
+
 # Translation
 # ------------
 # List of apps whose translatable strings should be excluded from this app's translations.
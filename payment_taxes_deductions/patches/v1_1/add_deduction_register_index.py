@@ -0,0 +1,14 @@
+import frappe
+
+
+def execute():
+    """
+    Add a covering index for deduction register queries on Advance Taxes and Charges
+    Register queries filter by account_head and parenttype and read parent and amounts
+    """
+    frappe.db.add_index(
+        "Advance Taxes and Charges",
+        ["account_head", "parenttype", "parent", "tax_amount", "base_tax_amount"],
+        index_name="deduction_register_index",
+    )
+
@@ -0,0 +1,6 @@
+from payment_taxes_deductions.payment_taxes_deductions.running_totals import rebuild_running_totals
+
+
+def execute():
+    """Build running totals from Payment Entries submitted before they were maintained"""
+    rebuild_running_totals()
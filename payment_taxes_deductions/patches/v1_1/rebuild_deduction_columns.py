@@ -0,0 +1,19 @@
+import os
+
+import frappe
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_columns import (
+    archive_deductions,
+    get_archive_folder,
+)
+
+
+def execute():
+    """Rebuild the columnar deduction archive with the party group, paid amount and bracket columns"""
+    companies = [
+        company
+        for company in frappe.get_all("Company", pluck="name")
+        if os.path.exists(get_archive_folder(company))
+    ]
+    if companies:
+        archive_deductions(companies, rebuild=True)
@@ -0,0 +1,18 @@
+import frappe
+
+
+def execute():
+    """
+    Mark existing deduction profiles as Receive profiles keyed by their customer group
+    and drop the old (company, customer_group) unique key, which Pay profiles would violate
+    """
+    frappe.db.sql(
+        """update `tabPayment Deductions Accounts`
+        set payment_type = 'Receive', party_group = customer_group
+        where ifnull(payment_type, '') in ('', 'Receive')"""
+    )
+
+    if frappe.db.has_index("tabPayment Deductions Accounts", "unique_company_customer_group"):
+        frappe.db.sql_ddl(
+            "alter table `tabPayment Deductions Accounts` drop index `unique_company_customer_group`"
+        )
@@ -0,0 +1,430 @@
+"""
+Bank Statement Net-Amount Matching
+Match bank statement lines against the expected net of open Sales Invoices
+
+Bank statements show what was actually received, i.e. the invoice amount
+minus the deductions withheld by the customer. This module evaluates the
+deduction engine in bulk for all open invoices, keeps the expected net amounts
+in a sorted in-memory index per customer and matches statement lines by binary
+search with a tolerance, including combinations of a few invoices paid with a
+single transfer. Matches can be turned into a draft Payment Entry with the
+deduction rows already filled in.
+
+Structure:
+1. Index Building
+2. Matching
+3. API Methods
+"""
+
+import json
+from bisect import bisect_left, bisect_right
+
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate, nowdate
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    evaluate_deductions,
+    get_compiled_brackets,
+    get_deduction_profile,
+)
+from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import (
+    get_deduction_exchange_rate,
+    get_exchange_rate,
+    preload_exchange_rates,
+    set_party_amount,
+)
+from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import (
+    calculate_invoice_expectations,
+    get_reference_expectations,
+)
+
+# Largest number of open invoices of one customer searched for 3-invoice combinations
+TRIPLE_SEARCH_LIMIT = 400
+
+
+# ============================================================================
+# SECTION 1: INDEX BUILDING
+# ============================================================================
+
+class NetAmountIndex:
+    """
+    Sorted index of expected net amounts of open invoices
+
+    Entries are tuples (net, invoice, customer, customer_group, outstanding,
+    vat_20_share, exchange_rate) sorted by net, kept per customer and for the
+    whole company.
+    """
+
+    def __init__(self, company):
+        self.company = company
+        self.brackets = get_compiled_brackets(company)
+        self.by_customer = {}
+        self.customer_nets = {}
+        self.all_entries = []
+        self.all_nets = []
+
+    def add(self, entry):
+        self.by_customer.setdefault(entry[2], []).append(entry)
+
+    def finalize(self):
+        for entries in self.by_customer.values():
+            entries.sort()
+        self.all_entries = sorted(
+            entry for entries in self.by_customer.values() for entry in entries
+        )
+        self.all_nets = [entry[0] for entry in self.all_entries]
+        self.customer_nets = {
+            customer: [entry[0] for entry in entries]
+            for customer, entries in self.by_customer.items()
+        }
+
+    def net_for(self, outstanding, vat_20_share, customer_group, exchange_rate=1):
+        """Expected net received when outstanding is paid in one Payment Entry"""
+        profile = get_deduction_profile(self.company, customer_group)
+        deductions = evaluate_deductions(
+            outstanding, self.brackets, profile, exchange_rate=exchange_rate
+        )
+        if vat_20_share and profile.get("vat_20_percent"):
+            deductions["vat_20_percent"] = vat_20_share
+        return flt(outstanding) - sum(deductions.values()), deductions
+
+
+def build_net_amount_index(company, customers=None):
+    """
+    Build the expected net index for all open Sales Invoices of a company
+
+    Open invoices and their stored expectations are read in one query;
+    invoices without stored expectations are computed in bulk.
+
+    Args:
+        company: Company name
+        customers: List of customers to restrict the index to (optional)
+
+    Returns:
+        NetAmountIndex: Finalized index
+    """
+    filters = {
+        "company": company,
+        "docstatus": 1,
+        "is_return": 0,
+        "outstanding_amount": [">", 0],
+    }
+    if customers:
+        filters["customer"] = ["in", customers]
+
+    invoices = frappe.get_all(
+        "Sales Invoice",
+        filters=filters,
+        fields=[
+            "name",
+            "customer",
+            "customer_group",
+            "grand_total",
+            "conversion_rate",
+            "party_account_currency",
+            "outstanding_amount",
+            "custom_expected_deductions",
+        ],
+    )
+
+    # Outstanding amounts are in the receivable currency, valued at today's rate
+    company_currency = frappe.get_cached_value("Company", company, "default_currency")
+    preload_exchange_rates(
+        company_currency, [invoice.party_account_currency for invoice in invoices], nowdate()
+    )
+
+    missing = [invoice for invoice in invoices if not invoice.custom_expected_deductions]
+    computed = calculate_invoice_expectations(missing, company) if missing else {}
+
+    index = NetAmountIndex(company)
+    for invoice in invoices:
+        if invoice.custom_expected_deductions:
+            expectation = json.loads(invoice.custom_expected_deductions)
+        else:
+            expectation = computed.get(invoice.name)
+
+        vat_20_share = 0
+        if expectation and flt(expectation.get("base")):
+            vat_20_share = flt(expectation["deductions"].get("vat_20_percent")) * (
+                flt(invoice.outstanding_amount) / flt(expectation["base"])
+            )
+
+        outstanding = flt(invoice.outstanding_amount)
+        exchange_rate = get_exchange_rate(
+            invoice.party_account_currency or company_currency, company_currency, nowdate()
+        )
+        net, _deductions = index.net_for(
+            outstanding, vat_20_share, invoice.customer_group, exchange_rate
+        )
+        index.add((
+            flt(net, 2),
+            invoice.name,
+            invoice.customer,
+            invoice.customer_group,
+            outstanding,
+            vat_20_share,
+            exchange_rate,
+        ))
+
+    index.finalize()
+    return index
+
+
+# ============================================================================
+# SECTION 2: MATCHING
+# ============================================================================
+
+def match_amount(index, amount, customer=None, tolerance=0.01, max_invoices=3, limit=5):
+    """
+    Match a received amount against the index
+
+    Single invoices are searched across the customer (or the whole company when
+    no customer is known). Combinations of 2 or 3 invoices are only searched
+    within one customer. Combination candidates are found on the sum of the
+    single nets and then confirmed by evaluating the engine on the combined
+    amount, since stamp brackets apply to the whole payment.
+
+    Args:
+        index: NetAmountIndex
+        amount: Net amount received on the statement line
+        customer: Customer of the statement line (optional)
+        tolerance: Accepted absolute difference
+        max_invoices: Largest number of invoices combined in one match (1-3)
+        limit: Maximum number of matches returned
+
+    Returns:
+        list: Matches sorted by difference, each a dict
+    """
+    amount = flt(amount)
+    tolerance = flt(tolerance)
+    matches = []
+
+    if customer:
+        entries = index.by_customer.get(customer, [])
+        nets = index.customer_nets.get(customer, [])
+    else:
+        entries, nets = index.all_entries, index.all_nets
+
+    for position in range(
+        bisect_left(nets, amount - tolerance), bisect_right(nets, amount + tolerance)
+    ):
+        matches.append(_make_match(index, [entries[position]], amount))
+
+    if customer and max_invoices > 1 and len(entries) > 1:
+        # Combined deductions differ from the sum of single deductions, so
+        # candidates are searched in a wider window and confirmed afterwards
+        window = tolerance + amount * 0.02
+        for combination in _find_combinations(entries, nets, amount, window, max_invoices):
+            match = _make_match(index, combination, amount)
+            if abs(match["difference"]) <= tolerance:
+                matches.append(match)
+
+    matches.sort(key=lambda match: (abs(match["difference"]), len(match["invoices"])))
+    return matches[:limit]
+
+
+def _find_combinations(entries, nets, amount, window, max_invoices):
+    count = len(nets)
+    for first in range(count):
+        rest = amount - nets[first]
+        if rest < nets[0] - window:
+            break
+        for second in range(
+            bisect_left(nets, rest - window, first + 1), bisect_right(nets, rest + window, first + 1)
+        ):
+            yield [entries[first], entries[second]]
+
+    if max_invoices < 3 or count > TRIPLE_SEARCH_LIMIT:
+        return
+
+    for first in range(count):
+        for second in range(first + 1, count):
+            rest = amount - nets[first] - nets[second]
+            if rest < nets[0] - window:
+                break
+            for third in range(
+                bisect_left(nets, rest - window, second + 1),
+                bisect_right(nets, rest + window, second + 1),
+            ):
+                yield [entries[first], entries[second], entries[third]]
+
+
+def _make_match(index, combination, amount):
+    customer_group = combination[0][3]
+    outstanding = sum(entry[4] for entry in combination)
+    vat_20_share = sum(entry[5] for entry in combination)
+    net, deductions = index.net_for(outstanding, vat_20_share, customer_group, combination[0][6])
+
+    return {
+        "customer": combination[0][2],
+        "customer_group": customer_group,
+        "invoices": [entry[1] for entry in combination],
+        "outstanding_amount": outstanding,
+        "expected_net": flt(net, 2),
+        "difference": flt(amount - net, 2),
+        "deductions": deductions,
+    }
+
+
+# ============================================================================
+# SECTION 3: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+@frappe.read_only()
+def match_statement_lines(company, lines, tolerance=0.01, max_invoices=3):
+    """
+    Match bank statement lines against expected net amounts of open invoices
+
+    Args:
+        company: Company name
+        lines: JSON list of {"amount": float, "customer": optional, "reference": optional}
+        tolerance: Accepted absolute difference per line
+        max_invoices: Largest number of invoices combined in one match
+
+    Returns:
+        list: One entry per line with its candidate matches
+    """
+    try:
+        if isinstance(lines, str):
+            lines = json.loads(lines)
+
+        if not company:
+            frappe.throw(_("Company is required"))
+
+        # Restrict the index only when every line names its customer
+        customers = None
+        if all(line.get("customer") for line in lines):
+            customers = list({line.get("customer") for line in lines})
+        index = build_net_amount_index(company, customers)
+
+        return [
+            {
+                "reference": line.get("reference"),
+                "amount": flt(line.get("amount")),
+                "matches": match_amount(
+                    index,
+                    line.get("amount"),
+                    line.get("customer"),
+                    flt(tolerance),
+                    int(max_invoices),
+                ),
+            }
+            for line in lines
+        ]
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), _("Error matching statement lines"))
+        frappe.throw(_("Error matching statement lines: {0}").format(str(e)))
+
+
+@frappe.whitelist()
+@frappe.read_only()
+def match_bank_transactions(bank_transactions, tolerance=0.01, max_invoices=3):
+    """
+    Match unreconciled Bank Transaction deposits against open invoices
+
+    Args:
+        bank_transactions: JSON list of Bank Transaction names
+        tolerance: Accepted absolute difference per transaction
+        max_invoices: Largest number of invoices combined in one match
+
+    Returns:
+        list: One entry per Bank Transaction with its candidate matches
+    """
+    if isinstance(bank_transactions, str):
+        bank_transactions = json.loads(bank_transactions)
+
+    transactions = frappe.get_all(
+        "Bank Transaction",
+        filters={"name": ["in", bank_transactions], "docstatus": 1},
+        fields=["name", "company", "deposit", "unallocated_amount", "party_type", "party"],
+    )
+
+    results = []
+    for company in {transaction.company for transaction in transactions}:
+        lines = [
+            {
+                "reference": transaction.name,
+                "amount": flt(transaction.unallocated_amount or transaction.deposit),
+                "customer": transaction.party if transaction.party_type == "Customer" else None,
+            }
+            for transaction in transactions
+            if transaction.company == company and flt(transaction.deposit) > 0
+        ]
+        if lines:
+            results.extend(match_statement_lines(company, lines, tolerance, max_invoices))
+
+    return results
+
+
+@frappe.whitelist()
+def make_payment_entry_for_match(company, invoices, reference_no=None, reference_date=None):
+    """
+    Build a draft Payment Entry for matched invoices with deductions pre-filled
+
+    Args:
+        company: Company name
+        invoices: JSON list of Sales Invoice names (same customer)
+        reference_no: Bank reference of the statement line (optional)
+        reference_date: Date of the statement line (optional)
+
+    Returns:
+        dict: Unsaved Payment Entry document
+    """
+    from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+    from payment_taxes_deductions.payment_taxes_deductions.payment_entry import (
+        build_deduction_rows,
+    )
+
+    if isinstance(invoices, str):
+        invoices = json.loads(invoices)
+
+    if not invoices:
+        frappe.throw(_("Select at least one Sales Invoice"))
+
+    payment_entry = get_payment_entry("Sales Invoice", invoices[0])
+
+    other_invoices = []
+    if len(invoices) > 1:
+        other_invoices = frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", invoices[1:]], "customer": payment_entry.party},
+            fields=["name", "grand_total", "outstanding_amount", "due_date"],
+        )
+
+    for invoice in other_invoices:
+        payment_entry.append("references", {
+            "reference_doctype": "Sales Invoice",
+            "reference_name": invoice.name,
+            "due_date": invoice.due_date,
+            "total_amount": invoice.grand_total,
+            "outstanding_amount": invoice.outstanding_amount,
+            "allocated_amount": invoice.outstanding_amount,
+        })
+
+    total = sum(flt(ref.allocated_amount) for ref in payment_entry.references)
+    set_party_amount(payment_entry, total)
+    payment_entry.reference_no = reference_no
+    payment_entry.reference_date = getdate(reference_date or nowdate())
+
+    customer_group = frappe.get_cached_value("Customer", payment_entry.party, "customer_group")
+    payment_entry.custom_customer_group = customer_group
+
+    vat_20_share = flt(
+        get_reference_expectations(payment_entry.references, company, customer_group).get(
+            "vat_20_percent"
+        )
+    )
+    _net, deductions = NetAmountIndex(company).net_for(
+        total, vat_20_share, customer_group, get_deduction_exchange_rate(payment_entry)
+    )
+
+    payment_entry.set("taxes", [])
+    for row in build_deduction_rows(deductions, company, customer_group):
+        payment_entry.append("taxes", row)
+
+    return payment_entry
+
@@ -0,0 +1,290 @@
+"""
+Batch Submit
+Submit reviewed draft Payment Entries in chunks without recomputing current deductions
+
+Drafts are submitted in keyset chunks of "Batch Submit Chunk Size" entries,
+one transaction per chunk. Shared context is prepared once per company, party
+group and direction (compiled brackets, deduction profile and their rule
+version) and the invoice expectations of a whole chunk are read in one query.
+An entry whose stored fingerprint still matches its rules and inputs keeps its
+deduction rows: before_validate is told to skip the recomputation. Entries
+without a fingerprint, with stale rules or inputs, or under the cumulative
+threshold basis (which depends on running totals) are recomputed as usual.
+
+Each entry is submitted under a savepoint, so a failing entry is recorded and
+the batch goes on. Counts, failures and throughput are kept in a Deduction Job
+Checkpoint, so an interrupted run resumes after the last committed chunk.
+
+Structure:
+1. Shared Context
+2. Job
+3. API Methods
+"""
+
+import json
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    get_compiled_brackets,
+    get_content_hash,
+    get_deduction_profile,
+    get_profile_direction,
+)
+from payment_taxes_deductions.payment_taxes_deductions.deduction_fingerprint import (
+    FINGERPRINT_FIELD,
+    get_fingerprint,
+    get_rule_settings,
+    get_rule_version,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.deduction_job_checkpoint.deduction_job_checkpoint import (
+    get_checkpoint,
+    get_checkpoint_state,
+    save_checkpoint,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+    get_deduction_settings,
+)
+
+JOB_TYPE = "Batch Submit Payment Entries"
+
+DEFAULT_CHUNK_SIZE = 100
+
+# Failures kept on the checkpoint (all of them are in the Error Log)
+FAILURE_LIMIT = 500
+
+
+# ============================================================================
+# SECTION 1: SHARED CONTEXT
+# ============================================================================
+
+def get_current_rule_version(contexts, company, payment_type, party_group, settings):
+    """
+    Rule version of the current brackets, profile and settings of a profile key
+    Computed once per company, direction and party group for the whole batch
+    """
+    key = (company, payment_type, party_group or "")
+    if key not in contexts:
+        contexts[key] = get_rule_version(
+            company,
+            payment_type,
+            party_group,
+            get_compiled_brackets(company),
+            get_deduction_profile(company, party_group, payment_type),
+            get_rule_settings(settings, company),
+        )
+    return contexts[key]
+
+
+def is_fingerprint_current(doc, contexts, settings):
+    """
+    Check whether the stored deductions of a draft were computed with today's rules and inputs
+
+    Args:
+        doc: Payment Entry document
+        contexts: Rule versions per profile key (filled on first use)
+        settings: Payment Deductions Settings
+
+    Returns:
+        bool: True if before_validate would produce the same deductions
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import get_deduction_exchange_rate
+
+    stored = doc.get(FINGERPRINT_FIELD)
+    if not stored:
+        return False
+
+    # The fiscal year running total is not part of the fingerprint
+    if settings.commercial_profits_threshold_basis == "Cumulative per Fiscal Year":
+        return False
+
+    company = doc.company or frappe.defaults.get_global_default("company")
+    payment_type, party_group = get_profile_direction(doc)
+    rule_version = get_current_rule_version(contexts, company, payment_type, party_group, settings)
+    if not stored.startswith(rule_version + ":"):
+        return False
+
+    return stored == get_fingerprint(
+        rule_version, doc, party_group, payment_type, get_deduction_exchange_rate(doc)
+    )
+
+
+def prefetch_invoice_expectations(names):
+    """Read the expectations of every invoice referenced by a chunk of entries in one query"""
+    from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import get_invoice_expectation_rows
+
+    invoices = frappe.get_all(
+        "Payment Entry Reference",
+        filters={
+            "parenttype": "Payment Entry",
+            "parent": ["in", names],
+            "reference_doctype": "Sales Invoice",
+        },
+        pluck="reference_name",
+        distinct=True,
+    )
+    if invoices:
+        get_invoice_expectation_rows(invoices)
+
+
+# ============================================================================
+# SECTION 2: JOB
+# ============================================================================
+
+def submit_payment_entries(names, checkpoint_key, chunk_size=None):
+    """
+    Background job: submit draft Payment Entries in chunks
+
+    Args:
+        names: Payment Entry names, sorted
+        checkpoint_key: Key of the Deduction Job Checkpoint of this batch
+        chunk_size: Entries per transaction (defaults to the settings value)
+    """
+    checkpoint = get_checkpoint(JOB_TYPE, checkpoint_key)
+    if checkpoint.status == "Completed":
+        return
+
+    save_checkpoint(checkpoint, status="Running", error=None)
+
+    settings = get_deduction_settings()
+    chunk_size = cint(chunk_size) or cint(settings.batch_submit_chunk_size) or DEFAULT_CHUNK_SIZE
+
+    state = get_checkpoint_state(checkpoint)
+    state.setdefault("submitted", 0)
+    state.setdefault("recompute_skipped", 0)
+    state.setdefault("failed", {})
+    state.setdefault("failed_count", 0)
+    state.setdefault("elapsed_seconds", 0)
+
+    remaining = [name for name in names if name > (checkpoint.last_value or "")]
+    processed = len(names) - len(remaining)
+    contexts = {}
+
+    try:
+        for start in range(0, len(remaining), chunk_size):
+            chunk = remaining[start:start + chunk_size]
+            chunk_start = time.perf_counter()
+
+            prefetch_invoice_expectations(chunk)
+
+            for name in chunk:
+                frappe.db.savepoint("batch_submit")
+                try:
+                    doc = frappe.get_doc("Payment Entry", name)
+                    if doc.docstatus != 0:
+                        continue
+
+                    current = is_fingerprint_current(doc, contexts, settings)
+                    doc.flags.deductions_prefilled = current
+
+                    doc.submit()
+                    state["submitted"] += 1
+                    state["recompute_skipped"] += cint(current)
+                except Exception as e:
+                    frappe.db.rollback(save_point="batch_submit")
+                    state["failed_count"] += 1
+                    if len(state["failed"]) < FAILURE_LIMIT:
+                        state["failed"][name] = str(e)
+                    frappe.log_error(
+                        frappe.get_traceback(),
+                        _("Error submitting Payment Entry {0}").format(name),
+                    )
+
+            processed += len(chunk)
+            state["elapsed_seconds"] = flt(
+                state["elapsed_seconds"] + time.perf_counter() - chunk_start, 3
+            )
+            state["entries_per_second"] = flt(
+                state["submitted"] / (state["elapsed_seconds"] or 1), 2
+            )
+
+            # Commits the chunk's submissions together with the progress
+            save_checkpoint(checkpoint, last_value=chunk[-1], processed_count=processed, state=state)
+            frappe.publish_progress(
+                processed * 100 / len(names),
+                title=_("Submitting Payment Entries"),
+                description=_("{0} of {1} entries, {2} per second").format(
+                    processed, len(names), state["entries_per_second"]
+                ),
+            )
+
+        save_checkpoint(checkpoint, status="Completed")
+
+    except Exception:
+        frappe.db.rollback()
+        save_checkpoint(checkpoint, status="Failed", error=frappe.get_traceback())
+        frappe.log_error(frappe.get_traceback(), _("Error submitting Payment Entries"))
+        raise
+
+    message = _(
+        "{0} Payment Entries submitted in {1} seconds ({2} per second), {3} without recomputing deductions"
+    ).format(
+        state["submitted"], state["elapsed_seconds"], state["entries_per_second"],
+        state["recompute_skipped"],
+    )
+    if state["failed_count"]:
+        message += "<br>" + _("{0} failed, see Deduction Job Checkpoint {1}").format(
+            state["failed_count"], checkpoint.name
+        )
+    frappe.publish_realtime("msgprint", message, user=frappe.session.user)
+
+
+# ============================================================================
+# SECTION 3: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def enqueue_batch_submit(company=None, from_date=None, to_date=None, names=None, chunk_size=None):
+    """
+    Enqueue submission of draft Payment Entries
+    Either the given names or every draft of a company and period
+
+    Args:
+        company: Company name (when names is not given)
+        from_date: Period start (optional)
+        to_date: Period end (optional)
+        names: JSON list of Payment Entry names (optional)
+        chunk_size: Entries per transaction (optional)
+
+    Returns:
+        dict: checkpoint name and number of entries
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+    frappe.has_permission("Payment Entry", "submit", throw=True)
+
+    if isinstance(names, str):
+        names = json.loads(names)
+
+    filters = {"docstatus": 0}
+    if names:
+        filters["name"] = ["in", names]
+    elif company:
+        filters["company"] = company
+        if from_date and to_date:
+            filters["posting_date"] = ["between", [from_date, to_date]]
+    else:
+        frappe.throw(_("Select Payment Entries or a Company"))
+
+    # Sorted here: the job resumes by comparing names in Python
+    names = sorted(frappe.get_all("Payment Entry", filters=filters, pluck="name"))
+    if not names:
+        frappe.throw(_("No draft Payment Entries to submit"))
+
+    checkpoint_key = get_content_hash(names)
+    checkpoint = get_checkpoint(JOB_TYPE, checkpoint_key)
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.batch_submit.submit_payment_entries",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id="batch-submit-" + checkpoint.name,
+        deduplicate=True,
+        names=names,
+        checkpoint_key=checkpoint_key,
+        chunk_size=chunk_size,
+    )
+
+    return {"checkpoint": checkpoint.name, "entries": len(names)}
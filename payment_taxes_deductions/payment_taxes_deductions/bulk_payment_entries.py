@@ -0,0 +1,361 @@
+"""
+Bulk Payment Entries
+Create draft Payment Entries with deductions pre-filled from selected Sales Invoices
+
+The Sales Invoice list sends the selected names in one call, which enqueues a
+background job. The job reads every invoice in one query and groups them by
+customer; each customer gets one draft receipt referencing all its invoices.
+Deductions are computed with the shared cached engine (compiled brackets and
+deduction profiles) and the invoice expectations of a whole chunk are read at
+once, so the before_validate hook is told to keep them instead of recomputing.
+
+Drafts are inserted in chunks of CHUNK_SIZE customers, one transaction per
+chunk, with a savepoint per customer so a failing customer does not roll back
+the others. Progress is published to the user's progress bar and recorded in a
+Deduction Job Checkpoint, so an interrupted run resumes after the last chunk.
+
+Structure:
+1. Invoice Grouping
+2. Draft Payment Entry
+3. Job
+4. API Methods
+"""
+
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate, nowdate
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    evaluate_deductions,
+    get_compiled_brackets,
+    get_content_hash,
+    get_deduction_profile,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.deduction_job_checkpoint.deduction_job_checkpoint import (
+    get_checkpoint,
+    get_checkpoint_state,
+    save_checkpoint,
+)
+
+JOB_TYPE = "Bulk Payment Entries"
+
+# Customers (draft Payment Entries) per transaction
+CHUNK_SIZE = 50
+
+# Invoices accepted in one request
+MAX_INVOICES = 10000
+
+
+# ============================================================================
+# SECTION 1: INVOICE GROUPING
+# ============================================================================
+
+def get_customer_invoices(company, invoices):
+    """
+    Read the selected invoices in one query and group them by customer
+    Only submitted invoices of the company with an outstanding amount are kept
+
+    Args:
+        company: Company name
+        invoices: Sales Invoice names
+
+    Returns:
+        list: (customer, customer_group, [invoice rows]) ordered by customer
+    """
+    rows = frappe.get_all(
+        "Sales Invoice",
+        filters={
+            "name": ["in", invoices],
+            "company": company,
+            "docstatus": 1,
+            "outstanding_amount": [">", 0],
+        },
+        fields=[
+            "name", "customer", "customer_group", "grand_total",
+            "outstanding_amount", "due_date", "posting_date",
+        ],
+        order_by="customer asc, posting_date asc, name asc",
+    )
+
+    customers = {}
+    for row in rows:
+        customers.setdefault(row.customer, (row.customer_group, []))[1].append(row)
+
+    return [
+        (customer, customer_group, invoice_rows)
+        for customer, (customer_group, invoice_rows) in sorted(customers.items())
+    ]
+
+
+# ============================================================================
+# SECTION 2: DRAFT PAYMENT ENTRY
+# ============================================================================
+
+def make_customer_payment_entry(company, invoices, posting_date=None, mode_of_payment=None,
+                                reference_no=None, reference_date=None):
+    """
+    Build an unsaved receipt for the invoices of one customer
+
+    The first invoice sets up party, accounts and currency through ERPNext's
+    get_payment_entry; the others are appended from the rows already read.
+
+    Args:
+        company: Company name
+        invoices: Invoice rows of one customer (from get_customer_invoices)
+        posting_date: Posting date of the entry (defaults to today)
+        mode_of_payment: Mode of Payment (optional)
+        reference_no: Cheque / reference number (optional)
+        reference_date: Reference date (defaults to the posting date)
+
+    Returns:
+        Document: Unsaved Payment Entry
+    """
+    from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import set_party_amount
+
+    payment_entry = get_payment_entry("Sales Invoice", invoices[0].name)
+    if posting_date:
+        payment_entry.posting_date = getdate(posting_date)
+    if mode_of_payment:
+        payment_entry.mode_of_payment = mode_of_payment
+
+    for invoice in invoices[1:]:
+        payment_entry.append("references", {
+            "reference_doctype": "Sales Invoice",
+            "reference_name": invoice.name,
+            "due_date": invoice.due_date,
+            "total_amount": invoice.grand_total,
+            "outstanding_amount": invoice.outstanding_amount,
+            "allocated_amount": invoice.outstanding_amount,
+        })
+
+    # Allocated amounts are in the receivable currency, the bank side is converted
+    set_party_amount(payment_entry, sum(flt(ref.allocated_amount) for ref in payment_entry.references))
+    payment_entry.reference_no = reference_no or payment_entry.reference_no
+    payment_entry.reference_date = getdate(
+        reference_date or posting_date or payment_entry.reference_date or nowdate()
+    )
+    payment_entry.custom_customer_group = invoices[0].customer_group
+
+    prefill_deductions(payment_entry, company, invoices[0].customer_group)
+    return payment_entry
+
+
+def prefill_deductions(doc, company, customer_group):
+    """
+    Fill the taxes table of a draft receipt from the cached deduction engine
+
+    Follows the allocation mode and threshold basis of Payment Deductions
+    Settings like before_validate, then sets the clearing routing and the
+    fingerprint and flags the entry so the hook keeps the rows on insert.
+
+    Args:
+        doc: Payment Entry document
+        company: Company name
+        customer_group: Customer Group of the party
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.consolidated_posting import (
+        route_to_clearing_account,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.deduction_fingerprint import (
+        set_deduction_fingerprint,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+        get_deduction_settings,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import get_deduction_exchange_rate
+    from payment_taxes_deductions.payment_taxes_deductions.payment_entry import (
+        allocate_deductions_per_reference,
+        build_deduction_rows,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import get_reference_expectations
+
+    settings = get_deduction_settings()
+    mode = settings.deduction_allocation_mode or "Aggregate"
+    exchange_rate = get_deduction_exchange_rate(doc)
+    profile = get_deduction_profile(company, customer_group)
+
+    doc.set("taxes", [])
+    if mode == "Aggregate" or not allocate_deductions_per_reference(
+        doc, company, customer_group, mode, exchange_rate
+    ):
+        deductions = evaluate_deductions(
+            doc.paid_amount, get_compiled_brackets(company), profile, exchange_rate=exchange_rate
+        )
+        if profile.get("vat_20_percent") and profile.get("vat_tax"):
+            vat_20_share = flt(
+                get_reference_expectations(doc.references, company, customer_group).get(
+                    "vat_20_percent"
+                )
+            )
+            if vat_20_share:
+                deductions["vat_20_percent"] = vat_20_share
+
+        for row in build_deduction_rows(deductions, company, customer_group):
+            doc.append("taxes", row)
+
+    if settings.commercial_profits_threshold_basis == "Cumulative per Fiscal Year":
+        from payment_taxes_deductions.payment_taxes_deductions.running_totals import (
+            apply_cumulative_commercial_profits,
+        )
+
+        apply_cumulative_commercial_profits(doc, company, customer_group)
+
+    deduction_accounts = {
+        account for tax_type, account in profile.items() if account and tax_type != "vat_tax"
+    }
+    route_to_clearing_account(doc, company, deduction_accounts)
+    set_deduction_fingerprint(doc, company, customer_group, "Receive", exchange_rate, settings)
+
+    doc.flags.deductions_prefilled = True
+
+
+# ============================================================================
+# SECTION 3: JOB
+# ============================================================================
+
+def publish_progress(done, total):
+    # Background jobs run as the enqueuing user, who receives the progress bar
+    frappe.publish_progress(
+        done * 100 / (total or 1),
+        title=_("Creating Payment Entries"),
+        description=_("{0} of {1} customers").format(done, total),
+    )
+
+
+def create_payment_entries(company, invoices, checkpoint_key, posting_date=None,
+                           mode_of_payment=None, reference_no=None, reference_date=None):
+    """
+    Background job: create one draft Payment Entry per customer of the invoices
+
+    Args:
+        company: Company name
+        invoices: Sales Invoice names
+        checkpoint_key: Key of the Deduction Job Checkpoint of this selection
+        posting_date, mode_of_payment, reference_no, reference_date: Set on every entry
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import get_invoice_expectation_rows
+
+    checkpoint = get_checkpoint(JOB_TYPE, checkpoint_key)
+    if checkpoint.status == "Completed":
+        return
+
+    save_checkpoint(checkpoint, status="Running", error=None)
+    state = get_checkpoint_state(checkpoint)
+    created = state.setdefault("created", {})
+    failed = state.setdefault("failed", {})
+
+    customers = get_customer_invoices(company, invoices)
+    remaining = [row for row in customers if row[0] > (checkpoint.last_value or "")]
+    done = len(customers) - len(remaining)
+
+    try:
+        for start in range(0, len(remaining), CHUNK_SIZE):
+            chunk = remaining[start:start + CHUNK_SIZE]
+
+            # Expectations of the whole chunk in one read, memoized for the references
+            get_invoice_expectation_rows(
+                [invoice.name for _customer, _group, rows in chunk for invoice in rows]
+            )
+
+            for customer, _customer_group, rows in chunk:
+                frappe.db.savepoint("bulk_payment_entry")
+                try:
+                    payment_entry = make_customer_payment_entry(
+                        company, rows, posting_date, mode_of_payment, reference_no, reference_date
+                    )
+                    payment_entry.insert()
+                    created[customer] = payment_entry.name
+                except Exception as e:
+                    frappe.db.rollback(save_point="bulk_payment_entry")
+                    failed[customer] = str(e)
+                    frappe.log_error(
+                        frappe.get_traceback(),
+                        _("Error creating Payment Entry for {0}").format(customer),
+                    )
+
+            done += len(chunk)
+            # Commits the chunk's entries together with the progress
+            save_checkpoint(
+                checkpoint, last_value=chunk[-1][0], processed_count=done,
+                state={"created": created, "failed": failed},
+            )
+            publish_progress(done, len(customers))
+
+        save_checkpoint(checkpoint, status="Completed")
+
+    except Exception:
+        frappe.db.rollback()
+        save_checkpoint(checkpoint, status="Failed", error=frappe.get_traceback())
+        frappe.log_error(frappe.get_traceback(), _("Error creating Payment Entries"))
+        raise
+
+    message = _("{0} draft Payment Entries created").format(len(created))
+    if failed:
+        message += "<br>" + _("Failed for {0} customers: {1}").format(
+            len(failed), ", ".join(failed)
+        )
+    frappe.publish_realtime("msgprint", message, user=frappe.session.user)
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def enqueue_payment_entries_from_invoices(invoices, posting_date=None, mode_of_payment=None,
+                                          reference_no=None, reference_date=None):
+    """
+    Enqueue draft Payment Entries for selected Sales Invoices, one per customer
+    Selecting the same invoices again resumes the interrupted run
+
+    Args:
+        invoices: JSON list of Sales Invoice names (one company)
+        posting_date: Posting date of the entries (optional)
+        mode_of_payment: Mode of Payment (optional)
+        reference_no: Cheque / reference number (optional)
+        reference_date: Reference date (optional)
+
+    Returns:
+        str: Name of the Deduction Job Checkpoint tracking progress
+    """
+    frappe.only_for(["System Manager", "Accounts Manager", "Accounts User"])
+    frappe.has_permission("Payment Entry", "create", throw=True)
+
+    if isinstance(invoices, str):
+        invoices = json.loads(invoices)
+
+    invoices = sorted(set(invoices or []))
+    if not invoices:
+        frappe.throw(_("Select at least one Sales Invoice"))
+    if len(invoices) > MAX_INVOICES:
+        frappe.throw(_("Select at most {0} Sales Invoices").format(MAX_INVOICES))
+
+    companies = frappe.get_all(
+        "Sales Invoice", filters={"name": ["in", invoices]}, pluck="company", distinct=True
+    )
+    if len(companies) != 1:
+        frappe.throw(_("Select Sales Invoices of a single company"))
+
+    checkpoint_key = get_content_hash([invoices, posting_date, mode_of_payment, reference_no])
+    checkpoint = get_checkpoint(JOB_TYPE, checkpoint_key)
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.bulk_payment_entries.create_payment_entries",
+        queue="long",
+        timeout=2 * 60 * 60,
+        job_id="bulk-payment-entries-" + checkpoint.name,
+        deduplicate=True,
+        company=companies[0],
+        invoices=invoices,
+        checkpoint_key=checkpoint_key,
+        posting_date=posting_date,
+        mode_of_payment=mode_of_payment,
+        reference_no=reference_no,
+        reference_date=reference_date,
+    )
+
+    return checkpoint.name
@@ -0,0 +1,268 @@
+"""
+Deduction Config Cache
+Bounded in-process LRU in front of the shared deduction cache
+
+get_tax_account and get_stamp_tax_rule are called several times per Payment
+Entry save. Their profiles and bracket tables are kept in the worker in an LRU
+of at most "deduction_config_cache_size" entries (site config, default 2048),
+keyed by site, company and party group, so memory per worker stays bounded
+however many sites and companies share the bench. Least recently used entries
+are evicted; misses load from the shared cache (redis), which loads from the
+database.
+
+Records use __slots__ instead of dicts: a profile is one slot per tax type,
+a bracket table keeps its lookup lists and one slot record per range.
+
+Entries are stamped with the site's configuration version, which
+clear_deduction_cache changes on every configuration save, so other workers
+drop stale entries on their next lookup. The version itself is read from
+redis at most once per CONFIG_VERSION_TTL per site and worker, not once per
+request: a long background job would otherwise keep the version of its
+start. Companies and groups without
+configuration are cached as empty records, so a misconfigured company costs
+no query per save.
+
+Structure:
+1. Records
+2. LRU
+3. Lookups
+4. API Methods
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import frappe
+from frappe.utils import cint
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    BRACKET_FIELDS,
+    TAX_ACCOUNT_FIELDS,
+    get_compiled_brackets,
+    get_deduction_profile,
+    get_profile_cache_key,
+)
+
+# Shared cache key changed whenever deduction configuration changes
+CONFIG_VERSION_KEY = "payment_deductions_config_version"
+
+DEFAULT_MAX_ENTRIES = 2048
+
+# Seconds a worker reuses the configuration version read from redis
+CONFIG_VERSION_TTL = 1.0
+
+
+# ============================================================================
+# SECTION 1: RECORDS
+# ============================================================================
+
+class ProfileRecord:
+    """Account names of a deduction profile, one slot per tax type"""
+
+    __slots__ = TAX_ACCOUNT_FIELDS
+
+    def __init__(self, profile):
+        for tax_type in TAX_ACCOUNT_FIELDS:
+            setattr(self, tax_type, profile.get(tax_type) or "")
+
+    def get(self, tax_type, default=None):
+        return getattr(self, tax_type, default)
+
+    def __bool__(self):
+        # False for the "no config" marker of a company or group without a profile
+        return any(getattr(self, tax_type) for tax_type in TAX_ACCOUNT_FIELDS)
+
+
+class BracketRule:
+    """
+    One Stamp Tax Range of a compiled bracket table
+    Supports rule["field"] and rule.get("field") like the compiled dict rules
+    """
+
+    __slots__ = BRACKET_FIELDS
+
+    def __init__(self, rule):
+        for field in BRACKET_FIELDS:
+            setattr(self, field, rule[field])
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in BRACKET_FIELDS}
+
+
+class BracketTable:
+    """Compiled bracket index of a company, readable by deduction_engine.find_bracket"""
+
+    __slots__ = ("order", "reach", "rules", "starts")
+
+    def __init__(self, brackets):
+        self.starts = tuple(brackets.get("starts") or ())
+        self.reach = tuple(brackets.get("reach") or ())
+        self.order = tuple(brackets.get("order") or ())
+        self.rules = tuple(BracketRule(rule) for rule in brackets.get("rules") or ())
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __bool__(self):
+        return bool(self.starts)
+
+
+class _Entry:
+    __slots__ = ("value", "version")
+
+    def __init__(self, value, version):
+        self.value = value
+        self.version = version
+
+
+# ============================================================================
+# SECTION 2: LRU
+# ============================================================================
+
+class ConfigLRU:
+    """Thread-safe LRU of config records with hit, miss, stale and eviction counters"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, key, version, loader):
+        """
+        Get a record, loading it on a miss or when its version is outdated
+
+        Args:
+            key: Tuple starting with the site
+            version: Current configuration version of the site
+            loader: Function returning the record
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.version == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if entry is not None:
+                self.stale += 1
+            self.misses += 1
+
+        # Load outside the lock, a concurrent miss on the same key only loads twice
+        value = loader()
+
+        with self.lock:
+            self.entries[key] = _Entry(value, version)
+            self.entries.move_to_end(key)
+            max_entries = get_max_entries()
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": get_max_entries(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                # Cached "no config" markers (profiles and bracket tables that are empty)
+                "no_config": sum(1 for entry in self.entries.values() if not entry.value),
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+            }
+
+
+_config_cache = ConfigLRU()
+
+# site -> (version, monotonic time it was read)
+_config_versions = {}
+
+
+def get_max_entries():
+    return cint(frappe.conf.get("deduction_config_cache_size")) or DEFAULT_MAX_ENTRIES
+
+
+def get_config_version():
+    site = frappe.local.site
+    now = time.monotonic()
+    cached = _config_versions.get(site)
+    if cached and now - cached[1] < CONFIG_VERSION_TTL:
+        return cached[0]
+
+    # Not the request memo of frappe.cache(), which a job keeps for its whole run
+    version = frappe.cache().get_value(CONFIG_VERSION_KEY, use_local_cache=False) or ""
+    _config_versions[site] = (version, now)
+    return version
+
+
+def bump_config_version():
+    """Invalidate the in-process entries of this site in every worker"""
+    version = frappe.generate_hash(length=10)
+    frappe.cache().set_value(CONFIG_VERSION_KEY, version)
+    # This worker sees its own change at once
+    _config_versions[frappe.local.site] = (version, time.monotonic())
+
+
+# ============================================================================
+# SECTION 3: LOOKUPS
+# ============================================================================
+
+def get_profile_record(company, customer_group=None, payment_type="Receive"):
+    """
+    Deduction profile of a company and party group from the worker LRU
+
+    Returns:
+        ProfileRecord: account per tax type ("" when not configured)
+    """
+    return _config_cache.get(
+        ("profile", frappe.local.site, get_profile_cache_key(company, customer_group, payment_type)),
+        get_config_version(),
+        lambda: ProfileRecord(get_deduction_profile(company, customer_group, payment_type)),
+    )
+
+
+def get_bracket_table(company):
+    """
+    Compiled bracket table of a company from the worker LRU
+
+    Returns:
+        BracketTable: empty (falsy) when the company has no rules
+    """
+    return _config_cache.get(
+        ("brackets", frappe.local.site, company),
+        get_config_version(),
+        lambda: BracketTable(get_compiled_brackets(company)),
+    )
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def get_config_cache_stats():
+    """
+    Counters of the config LRU in the worker serving this request
+
+    Returns:
+        dict: entries, max_entries, hits, misses, stale, evictions, no_config, hit_ratio
+    """
+    frappe.only_for("System Manager")
+    return _config_cache.get_stats()
@@ -0,0 +1,224 @@
+"""
+Consolidated Deductions
+Group-level withholding totals across the companies of a site
+
+Each company is aggregated by one query over its submitted Payment Entry
+deduction rows (Advance Taxes and Charges in company currency), classified by
+tax type through the company's Payment Deductions Accounts profiles. Rows
+routed to a clearing account are classified by their real account.
+
+Companies are aggregated in parallel threads, each with its own site context
+and database connection, so the total time is close to that of the slowest
+company. Aggregation reads from the read replica when one is configured. The merged totals are converted to one presentation currency with
+the rate on the period end date.
+
+Structure:
+1. Per-Company Aggregation
+2. Parallel Fan-Out
+3. Merge and Currency
+4. API Methods
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    get_account_tax_types,
+)
+
+# Threads (database connections) opened for one consolidation
+MAX_WORKERS = 8
+
+
+# ============================================================================
+# SECTION 1: PER-COMPANY AGGREGATION
+# ============================================================================
+
+@frappe.read_only()
+def aggregate_company(company, from_date, to_date):
+    """
+    Deduction totals of one company in company currency
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+
+    Returns:
+        dict: company, currency, totals {(payment_type, tax_type): amount}, duration_ms
+    """
+    start = time.perf_counter()
+    account_tax_types = get_account_tax_types(company)
+
+    rows = frappe.db.sql(
+        """
+        select pe.payment_type,
+            coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head) as account,
+            sum(tax.base_tax_amount) as amount
+        from `tabAdvance Taxes and Charges` tax
+        inner join `tabPayment Entry` pe on pe.name = tax.parent
+        where tax.parenttype = 'Payment Entry'
+            and tax.add_deduct_tax = 'Deduct'
+            and pe.docstatus = 1
+            and pe.company = %(company)s
+            and pe.posting_date between %(from_date)s and %(to_date)s
+        group by pe.payment_type, account
+        """,
+        {"company": company, "from_date": from_date, "to_date": to_date},
+        as_dict=True,
+    )
+
+    totals = {}
+    for row in rows:
+        tax_type = account_tax_types.get(row.account)
+        if not tax_type:
+            continue
+        key = (row.payment_type, tax_type)
+        totals[key] = totals.get(key, 0) + flt(row.amount)
+
+    return {
+        "company": company,
+        "currency": frappe.get_cached_value("Company", company, "default_currency"),
+        "totals": totals,
+        "duration_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+# ============================================================================
+# SECTION 2: PARALLEL FAN-OUT
+# ============================================================================
+
+def _aggregate_in_thread(site, sites_path, user, company, from_date, to_date):
+    # frappe.local is per thread: each worker opens its own site context and connection
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    try:
+        frappe.set_user(user)
+        return aggregate_company(company, from_date, to_date)
+    finally:
+        frappe.destroy()
+
+
+def aggregate_companies(companies, from_date, to_date):
+    """
+    Aggregate several companies in parallel threads
+
+    Returns:
+        list: aggregate_company results in the order of companies
+    """
+    if len(companies) <= 1:
+        return [aggregate_company(company, from_date, to_date) for company in companies]
+
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+    with ThreadPoolExecutor(max_workers=min(len(companies), MAX_WORKERS)) as pool:
+        futures = [
+            pool.submit(_aggregate_in_thread, site, sites_path, user, company, from_date, to_date)
+            for company in companies
+        ]
+        return [future.result() for future in futures]
+
+
+# ============================================================================
+# SECTION 3: MERGE AND CURRENCY
+# ============================================================================
+
+def get_consolidation(from_date, to_date, companies=None, presentation_currency=None):
+    """
+    Consolidated deduction totals of several companies
+
+    Args:
+        from_date: Period start
+        to_date: Period end
+        companies: Company names (defaults to every company the user can read)
+        presentation_currency: Currency of the group view (defaults to the
+            currency of the default company)
+
+    Returns:
+        dict: currency, companies (currency, rate, duration_ms),
+            rows {(payment_type, tax_type): {company: amount}}, elapsed_ms
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import get_exchange_rate
+
+    start = time.perf_counter()
+
+    # get_list applies the user's Company permissions
+    readable = frappe.get_list("Company", pluck="name", order_by="name asc")
+    companies = [company for company in (companies or readable) if company in readable]
+    if not companies:
+        frappe.throw(_("No Company to consolidate"))
+
+    presentation_currency = presentation_currency or frappe.get_cached_value(
+        "Company",
+        frappe.defaults.get_user_default("Company") or companies[0],
+        "default_currency",
+    )
+
+    results = aggregate_companies(companies, from_date, to_date)
+
+    company_info = {}
+    rows = {}
+    for result in results:
+        rate = get_exchange_rate(result["currency"], presentation_currency, to_date)
+        company_info[result["company"]] = {
+            "currency": result["currency"],
+            "rate": rate,
+            "duration_ms": flt(result["duration_ms"], 1),
+        }
+        for key, amount in result["totals"].items():
+            rows.setdefault(key, {})[result["company"]] = amount * rate
+
+    return {
+        "currency": presentation_currency,
+        "companies": company_info,
+        "rows": rows,
+        "elapsed_ms": flt((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+@frappe.read_only()
+def get_consolidated_deductions(from_date, to_date, companies=None, presentation_currency=None):
+    """
+    Consolidated deductions per payment type and tax type across companies
+
+    Args:
+        from_date: Period start
+        to_date: Period end
+        companies: JSON list of companies (optional, defaults to all readable companies)
+        presentation_currency: Currency of the totals (optional)
+
+    Returns:
+        dict: currency, per-company timing and rate, and rows with per-company and total amounts
+    """
+    frappe.only_for(["System Manager", "Accounts Manager", "Accounts User"])
+
+    companies = frappe.parse_json(companies) if companies else None
+
+    try:
+        consolidation = get_consolidation(from_date, to_date, companies, presentation_currency)
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), _("Error consolidating deductions"))
+        frappe.throw(_("Error consolidating deductions: {0}").format(str(e)))
+
+    return {
+        "currency": consolidation["currency"],
+        "companies": consolidation["companies"],
+        "elapsed_ms": consolidation["elapsed_ms"],
+        "rows": [
+            {
+                "payment_type": payment_type,
+                "tax_type": tax_type,
+                "companies": amounts,
+                "total": sum(amounts.values()),
+            }
+            for (payment_type, tax_type), amounts in sorted(consolidation["rows"].items())
+        ],
+    }
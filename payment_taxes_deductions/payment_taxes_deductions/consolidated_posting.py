@@ -0,0 +1,238 @@
+"""
+Consolidated Deduction Posting
+Post deductions of many Payment Entries as one Journal Entry per day
+
+When "Consolidate Deduction Postings" is enabled in Payment Deductions
+Settings, deduction rows of each Payment Entry are posted to the company
+clearing account (the real account is kept in custom_deduction_account). A
+daily job then posts one Journal Entry per company x deduction account x day
+moving the amount from the clearing account to the deduction account. Receipts
+withhold into the clearing account (debit) and payments to suppliers withhold
+out of it (credit), so payment deductions move back the other way.
+
+The job posts the difference between what submitted Payment Entries withheld
+and what consolidated Journal Entries already posted, so running it again is a
+no-op and a cancelled Payment Entry is reversed by the next run.
+
+Structure:
+1. Payment Entry Routing
+2. Consolidation Job
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt, now_datetime
+
+from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+    get_clearing_account,
+    get_deduction_settings,
+)
+
+# ============================================================================
+# SECTION 1: PAYMENT ENTRY ROUTING
+# ============================================================================
+
+def restore_deduction_accounts(doc):
+    """
+    Put the real deduction accounts back on rows routed to the clearing account
+    Called before deductions are recalculated so rows are matched by account
+
+    Args:
+        doc: Payment Entry document
+    """
+    for tax in doc.get("taxes") or []:
+        if tax.get("custom_deduction_account"):
+            tax.account_head = tax.custom_deduction_account
+            tax.custom_deduction_account = None
+
+
+def route_to_clearing_account(doc, company, deduction_accounts):
+    """
+    Post deduction rows of a Payment Entry to the company clearing account
+
+    Args:
+        doc: Payment Entry document
+        company: Company name
+        deduction_accounts: Accounts of the deduction profile
+    """
+    settings = get_deduction_settings()
+    if not settings.consolidate_deduction_postings:
+        return
+
+    clearing_account = get_clearing_account(company)
+    if not clearing_account:
+        return
+
+    for tax in doc.get("taxes") or []:
+        if tax.add_deduct_tax == "Deduct" and tax.account_head in deduction_accounts:
+            tax.custom_deduction_account = tax.account_head
+            tax.account_head = clearing_account
+
+
+# ============================================================================
+# SECTION 2: CONSOLIDATION JOB
+# ============================================================================
+
+def post_consolidated_deductions():
+    """
+    Scheduled job: post consolidated deduction Journal Entries
+
+    Only days touched by Payment Entries modified since the last run are
+    recomputed, so the job stays cheap on large ledgers.
+    """
+    settings = get_deduction_settings()
+    if not settings.consolidate_deduction_postings:
+        return
+
+    run_started = now_datetime()
+    for row in settings.clearing_accounts:
+        consolidate_company(row.company, row.clearing_account, settings.last_consolidation_run)
+
+    frappe.db.set_single_value(
+        "Payment Deductions Settings", "last_consolidation_run", run_started
+    )
+
+
+@frappe.whitelist()
+def run_consolidation(full=0):
+    """
+    Run the consolidation on demand
+    With full=1 every day is recomputed, e.g. after a consolidated Journal Entry was cancelled
+
+    Args:
+        full: Recompute all days instead of days modified since the last run
+    """
+    frappe.only_for("System Manager")
+
+    settings = get_deduction_settings()
+    if not settings.consolidate_deduction_postings:
+        frappe.throw(_("Consolidate Deduction Postings is not enabled"))
+
+    count = 0
+    since = None if frappe.utils.cint(full) else settings.last_consolidation_run
+    for row in settings.clearing_accounts:
+        count += consolidate_company(row.company, row.clearing_account, since)
+
+    return count
+
+
+def consolidate_company(company, clearing_account, since=None):
+    """
+    Post the missing consolidated amounts of one company
+
+    Args:
+        company: Company name
+        clearing_account: Clearing account of the company
+        since: Only recompute days of Payment Entries modified after this datetime
+
+    Returns:
+        int: Number of Journal Entries posted
+    """
+    days_condition = ""
+    if since:
+        days_condition = """
+            and pe.posting_date in (
+                select distinct posting_date from `tabPayment Entry`
+                where company = %(company)s and modified >= %(since)s
+            )"""
+
+    # Deduct rows of receipts debit the clearing account, those of payments
+    # (Pay, Internal Transfer) credit it: payments move the other way
+    withheld = frappe.db.sql(
+        f"""
+        select pe.posting_date, tax.custom_deduction_account as account,
+            sum(if(pe.payment_type = 'Receive', tax.base_tax_amount, -tax.base_tax_amount)) as amount
+        from `tabAdvance Taxes and Charges` tax
+        inner join `tabPayment Entry` pe on pe.name = tax.parent
+        where tax.parenttype = 'Payment Entry'
+            and pe.company = %(company)s
+            and pe.docstatus = 1
+            and tax.account_head = %(clearing_account)s
+            and ifnull(tax.custom_deduction_account, '') != ''
+            {days_condition}
+        group by pe.posting_date, tax.custom_deduction_account
+        """,
+        {"company": company, "clearing_account": clearing_account, "since": since},
+        as_dict=True,
+    )
+
+    posted = frappe.db.sql(
+        """
+        select je.posting_date, je.custom_deduction_account as account,
+            sum(jea.debit - jea.credit) as amount
+        from `tabJournal Entry` je
+        inner join `tabJournal Entry Account` jea
+            on jea.parent = je.name and jea.account = je.custom_deduction_account
+        where je.company = %(company)s
+            and je.docstatus = 1
+            and ifnull(je.custom_deduction_account, '') != ''
+            {days_condition}
+        group by je.posting_date, je.custom_deduction_account
+        """.format(days_condition=days_condition.replace("pe.posting_date", "je.posting_date")),
+        {"company": company, "since": since},
+        as_dict=True,
+    )
+
+    balances = {}
+    for row in withheld:
+        balances[(row.posting_date, row.account)] = flt(row.amount)
+    for row in posted:
+        key = (row.posting_date, row.account)
+        balances[key] = balances.get(key, 0) - flt(row.amount)
+
+    precision = frappe.get_precision("Journal Entry Account", "debit")
+    cost_center = frappe.get_cached_value("Company", company, "cost_center")
+
+    count = 0
+    for (posting_date, account), difference in sorted(balances.items()):
+        difference = flt(difference, precision)
+        if not difference:
+            continue
+
+        make_consolidation_entry(
+            company, posting_date, account, clearing_account, difference, cost_center
+        )
+        count += 1
+
+    frappe.db.commit()
+    return count
+
+
+def make_consolidation_entry(company, posting_date, account, clearing_account, amount, cost_center):
+    """
+    Post one consolidated Journal Entry (reversing when amount is negative)
+
+    Args:
+        company: Company name
+        posting_date: Day being consolidated
+        account: Deduction account
+        clearing_account: Clearing account of the company
+        amount: Debit to move from clearing to deduction account (negative: credit)
+        cost_center: Company cost center
+    """
+    debit_account, credit_account = account, clearing_account
+    if amount < 0:
+        debit_account, credit_account = clearing_account, account
+
+    journal_entry = frappe.new_doc("Journal Entry")
+    journal_entry.update({
+        "voucher_type": "Journal Entry",
+        "company": company,
+        "posting_date": posting_date,
+        "custom_deduction_account": account,
+        "user_remark": _("Consolidated deductions of {0} for {1}").format(account, posting_date),
+    })
+    journal_entry.append("accounts", {
+        "account": debit_account,
+        "debit_in_account_currency": abs(amount),
+        "cost_center": cost_center,
+    })
+    journal_entry.append("accounts", {
+        "account": credit_account,
+        "credit_in_account_currency": abs(amount),
+        "cost_center": cost_center,
+    })
+    journal_entry.flags.ignore_permissions = True
+    journal_entry.insert()
+    journal_entry.submit()
+    return journal_entry
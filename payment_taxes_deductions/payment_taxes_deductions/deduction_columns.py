@@ -0,0 +1,582 @@
+"""
+Deduction Columns
+Columnar archive of submitted deductions per company and month
+
+A nightly job appends the deduction rows of Payment Entries submitted (or
+cancelled) since its last run to one directory per company and month under
+private/deduction_columns. Each column is a raw little-endian binary file of a
+fixed dtype; parties, party groups, accounts and stamp brackets are
+dictionary-encoded in meta.json, which also holds the committed row count.
+Every deduction row carries the base paid amount of its entry and the stamp
+bracket matching it in the company's current rules, so what-if runs can
+re-evaluate brackets without reading Payment Entries. Queries open the columns with numpy.memmap,
+so aggregating a month reads the mapped pages directly without loading rows
+into Python objects.
+
+Appending is crash safe: columns are first cut back to the committed row count,
+the new rows are written and synced, then meta.json is replaced atomically.
+Readers only map the committed rows, so a half-written append is never seen.
+
+The archive is append-only: a cancelled entry that was already archived gets
+reversal rows (its archived rows with negative amount and sign -1) in the same
+month, so sums stay correct without rewriting files. Deduction rows are read
+from the read replica when one is configured, starting an overlap before the
+mark (read_replica.get_read_from); entries already archived are skipped.
+
+Structure:
+1. Storage
+2. Archive Job
+3. Queries
+4. API Methods
+"""
+
+import json
+import os
+
+import frappe
+import numpy as np
+from frappe import _
+from frappe.utils import add_months, cint, flt, get_first_day, getdate
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    OPEN_RANGE_LIMIT,
+    TAX_ACCOUNT_FIELDS,
+    find_bracket,
+    get_account_tax_types,
+    get_compiled_brackets,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.deduction_job_checkpoint.deduction_job_checkpoint import (
+    get_checkpoint,
+    save_checkpoint,
+)
+from payment_taxes_deductions.payment_taxes_deductions.read_replica import (
+    get_read_from,
+    replica_connection,
+)
+
+JOB_TYPE = "Deduction Columns"
+
+CHUNK_SIZE = 20000
+
+PAYMENT_TYPES = ("Receive", "Pay")
+
+# Column name -> dtype of its file; codes index PAYMENT_TYPES, TAX_ACCOUNT_FIELDS
+# and the parties/party_groups/accounts/brackets lists of meta.json
+COLUMNS = {
+    "payment_entry": "S64",
+    "posting_date": "<M8[D]",
+    "payment_type": "<i1",
+    "party": "<i4",
+    "party_group": "<i4",
+    "tax_type": "<i1",
+    "account": "<i4",
+    "paid_amount": "<f8",
+    "bracket": "<i4",
+    "amount": "<f8",
+    "sign": "<i1",
+}
+
+# Dictionaries of meta.json
+META_LISTS = ("parties", "party_groups", "accounts", "brackets")
+
+# Bracket code of a paid amount no stamp bracket covers
+NO_BRACKET = -1
+
+GROUP_BY_FIELDS = (
+    "tax_type", "account", "party", "party_group", "bracket", "posting_date", "payment_type",
+)
+
+
+# ============================================================================
+# SECTION 1: STORAGE
+# ============================================================================
+
+def get_archive_folder(company=None):
+    folder = frappe.get_site_path("private", "deduction_columns")
+    if company:
+        folder = os.path.join(folder, frappe.scrub(company))
+    return folder
+
+
+def get_month_folder(company, month):
+    return os.path.join(get_archive_folder(company), month)
+
+
+def read_meta(folder):
+    path = os.path.join(folder, "meta.json")
+    if not os.path.exists(path):
+        return {"rows": 0, **{name: [] for name in META_LISTS}}
+    with open(path) as meta_file:
+        return json.load(meta_file)
+
+
+def write_meta(folder, meta):
+    path = os.path.join(folder, "meta.json")
+    with open(path + ".tmp", "w") as meta_file:
+        json.dump(meta, meta_file, separators=(",", ":"), ensure_ascii=False)
+        meta_file.flush()
+        os.fsync(meta_file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def append_rows(folder, meta, columns):
+    """
+    Append rows to the column files of a month and commit them in meta.json
+
+    Args:
+        folder: Month folder
+        meta: Current meta of the month (rows and META_LISTS), updated in place
+        columns: Column name -> numpy array, all of the same length
+    """
+    count = len(columns["amount"])
+    if not count:
+        return
+
+    os.makedirs(folder, exist_ok=True)
+    for name, dtype in COLUMNS.items():
+        values = np.ascontiguousarray(columns[name], dtype=dtype)
+        path = os.path.join(folder, name + ".bin")
+        with open(path, "ab") as column_file:
+            # Drop bytes of an append that never reached meta.json
+            column_file.truncate(meta["rows"] * values.itemsize)
+            column_file.write(values.tobytes())
+            column_file.flush()
+            os.fsync(column_file.fileno())
+
+    meta["rows"] += count
+    write_meta(folder, meta)
+
+
+def load_month(company, month):
+    """
+    Memory-mapped columns of one company and month (read-only, zero-copy)
+
+    Args:
+        company: Company name
+        month: Month as YYYY-MM
+
+    Returns:
+        dict: rows, columns (name -> numpy.memmap) and the META_LISTS dictionaries
+    """
+    folder = get_month_folder(company, month)
+    meta = read_meta(folder)
+    rows = cint(meta["rows"])
+
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        if rows:
+            columns[name] = np.memmap(
+                os.path.join(folder, name + ".bin"), dtype=dtype, mode="r", shape=(rows,)
+            )
+        else:
+            # memmap cannot map an empty file
+            columns[name] = np.empty(0, dtype=dtype)
+
+    return frappe._dict(rows=rows, columns=columns, **{name: meta[name] for name in META_LISTS})
+
+
+def get_archived_entries(data):
+    """
+    Payment Entries already archived in a month
+
+    Args:
+        data: Month from load_month()
+
+    Returns:
+        tuple: (submitted names, reversed names)
+    """
+    names = data.columns["payment_entry"]
+    signs = data.columns["sign"]
+    return (
+        {name.decode() for name in np.unique(names[signs == 1])},
+        {name.decode() for name in np.unique(names[signs == -1])},
+    )
+
+
+def get_reversal_columns(data, names):
+    """
+    Reversal of the archived rows of cancelled Payment Entries
+
+    The archived rows are copied with the amount negated, so a reversal always
+    matches what was archived even if the configuration changed since.
+
+    Args:
+        data: Month from load_month()
+        names: Cancelled Payment Entry names
+
+    Returns:
+        dict: column name -> numpy array
+    """
+    columns = data.columns
+    mask = np.isin(columns["payment_entry"], [name.encode() for name in names])
+    mask &= columns["sign"] == 1
+
+    reversal = {name: np.array(values[mask]) for name, values in columns.items()}
+    reversal["amount"] = -reversal["amount"]
+    reversal["sign"] = np.full(len(reversal["sign"]), -1, dtype=COLUMNS["sign"])
+    return reversal
+
+
+# ============================================================================
+# SECTION 2: ARCHIVE JOB
+# ============================================================================
+
+def read_deduction_rows(company, since, db=None):
+    """
+    Read deduction rows of Payment Entries submitted or cancelled after a high-water mark
+
+    Rows are read in keyset chunks on (modified, name).
+
+    Args:
+        company: Company name
+        since: High-water mark (Payment Entry.modified), None for everything; the
+            read starts the overlap of get_read_from before it
+        db: Connection to read from (defaults to frappe.db)
+
+    Returns:
+        tuple: ({payment_entry: [rows]}, highest modified seen)
+    """
+    db = db or frappe.db
+    entries = {}
+    last_modified, last_name = get_read_from(since) or "1900-01-01", ""
+    highest = since
+
+    while True:
+        chunk = db.sql(
+            """
+            select pe.name, pe.modified, pe.docstatus, pe.posting_date, pe.payment_type,
+                pe.party_type, pe.party, pe.base_paid_amount,
+                coalesce(
+                    nullif(case when pe.party_type = 'Supplier' then pe.custom_supplier_group
+                        else pe.custom_customer_group end, ''),
+                    customer.customer_group, supplier.supplier_group, ''
+                ) as party_group,
+                coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head) as account,
+                tax.base_tax_amount as amount
+            from `tabPayment Entry` pe
+            inner join `tabAdvance Taxes and Charges` tax
+                on tax.parent = pe.name and tax.parenttype = 'Payment Entry'
+            left join `tabCustomer` customer
+                on pe.party_type = 'Customer' and customer.name = pe.party
+            left join `tabSupplier` supplier
+                on pe.party_type = 'Supplier' and supplier.name = pe.party
+            where pe.company = %(company)s
+                and pe.docstatus in (1, 2)
+                and tax.add_deduct_tax = 'Deduct'
+                and (pe.modified > %(last_modified)s
+                    or (pe.modified = %(last_modified)s and pe.name > %(last_name)s))
+            order by pe.modified, pe.name
+            limit %(limit)s
+            """,
+            {
+                "company": company,
+                "last_modified": last_modified,
+                "last_name": last_name,
+                "limit": CHUNK_SIZE,
+            },
+            as_dict=True,
+        )
+
+        # Re-read a Payment Entry whose tax rows were cut by the limit
+        has_more = len(chunk) == CHUNK_SIZE
+        if has_more:
+            cut = chunk[-1].name
+            chunk = [row for row in chunk if row.name != cut] or chunk
+
+        for row in chunk:
+            entries.setdefault(row.name, []).append(row)
+            if highest is None or str(row.modified) > str(highest):
+                highest = str(row.modified)
+
+        if not has_more:
+            break
+
+        last_modified, last_name = str(chunk[-1].modified), chunk[-1].name
+
+    return entries, highest
+
+
+def get_bracket_key(brackets, paid_amount):
+    """(from_amount, to_amount) of the stamp bracket covering a paid amount, None if none does"""
+    rule = find_bracket(brackets, paid_amount)
+    return (rule["from_amount"], rule["to_amount"]) if rule else None
+
+
+def build_month_columns(rows, meta, account_tax_types, brackets=None):
+    """
+    Encode new deduction rows of one month into column arrays
+
+    Args:
+        rows: Deduction rows from read_deduction_rows()
+        meta: Meta of the month; new parties, party groups, accounts and brackets
+            are added to its dictionaries
+        account_tax_types: account -> tax_type of the company
+        brackets: Compiled bracket index of the company (optional)
+
+    Returns:
+        dict: column name -> numpy array
+    """
+    parties = {tuple(party): code for code, party in enumerate(meta["parties"])}
+    party_groups = {group: code for code, group in enumerate(meta["party_groups"])}
+    accounts = {account: code for code, account in enumerate(meta["accounts"])}
+    bracket_codes = {tuple(bracket): code for code, bracket in enumerate(meta["brackets"])}
+
+    def encode(codes, values, key):
+        if key not in codes:
+            codes[key] = len(values)
+            values.append(list(key) if isinstance(key, tuple) else key)
+        return codes[key]
+
+    # Rows of one entry share its paid amount: look its bracket up once
+    entry_brackets = {}
+
+    columns = {name: [] for name in COLUMNS}
+    for row in rows:
+        if row.name not in entry_brackets:
+            bracket = get_bracket_key(brackets, row.base_paid_amount)
+            entry_brackets[row.name] = (
+                encode(bracket_codes, meta["brackets"], bracket) if bracket else NO_BRACKET
+            )
+
+        columns["payment_entry"].append(row.name.encode())
+        columns["posting_date"].append(str(row.posting_date))
+        columns["payment_type"].append(PAYMENT_TYPES.index(row.payment_type))
+        columns["party"].append(encode(parties, meta["parties"], (row.party_type, row.party)))
+        columns["party_group"].append(encode(party_groups, meta["party_groups"], row.party_group or ""))
+        columns["tax_type"].append(TAX_ACCOUNT_FIELDS.index(account_tax_types[row.account]))
+        columns["account"].append(encode(accounts, meta["accounts"], row.account))
+        columns["paid_amount"].append(flt(row.base_paid_amount))
+        columns["bracket"].append(entry_brackets[row.name])
+        columns["amount"].append(flt(row.amount))
+        columns["sign"].append(1)
+
+    return {name: np.array(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+
+
+def archive_company(company, rebuild=False):
+    """
+    Append deductions submitted or cancelled since the last run of a company
+
+    Args:
+        company: Company name
+        rebuild: Drop the archive of the company and read everything again
+
+    Returns:
+        int: Rows appended
+    """
+    import shutil
+
+    checkpoint = get_checkpoint(JOB_TYPE, company)
+    if rebuild:
+        shutil.rmtree(get_archive_folder(company), ignore_errors=True)
+        save_checkpoint(checkpoint, last_value=None, processed_count=0)
+
+    account_tax_types = get_account_tax_types(company)
+    if not account_tax_types:
+        return 0
+    brackets = get_compiled_brackets(company)
+
+    save_checkpoint(checkpoint, status="Running", error=None)
+    try:
+        with replica_connection() as db:
+            entries, highest = read_deduction_rows(company, checkpoint.last_value, db)
+
+        # Per month: rows of newly submitted entries and names of cancelled ones
+        months = {}
+        for name, rows in entries.items():
+            if rows[0].payment_type not in PAYMENT_TYPES:
+                continue
+            month = months.setdefault(
+                getdate(rows[0].posting_date).strftime("%Y-%m"), {"rows": [], "cancelled": []}
+            )
+            if rows[0].docstatus == 1:
+                month["rows"].extend(row for row in rows if row.account in account_tax_types)
+            else:
+                month["cancelled"].append(name)
+
+        appended = 0
+        for month, pending in sorted(months.items()):
+            data = load_month(company, month)
+            submitted, reversed_ = get_archived_entries(data)
+
+            # Entries seen again after an earlier run (modified after submit) are skipped
+            new_rows = [row for row in pending["rows"] if row.name not in submitted]
+            cancelled = [
+                name for name in pending["cancelled"] if name in submitted and name not in reversed_
+            ]
+
+            folder = get_month_folder(company, month)
+            meta = read_meta(folder)
+            if cancelled:
+                reversal = get_reversal_columns(data, cancelled)
+                append_rows(folder, meta, reversal)
+                appended += len(reversal["amount"])
+
+            if new_rows:
+                append_rows(folder, meta, build_month_columns(new_rows, meta, account_tax_types, brackets))
+                appended += len(new_rows)
+
+        save_checkpoint(
+            checkpoint,
+            status="Completed",
+            last_value=highest,
+            processed_count=cint(checkpoint.processed_count) + appended,
+        )
+        return appended
+
+    except Exception:
+        frappe.db.rollback()
+        save_checkpoint(checkpoint, status="Failed", error=frappe.get_traceback())
+        frappe.log_error(frappe.get_traceback(), _("Error archiving deduction columns"))
+        raise
+
+
+def archive_deductions(companies=None, rebuild=False):
+    """
+    Scheduled job: append the day's deductions of every company to the archive
+
+    Args:
+        companies: Company names (defaults to all companies)
+        rebuild: Rebuild the archive of the companies from scratch
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+        get_deduction_settings,
+    )
+
+    if not companies and not cint(get_deduction_settings().enable_deduction_columns):
+        return
+
+    for company in companies or frappe.get_all("Company", pluck="name"):
+        archive_company(company, rebuild)
+
+
+# ============================================================================
+# SECTION 3: QUERIES
+# ============================================================================
+
+def iter_months(from_date, to_date):
+    month = get_first_day(from_date)
+    to_date = getdate(to_date)
+    while month <= to_date:
+        yield month.strftime("%Y-%m")
+        month = add_months(month, 1)
+
+
+def get_bracket_label(bracket):
+    if not bracket:
+        return _("No Bracket")
+    from_amount, to_amount = bracket
+    if to_amount >= OPEN_RANGE_LIMIT:
+        return f"{from_amount:g}+"
+    return f"{from_amount:g} - {to_amount:g}"
+
+
+def query_deductions(company, from_date, to_date, group_by="tax_type", payment_type=None):
+    """
+    Aggregate archived deductions of a company straight from the mapped columns
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        group_by: One of GROUP_BY_FIELDS
+        payment_type: "Receive" or "Pay" (optional)
+
+    Returns:
+        dict: totals {key: amount in company currency}, rows_scanned
+    """
+    if group_by not in GROUP_BY_FIELDS:
+        frappe.throw(_("Cannot group archived deductions by {0}").format(group_by))
+
+    start, end = np.datetime64(str(getdate(from_date))), np.datetime64(str(getdate(to_date)))
+    totals = {}
+    rows_scanned = 0
+
+    for month in iter_months(from_date, to_date):
+        data = load_month(company, month)
+        if not data.rows:
+            continue
+        rows_scanned += data.rows
+
+        columns = data.columns
+        mask = (columns["posting_date"] >= start) & (columns["posting_date"] <= end)
+        if payment_type:
+            mask &= columns["payment_type"] == PAYMENT_TYPES.index(payment_type)
+
+        keys, inverse = np.unique(columns[group_by][mask], return_inverse=True)
+        if not len(keys):
+            continue
+        sums = np.bincount(inverse, weights=columns["amount"][mask])
+
+        for key, amount in zip(keys.tolist(), sums.tolist(), strict=True):
+            if group_by == "tax_type":
+                key = TAX_ACCOUNT_FIELDS[key]
+            elif group_by == "account":
+                key = data.accounts[key]
+            elif group_by == "party":
+                key = "{}: {}".format(*data.parties[key])
+            elif group_by == "party_group":
+                key = data.party_groups[key]
+            elif group_by == "bracket":
+                key = get_bracket_label(data.brackets[key] if key != NO_BRACKET else None)
+            elif group_by == "payment_type":
+                key = PAYMENT_TYPES[key]
+            else:
+                key = str(key)
+            totals[key] = totals.get(key, 0) + amount
+
+    return {
+        "totals": {key: flt(amount, 2) for key, amount in totals.items()},
+        "rows_scanned": rows_scanned,
+    }
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def get_archived_deduction_totals(company, from_date, to_date, group_by="tax_type", payment_type=None):
+    """
+    Deduction totals of a period from the columnar archive
+
+    Only rows archived by the last nightly run are included.
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        group_by: tax_type, account, party, party_group, bracket, posting_date or payment_type
+        payment_type: "Receive" or "Pay" (optional)
+
+    Returns:
+        dict: totals {key: amount}, rows_scanned, archived_until
+    """
+    frappe.only_for(["System Manager", "Accounts Manager", "Accounts User"])
+    frappe.has_permission("Company", "read", company, throw=True)
+
+    result = query_deductions(company, from_date, to_date, group_by, payment_type)
+    result["archived_until"] = get_checkpoint(JOB_TYPE, company).last_value
+    return result
+
+
+@frappe.whitelist()
+def enqueue_archive_deductions(company=None, rebuild=0):
+    """
+    Run the columnar archive job now
+
+    Args:
+        company: Only archive this company (optional)
+        rebuild: Drop the archive and read all submitted deductions again
+    """
+    frappe.only_for("System Manager")
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_columns.archive_deductions",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id="deduction-columns-" + (company or "all"),
+        deduplicate=True,
+        companies=[company] if company else frappe.get_all("Company", pluck="name"),
+        rebuild=cint(rebuild),
+    )
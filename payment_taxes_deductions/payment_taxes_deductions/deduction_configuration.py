@@ -0,0 +1,607 @@
+"""
+Deduction Configuration
+Bulk edit, import and export of deduction profiles and stamp tax brackets
+
+Backs the Deduction Matrix Editor page and CSV import/export. A whole set of
+Payment Deductions Accounts profiles (party groups x deduction accounts) and
+Stamp Tax Range tables is validated at once: every company, party group and
+account referenced by the set is read in one query per DocType and all rows
+are checked against those sets, so errors of every row are reported together.
+
+Valid sets are written with bulk statements in the request transaction:
+profiles are replaced row for row (keeping name, creation and owner), bracket
+tables are replaced per company. The deduction cache is cleared once after
+commit instead of once per saved document. Profiles still run the
+controller validate (duplicates are checked for the whole set instead of per
+row), and one Version per changed document is bulk-inserted with the field
+and table diffs, so as-of verification (deduction_verifier.revert_to) sees
+bulk edits like saves through the form.
+
+Structure:
+1. Read
+2. Validation
+3. Bulk Write
+4. CSV
+5. API Methods
+"""
+
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, now_datetime
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    BRACKET_FIELDS,
+    TAX_ACCOUNT_FIELDS,
+    clear_deduction_cache,
+)
+
+PROFILE_KEY_FIELDS = ("company", "payment_type", "party_group")
+PROFILE_FIELDS = PROFILE_KEY_FIELDS + TAX_ACCOUNT_FIELDS
+BRACKET_TABLE_FIELDS = ("company", *BRACKET_FIELDS)
+
+PAYMENT_TYPES = ("Receive", "Pay")
+
+# Rows accepted in one save or import
+MAX_ROWS = 20000
+
+
+# ============================================================================
+# SECTION 1: READ
+# ============================================================================
+
+def get_profiles(company=None):
+    """
+    All deduction profiles as flat rows
+
+    Returns:
+        list: dicts with PROFILE_FIELDS, ordered by company, payment type and party group
+    """
+    filters = {"company": company} if company else {}
+    return frappe.get_all(
+        "Payment Deductions Accounts",
+        filters=filters,
+        fields=list(PROFILE_FIELDS),
+        order_by="company asc, payment_type desc, party_group asc",
+    )
+
+
+def get_bracket_rows(company=None):
+    """
+    Stamp Tax Range rows of every company in one query
+
+    Returns:
+        list: dicts with BRACKET_TABLE_FIELDS, in table order per company
+    """
+    condition = "and rules.company = %(company)s" if company else ""
+    return frappe.db.sql(
+        """
+        select rules.company, {fields}
+        from `tabStamp Tax Range` str
+        inner join `tabStamp Tax Calculation Rules` rules on rules.name = str.parent
+        where str.parenttype = 'Stamp Tax Calculation Rules' {condition}
+        order by rules.company, str.idx
+        """.format(
+            fields=", ".join(f"str.`{field}`" for field in BRACKET_FIELDS),
+            condition=condition,
+        ),
+        {"company": company},
+        as_dict=True,
+    )
+
+
+# ============================================================================
+# SECTION 2: VALIDATION
+# ============================================================================
+
+def get_existing_names(doctype, names):
+    names = list({name for name in names if name})
+    if not names:
+        return set()
+    return set(frappe.get_all(doctype, filters={"name": ["in", names]}, pluck="name"))
+
+
+def normalize_profiles(rows):
+    """Trim values and fill missing columns so every row has PROFILE_FIELDS"""
+    profiles = []
+    for row in rows:
+        profile = {field: str(row.get(field) or "").strip() for field in PROFILE_FIELDS}
+        profile["payment_type"] = profile["payment_type"] or "Receive"
+        profiles.append(profile)
+    return profiles
+
+
+def validate_profiles(profiles):
+    """
+    Validate a set of profiles against companies, party groups and accounts read in bulk
+
+    Args:
+        profiles: Normalized profile rows
+
+    Returns:
+        list: errors as {"row": 1-based row, "field": fieldname, "message": text}
+    """
+    companies = get_existing_names("Company", (row["company"] for row in profiles))
+    customer_groups = get_existing_names(
+        "Customer Group",
+        (row["party_group"] for row in profiles if row["payment_type"] == "Receive"),
+    )
+    supplier_groups = get_existing_names(
+        "Supplier Group",
+        (row["party_group"] for row in profiles if row["payment_type"] == "Pay"),
+    )
+
+    account_names = list({
+        row[field] for row in profiles for field in TAX_ACCOUNT_FIELDS if row[field]
+    })
+    accounts = {}
+    if account_names:
+        accounts = {
+            account.name: account
+            for account in frappe.get_all(
+                "Account",
+                filters={"name": ["in", account_names]},
+                fields=["name", "company", "is_group", "disabled"],
+            )
+        }
+
+    errors = []
+    seen = {}
+
+    def error(index, field, message):
+        errors.append({"row": index + 1, "field": field, "message": message})
+
+    for index, row in enumerate(profiles):
+        if row["company"] not in companies:
+            error(index, "company", _("Company {0} does not exist").format(row["company"]))
+
+        if row["payment_type"] not in PAYMENT_TYPES:
+            error(index, "payment_type", _("Payment Type must be Receive or Pay"))
+        elif not row["party_group"]:
+            error(index, "party_group", _("Party Group is required"))
+        elif row["payment_type"] == "Receive" and row["party_group"] not in customer_groups:
+            error(index, "party_group", _("Customer Group {0} does not exist").format(row["party_group"]))
+        elif row["payment_type"] == "Pay" and row["party_group"] not in supplier_groups:
+            error(index, "party_group", _("Supplier Group {0} does not exist").format(row["party_group"]))
+
+        key = tuple(row[field] for field in PROFILE_KEY_FIELDS)
+        if key in seen:
+            error(index, "party_group", _("Duplicate of row {0}").format(seen[key] + 1))
+        seen.setdefault(key, index)
+
+        for field in TAX_ACCOUNT_FIELDS:
+            if not row[field]:
+                continue
+            account = accounts.get(row[field])
+            if not account:
+                error(index, field, _("Account {0} does not exist").format(row[field]))
+            elif account.company != row["company"]:
+                error(index, field, _("Account {0} belongs to company {1}").format(row[field], account.company))
+            elif account.is_group:
+                error(index, field, _("Account {0} is a group account").format(row[field]))
+            elif account.disabled:
+                error(index, field, _("Account {0} is disabled").format(row[field]))
+
+    return errors
+
+
+def normalize_brackets(rows):
+    brackets = []
+    for row in rows:
+        bracket = {"company": str(row.get("company") or "").strip()}
+        for field in BRACKET_FIELDS:
+            bracket[field] = flt(row.get(field))
+        brackets.append(bracket)
+    return brackets
+
+
+def validate_brackets(brackets):
+    """
+    Validate Stamp Tax Range rows; to_amount 0 is an open range
+
+    Returns:
+        list: errors as {"row": 1-based row, "field": fieldname, "message": text}
+    """
+    companies = get_existing_names("Company", (row["company"] for row in brackets))
+
+    errors = []
+    for index, row in enumerate(brackets):
+        if row["company"] not in companies:
+            errors.append({"row": index + 1, "field": "company",
+                           "message": _("Company {0} does not exist").format(row["company"])})
+        if row["to_amount"] and row["to_amount"] < row["from_amount"]:
+            errors.append({"row": index + 1, "field": "to_amount",
+                           "message": _("To Amount is lower than From Amount")})
+        if not 0 <= row["percentage"] <= 100:
+            errors.append({"row": index + 1, "field": "percentage",
+                           "message": _("Percentage must be between 0 and 100")})
+        for field in BRACKET_FIELDS:
+            if row[field] < 0:
+                errors.append({"row": index + 1, "field": field,
+                               "message": _("{0} cannot be negative").format(field)})
+
+    return errors
+
+
+# ============================================================================
+# SECTION 3: BULK WRITE
+# ============================================================================
+
+VERSION_FIELDS = ("name", "creation", "modified", "modified_by", "owner", "docstatus", "ref_doctype", "docname", "data")
+
+
+def get_version_row(doctype, name, data, now, user):
+    """Version values in VERSION_FIELDS order, data in the format of frappe.model.document.get_diff"""
+    data = {"changed": [], "added": [], "removed": [], "row_changed": [], **data}
+    return [
+        frappe.generate_hash(length=10),
+        now,
+        now,
+        user,
+        user,
+        0,
+        doctype,
+        name,
+        frappe.as_json(data, indent=None),
+    ]
+
+
+def insert_versions(versions):
+    if versions:
+        frappe.db.bulk_insert("Version", VERSION_FIELDS, versions)
+
+
+def get_profile_doc(row):
+    """Unsaved Payment Deductions Accounts of a row, validated by the controller"""
+    doc = frappe.get_doc({
+        "doctype": "Payment Deductions Accounts",
+        "customer_group": row["party_group"] if row["payment_type"] == "Receive" else None,
+        "supplier_group": row["party_group"] if row["payment_type"] == "Pay" else None,
+        **{field: row[field] or None for field in PROFILE_FIELDS},
+    })
+    # validate_profiles already rejected duplicates within the set, existing profiles are replaced
+    doc.flags.skip_duplicate_check = True
+    doc.run_method("validate")
+    return doc
+
+
+def write_profiles(profiles):
+    """
+    Replace the given profiles with one delete and one bulk insert
+    Profiles not in the set are left untouched; name, creation and owner are kept
+
+    Returns:
+        dict: inserted and updated counts
+    """
+    existing = {}
+    for row in frappe.get_all(
+        "Payment Deductions Accounts",
+        filters={"company": ["in", list({row["company"] for row in profiles})]},
+        fields=["name", "creation", "owner", *PROFILE_FIELDS],
+    ):
+        existing[tuple(row[field] for field in PROFILE_KEY_FIELDS)] = row
+
+    now = now_datetime()
+    user = frappe.session.user
+    fields = [
+        "name", "creation", "modified", "modified_by", "owner", "docstatus", "idx",
+        "customer_group", "supplier_group", *PROFILE_FIELDS,
+    ]
+
+    replaced = []
+    values = []
+    versions = []
+    for row in profiles:
+        doc = get_profile_doc(row)
+        current = existing.get(tuple(doc.get(field) for field in PROFILE_KEY_FIELDS))
+        if current:
+            replaced.append(current.name)
+            changed = [
+                [field, current.get(field) or None, doc.get(field) or None]
+                for field in TAX_ACCOUNT_FIELDS
+                if (current.get(field) or None) != (doc.get(field) or None)
+            ]
+            if changed:
+                versions.append(
+                    get_version_row("Payment Deductions Accounts", current.name, {"changed": changed}, now, user)
+                )
+        else:
+            doc.autoname()
+
+        values.append([
+            current.name if current else doc.name,
+            current.creation if current else now,
+            now,
+            user,
+            current.owner if current else user,
+            0,
+            0,
+            doc.customer_group,
+            doc.supplier_group,
+        ] + [doc.get(field) or None for field in PROFILE_FIELDS])
+
+    if replaced:
+        frappe.db.delete("Payment Deductions Accounts", {"name": ["in", replaced]})
+    frappe.db.bulk_insert("Payment Deductions Accounts", fields, values)
+    # New profiles need no Version: as-of reads skip documents created after the date
+    insert_versions(versions)
+
+    return {"inserted": len(values) - len(replaced), "updated": len(replaced)}
+
+
+def get_range_rows(parents):
+    """Current Stamp Tax Range rows per parent, as Version table rows"""
+    rows = {}
+    for row in frappe.get_all(
+        "Stamp Tax Range",
+        filters={"parenttype": "Stamp Tax Calculation Rules", "parent": ["in", parents]},
+        fields=["name", "parent", "idx", *BRACKET_FIELDS],
+        order_by="parent asc, idx asc",
+    ):
+        rows.setdefault(row.pop("parent"), []).append(row)
+    return rows
+
+
+def get_bracket_values(rows):
+    return [[flt(row.get(field)) for field in BRACKET_FIELDS] for row in rows]
+
+
+def write_brackets(brackets):
+    """
+    Replace the Stamp Tax Range table of every company in the set
+    Missing Stamp Tax Calculation Rules parents are created (named by company)
+
+    Returns:
+        dict: companies and ranges written
+    """
+    by_company = {}
+    for row in brackets:
+        by_company.setdefault(row["company"], []).append(row)
+
+    parents = {
+        rules.company: rules.name
+        for rules in frappe.get_all(
+            "Stamp Tax Calculation Rules",
+            filters={"company": ["in", list(by_company)]},
+            fields=["name", "company"],
+        )
+    }
+    old_rows = get_range_rows(list(parents.values())) if parents else {}
+
+    now = now_datetime()
+    user = frappe.session.user
+
+    new_parents = [company for company in by_company if company not in parents]
+    if new_parents:
+        frappe.db.bulk_insert(
+            "Stamp Tax Calculation Rules",
+            ["name", "company", "creation", "modified", "modified_by", "owner", "docstatus", "idx"],
+            [[company, company, now, now, user, user, 0, 0] for company in new_parents],
+        )
+        parents.update({company: company for company in new_parents})
+
+    if len(new_parents) < len(parents):
+        frappe.db.set_value(
+            "Stamp Tax Calculation Rules",
+            {"name": ["in", [parents[company] for company in by_company if company not in new_parents]]},
+            {"modified": now, "modified_by": user},
+            update_modified=False,
+        )
+
+    frappe.db.delete(
+        "Stamp Tax Range",
+        {"parenttype": "Stamp Tax Calculation Rules", "parent": ["in", list(parents.values())]},
+    )
+
+    fields = [
+        "name", "parent", "parenttype", "parentfield", "idx",
+        "creation", "modified", "modified_by", "owner", "docstatus", *BRACKET_FIELDS,
+    ]
+    values = []
+    versions = []
+    for company, rows in by_company.items():
+        new_rows = [
+            {"name": frappe.generate_hash(length=10), "idx": idx, **{field: row[field] for field in BRACKET_FIELDS}}
+            for idx, row in enumerate(rows, start=1)
+        ]
+        values.extend(
+            [
+                new_row["name"],
+                parents[company],
+                "Stamp Tax Calculation Rules",
+                "stamp_tax_range",
+                new_row["idx"],
+                now, now, user, user, 0,
+            ] + [new_row[field] for field in BRACKET_FIELDS]
+            for new_row in new_rows
+        )
+
+        # The table is replaced as a whole: record all old rows removed and all new rows added
+        removed = old_rows.get(parents[company]) or []
+        if company not in new_parents and get_bracket_values(removed) != get_bracket_values(new_rows):
+            versions.append(get_version_row(
+                "Stamp Tax Calculation Rules",
+                parents[company],
+                {
+                    "added": [["stamp_tax_range", row] for row in new_rows],
+                    "removed": [["stamp_tax_range", row] for row in removed],
+                },
+                now,
+                user,
+            ))
+
+    frappe.db.bulk_insert("Stamp Tax Range", fields, values)
+    insert_versions(versions)
+
+    return {"companies": len(by_company), "ranges": len(values)}
+
+
+def save_configuration(profiles=None, brackets=None, validate_only=False):
+    """
+    Validate and write a set of profiles and bracket rows in the current transaction
+
+    Args:
+        profiles: Profile rows (dicts with PROFILE_FIELDS)
+        brackets: Bracket rows (dicts with BRACKET_TABLE_FIELDS)
+        validate_only: Only return the errors
+
+    Returns:
+        dict: errors per table and, when written, the write counts
+    """
+    profiles = normalize_profiles(profiles or [])
+    brackets = normalize_brackets(brackets or [])
+    if len(profiles) + len(brackets) > MAX_ROWS:
+        frappe.throw(_("At most {0} rows can be saved at once").format(MAX_ROWS))
+
+    result = {
+        "profile_errors": validate_profiles(profiles) if profiles else [],
+        "bracket_errors": validate_brackets(brackets) if brackets else [],
+    }
+    if validate_only or result["profile_errors"] or result["bracket_errors"]:
+        return result
+
+    if profiles:
+        result["profiles"] = write_profiles(profiles)
+    if brackets:
+        result["brackets"] = write_brackets(brackets)
+
+    # One invalidation for the whole set, once the rows are visible to other workers
+    frappe.db.after_commit.add(clear_deduction_cache)
+    return result
+
+
+# ============================================================================
+# SECTION 4: CSV
+# ============================================================================
+
+def get_csv_columns(kind):
+    if kind == "profiles":
+        return PROFILE_FIELDS
+    if kind == "brackets":
+        return BRACKET_TABLE_FIELDS
+    frappe.throw(_("Unknown configuration kind {0}").format(kind))
+
+
+def read_csv_rows(kind, content):
+    """
+    Parse CSV content (first row is the header) into dicts of the known columns
+
+    Returns:
+        list: dicts keyed by fieldname
+    """
+    from frappe.utils.csvutils import read_csv_content
+
+    rows = read_csv_content(content)
+    if not rows:
+        return []
+
+    columns = get_csv_columns(kind)
+    header = [frappe.scrub(str(column or "")) for column in rows[0]]
+    unknown = [column for column in header if column and column not in columns]
+    if unknown:
+        frappe.throw(_("Unknown columns: {0}").format(", ".join(unknown)))
+
+    return [
+        {column: value for column, value in zip(header, row, strict=False) if column}
+        for row in rows[1:]
+        if any(str(value or "").strip() for value in row)
+    ]
+
+
+# ============================================================================
+# SECTION 5: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def get_deduction_matrix(company=None):
+    """
+    Profiles and bracket tables for the matrix editor
+
+    Returns:
+        dict: profile and bracket columns and rows
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    return {
+        "profile_fields": PROFILE_FIELDS,
+        "tax_account_fields": TAX_ACCOUNT_FIELDS,
+        "bracket_fields": BRACKET_TABLE_FIELDS,
+        "profiles": get_profiles(company),
+        "brackets": get_bracket_rows(company),
+    }
+
+
+@frappe.whitelist(methods=["POST"])
+def save_deduction_matrix(profiles=None, brackets=None, validate_only=0):
+    """
+    Validate and save profiles and bracket tables edited in the matrix editor
+
+    Args:
+        profiles: JSON list of profile rows (optional)
+        brackets: JSON list of bracket rows; replaces the tables of their companies (optional)
+        validate_only: Only validate
+
+    Returns:
+        dict: errors per table and write counts
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    if isinstance(profiles, str):
+        profiles = json.loads(profiles)
+    if isinstance(brackets, str):
+        brackets = json.loads(brackets)
+
+    try:
+        return save_configuration(profiles, brackets, cint(validate_only))
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), _("Error saving deduction configuration"))
+        frappe.throw(_("Error saving deduction configuration: {0}").format(str(e)))
+
+
+@frappe.whitelist(methods=["POST"])
+def import_deduction_csv(kind, file_url, validate_only=0):
+    """
+    Import profiles or bracket tables from an uploaded CSV file
+
+    Args:
+        kind: "profiles" or "brackets"
+        file_url: URL of the uploaded File
+        validate_only: Only validate
+
+    Returns:
+        dict: errors per table and write counts
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    content = frappe.get_doc("File", {"file_url": file_url}).get_content()
+    rows = read_csv_rows(kind, content)
+    if not rows:
+        frappe.throw(_("The file has no rows"))
+
+    try:
+        if kind == "profiles":
+            return save_configuration(profiles=rows, validate_only=cint(validate_only))
+        return save_configuration(brackets=rows, validate_only=cint(validate_only))
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), _("Error importing deduction configuration"))
+        frappe.throw(_("Error importing deduction configuration: {0}").format(str(e)))
+
+
+@frappe.whitelist()
+@frappe.read_only()
+def export_deduction_csv(kind, company=None):
+    """Download profiles or bracket tables as CSV (same columns as the import)"""
+    from frappe.utils.csvutils import build_csv_response
+
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    columns = get_csv_columns(kind)
+    rows = get_profiles(company) if kind == "profiles" else get_bracket_rows(company)
+
+    build_csv_response(
+        [list(columns)] + [[row.get(column) for column in columns] for row in rows],
+        f"deduction_{kind}",
+    )
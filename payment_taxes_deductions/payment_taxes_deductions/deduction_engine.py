@@ -0,0 +1,515 @@
+"""
+Deduction Engine
+Compiled stamp brackets and deduction profiles shared by all calculation paths
+
+Stamp Tax Calculation Rules are compiled once per company into a sorted bracket
+index (searched with bisect) and Payment Deductions Accounts into a flat profile
+of account names. Both are kept in the shared cache and cleared whenever the
+configuration documents change. After a migrate (or on demand) the cache is
+prewarmed for all configured companies in bulk, so the first saves after a
+deploy do not load the configuration one company at a time. Cache loads read
+the primary even inside read replica requests, so a lagging replica cannot
+put an outdated configuration back into the cache.
+
+Structure:
+1. Constants
+2. Bracket Compilation and Lookup
+3. Cached Loaders
+4. Evaluation
+5. Prewarming
+"""
+
+import hashlib
+import json
+from bisect import bisect_right
+
+import frappe
+from frappe.utils import flt
+
+from payment_taxes_deductions.payment_taxes_deductions.read_replica import on_primary
+
+# ============================================================================
+# SECTION 1: CONSTANTS
+# ============================================================================
+
+BRACKETS_CACHE_KEY = "payment_deductions_stamp_brackets"
+PROFILES_CACHE_KEY = "payment_deductions_profiles"
+
+# Upper bound used when a range has no to_amount (same default as the rule lookup)
+OPEN_RANGE_LIMIT = 999999999
+
+# Stamp Tax Range fields read into the bracket index
+BRACKET_FIELDS = (
+    "from_amount",
+    "to_amount",
+    "percentage",
+    "subtract_amount",
+    "add_amount",
+    "check_stamp_amount",
+    "ats_tax_amount",
+    "additional_stamp_multiplier",
+)
+
+# Account fields of Payment Deductions Accounts, in form order
+TAX_ACCOUNT_FIELDS = (
+    "commercial_profits",
+    "regular_stamp",
+    "additional_stamp",
+    "contract_stamp",
+    "check_stamp",
+    "applied_professions_tax",
+    "medical_professions_tax",
+    "vat_20_percent",
+    "vat_tax",
+    "qaderon_difference",
+)
+
+# Labels used on certificates, exports and reports
+TAX_TYPE_LABELS = {
+    "commercial_profits": "ارباح تجارية",
+    "regular_stamp": "دمغة عادية",
+    "additional_stamp": "دمغة اضافية",
+    "contract_stamp": "دمغة عقد",
+    "check_stamp": "دمغة شيك",
+    "applied_professions_tax": "دمغة المهن التطبيقية",
+    "medical_professions_tax": "دمغة المهن الطبية",
+    "vat_20_percent": "20% من القيمة المضافة",
+    "vat_tax": "ضريبة القيمة المضافة",
+    "qaderon_difference": "فرق قادرون",
+}
+
+
+# ============================================================================
+# SECTION 2: BRACKET COMPILATION AND LOOKUP
+# ============================================================================
+
+def compile_brackets(ranges):
+    """
+    Compile Stamp Tax Range rows into a sorted bracket index
+
+    Rows are sorted by from_amount so a lookup is a bisect instead of a scan.
+    The original row order is kept so overlapping ranges still resolve to the
+    first matching row, exactly like the sequential scan did.
+
+    Args:
+        ranges: Iterable of Stamp Tax Range rows (documents or dicts)
+
+    Returns:
+        dict: {"starts": [...], "reach": [...], "order": [...], "rules": [...], "version": hash}
+    """
+    rows = []
+    for position, range_row in enumerate(ranges):
+        from_amount = flt(range_row.get("from_amount") or 0)
+        to_amount = flt(range_row.get("to_amount") or OPEN_RANGE_LIMIT)
+        rows.append((from_amount, position, {
+            "from_amount": from_amount,
+            "to_amount": to_amount,
+            "percentage": flt(range_row.get("percentage") or 0),
+            "subtract_amount": flt(range_row.get("subtract_amount") or 0),
+            "add_amount": flt(range_row.get("add_amount") or 0),
+            "check_stamp_amount": flt(range_row.get("check_stamp_amount") or 0),
+            "ats_tax_amount": flt(range_row.get("ats_tax_amount") or 0),
+            "additional_stamp_multiplier": flt(
+                range_row.get("additional_stamp_multiplier") or 3
+            ),
+        }))
+
+    rows.sort(key=lambda row: (row[0], row[1]))
+
+    # reach[i] = highest to_amount among rows[0..i], bounds the backward walk
+    reach = []
+    highest = None
+    for row in rows:
+        to_amount = row[2]["to_amount"]
+        highest = to_amount if highest is None else max(highest, to_amount)
+        reach.append(highest)
+
+    return {
+        "starts": [row[0] for row in rows],
+        "reach": reach,
+        "order": [row[1] for row in rows],
+        "rules": [row[2] for row in rows],
+        "version": get_content_hash([row[2] for row in sorted(rows, key=lambda row: row[1])]),
+    }
+
+
+def get_content_hash(value, length=12):
+    """Short stable hash of a JSON serializable value (used by rule versions and fingerprints)"""
+    content = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(content.encode()).hexdigest()[:length]
+
+
+def find_bracket(brackets, total):
+    """
+    Find the stamp tax rule matching total in a compiled bracket index
+
+    Args:
+        brackets: Compiled bracket index from compile_brackets()
+        total: Amount to look up
+
+    Returns:
+        dict: Rule dictionary, or None if no range covers total
+    """
+    if not brackets or not brackets["starts"]:
+        return None
+
+    total = flt(total)
+    starts, reach, order, rules = (
+        brackets["starts"], brackets["reach"], brackets["order"], brackets["rules"]
+    )
+
+    match = None
+    index = bisect_right(starts, total) - 1
+    while index >= 0 and reach[index] >= total:
+        rule = rules[index]
+        if rule["to_amount"] >= total and (match is None or order[index] < order[match]):
+            match = index
+        index -= 1
+
+    return rules[match] if match is not None else None
+
+
+# ============================================================================
+# SECTION 3: CACHED LOADERS
+# ============================================================================
+
+def get_compiled_brackets(company):
+    """
+    Get the compiled bracket index for a company from the shared cache
+
+    Args:
+        company: Company name
+
+    Returns:
+        dict: Compiled bracket index (empty when the company has no rules)
+    """
+    return frappe.cache().hget(
+        BRACKETS_CACHE_KEY, company, lambda: on_primary(_load_brackets, company)
+    )
+
+
+def _load_brackets(company):
+    rules_name = frappe.db.get_value(
+        "Stamp Tax Calculation Rules", {"company": company}, "name"
+    )
+    ranges = []
+    if rules_name:
+        ranges = frappe.get_all(
+            "Stamp Tax Range",
+            filters={
+                "parent": rules_name,
+                "parenttype": "Stamp Tax Calculation Rules",
+            },
+            fields=list(BRACKET_FIELDS),
+            order_by="idx asc",
+        )
+    return compile_brackets(ranges)
+
+
+def get_deduction_profile(company, customer_group=None, payment_type="Receive"):
+    """
+    Get tax account names of Payment Deductions Accounts from the shared cache
+
+    Receive and Pay profiles share the cache; Pay profiles are keyed by
+    Supplier Group, passed in customer_group.
+
+    Args:
+        company: Company name
+        customer_group: Customer Group (Supplier Group for Pay), company only if not provided
+        payment_type: "Receive" (customers) or "Pay" (suppliers)
+
+    Returns:
+        dict: tax_type -> account name ("" when not configured)
+    """
+    return frappe.cache().hget(
+        PROFILES_CACHE_KEY,
+        get_profile_cache_key(company, customer_group, payment_type),
+        lambda: on_primary(_load_profile, company, customer_group, payment_type),
+    )
+
+
+def get_profile_cache_key(company, customer_group=None, payment_type="Receive"):
+    key = "{}::{}".format(company, customer_group or "")
+    if payment_type == "Pay":
+        key += "::Pay"
+    return key
+
+
+def get_profile_direction(doc):
+    """
+    Payment type and party group selecting the deduction profile of a Payment Entry
+
+    Args:
+        doc: Payment Entry document
+
+    Returns:
+        tuple: ("Receive", customer group) or ("Pay", supplier group)
+    """
+    if doc.get("payment_type") == "Pay" and doc.get("party_type") == "Supplier":
+        return "Pay", doc.get("custom_supplier_group")
+    return "Receive", doc.get("custom_customer_group")
+
+
+def _load_profile(company, customer_group=None, payment_type="Receive"):
+    filters = {"company": company, "payment_type": payment_type}
+    if customer_group:
+        filters["party_group"] = customer_group
+
+    settings = frappe.db.get_value(
+        "Payment Deductions Accounts", filters, list(TAX_ACCOUNT_FIELDS), as_dict=True
+    ) or {}
+
+    return {field: settings.get(field) or "" for field in TAX_ACCOUNT_FIELDS}
+
+
+def get_account_tax_types(company):
+    """
+    Map every deduction account configured for a company to its tax type
+    Reads all Payment Deductions Accounts profiles of the company in one query
+
+    Args:
+        company: Company name
+
+    Returns:
+        dict: account -> tax_type
+    """
+    account_tax_types = {}
+    for profile in frappe.get_all(
+        "Payment Deductions Accounts",
+        filters={"company": company},
+        fields=list(TAX_ACCOUNT_FIELDS),
+    ):
+        for account, tax_type in get_profile_tax_types(profile).items():
+            account_tax_types.setdefault(account, tax_type)
+
+    return account_tax_types
+
+
+def get_profile_tax_types(profile):
+    """
+    Map the deduction accounts of one profile to their tax type
+    An account shared by several tax types maps to the first in TAX_ACCOUNT_FIELDS
+
+    Args:
+        profile: Deduction profile (tax_type -> account)
+
+    Returns:
+        dict: account -> tax_type
+    """
+    account_tax_types = {}
+    for tax_type in TAX_ACCOUNT_FIELDS:
+        if profile.get(tax_type) and tax_type != "vat_tax":
+            account_tax_types.setdefault(profile[tax_type], tax_type)
+    return account_tax_types
+
+
+def clear_deduction_cache(doc=None, method=None, *args, **kwargs):
+    """
+    Clear compiled brackets and profiles from the shared cache
+    Called from the configuration DocType controllers on every change and on
+    Company / party group renames; the new config version also invalidates
+    the in-process LRU of every worker
+
+    Companies and groups without configuration are cached as empty profiles
+    and bracket tables ("no config" markers). A save running while this
+    transaction is open can still load and cache the old configuration, so
+    the cache is cleared again once the transaction commits.
+    """
+    _clear_shared_cache()
+    frappe.db.after_commit.add(_clear_shared_cache)
+
+
+def _clear_shared_cache():
+    from payment_taxes_deductions.payment_taxes_deductions.config_cache import bump_config_version
+
+    frappe.cache().delete_value([BRACKETS_CACHE_KEY, PROFILES_CACHE_KEY])
+    bump_config_version()
+
+
+# ============================================================================
+# SECTION 4: EVALUATION
+# ============================================================================
+
+def calculate_stamp_amounts(rule, total):
+    """
+    Calculate regular and additional stamp for total using a bracket rule
+    Formula: ((total - subtract_amount) * percentage / 100 + add_amount) / 4
+
+    Returns:
+        tuple: (regular_stamp_amount, additional_stamp_amount)
+    """
+    regular_stamp_amount = (
+        (total - rule["subtract_amount"]) * rule["percentage"] / 100
+        + rule["add_amount"]
+    ) / 4
+    return regular_stamp_amount, regular_stamp_amount * rule["additional_stamp_multiplier"]
+
+
+def evaluate_deductions(total, brackets, profile, vat_amount=0, exchange_rate=1):
+    """
+    Evaluate expected deductions for an amount (same rules as before_validate)
+
+    Only tax types with a configured account in the profile are returned.
+    Brackets and thresholds are in company currency: total is converted with
+    exchange_rate for the evaluation and the deductions are converted back.
+
+    Args:
+        total: Amount to evaluate (paid amount or invoice total)
+        brackets: Compiled bracket index of the company
+        profile: Deduction profile from get_deduction_profile()
+        vat_amount: VAT charged on the invoice (for the VAT 20% share)
+        exchange_rate: Rate from the currency of total to company currency
+
+    Returns:
+        dict: tax_type -> deduction amount (in the currency of total)
+    """
+    exchange_rate = flt(exchange_rate) or 1
+    base_total = flt(total) * exchange_rate
+    base_amounts = {}
+
+    if profile.get("commercial_profits") and base_total > 300:
+        base_amounts["commercial_profits"] = base_total * 0.01
+
+    rule = find_bracket(brackets, base_total)
+    if rule:
+        regular_stamp_amount, additional_stamp_amount = calculate_stamp_amounts(rule, base_total)
+        if profile.get("regular_stamp"):
+            base_amounts["regular_stamp"] = regular_stamp_amount
+        if profile.get("additional_stamp"):
+            base_amounts["additional_stamp"] = additional_stamp_amount
+        if profile.get("check_stamp") and rule["check_stamp_amount"] > 0:
+            base_amounts["check_stamp"] = rule["check_stamp_amount"]
+
+    amounts = {tax_type: amount / exchange_rate for tax_type, amount in base_amounts.items()}
+
+    if profile.get("vat_20_percent") and profile.get("vat_tax") and flt(vat_amount):
+        amounts["vat_20_percent"] = flt(vat_amount) * 0.20
+
+    return amounts
+
+
+# ============================================================================
+# SECTION 5: PREWARMING
+# ============================================================================
+
+def prewarm_deduction_cache(companies=None):
+    """
+    Load compiled brackets and profiles of all configured companies into the shared cache
+
+    Rules, ranges and profiles of every company are read in three queries; the
+    Company and deduction Account documents read on save (cost center, account
+    names) and Payment Deductions Settings are loaded into the document cache.
+    Runs after every migrate, can be called from bench or the desk.
+
+    Args:
+        companies: Only prewarm these companies (all configured companies when empty)
+
+    Returns:
+        dict: Number of companies, profiles and accounts loaded
+    """
+    company_filters = {"company": ["in", list(companies)]} if companies else {}
+
+    # Latest rules document of each company, like _load_brackets()
+    rules_by_company = {}
+    for rules in frappe.get_all(
+        "Stamp Tax Calculation Rules",
+        filters=company_filters,
+        fields=["name", "company"],
+        order_by="modified desc",
+    ):
+        rules_by_company.setdefault(rules.company, rules.name)
+
+    ranges_by_rules = {name: [] for name in rules_by_company.values()}
+    if ranges_by_rules:
+        for range_row in frappe.get_all(
+            "Stamp Tax Range",
+            filters={
+                "parent": ["in", list(ranges_by_rules)],
+                "parenttype": "Stamp Tax Calculation Rules",
+            },
+            fields=["parent", *BRACKET_FIELDS],
+            order_by="parent asc, idx asc",
+        ):
+            ranges_by_rules[range_row.parent].append(range_row)
+
+    # Profiles by cache key; the group-less key gets the latest profile, like _load_profile()
+    profiles = {}
+    for settings in frappe.get_all(
+        "Payment Deductions Accounts",
+        filters=company_filters,
+        fields=["company", "payment_type", "party_group", *TAX_ACCOUNT_FIELDS],
+        order_by="modified desc",
+    ):
+        profile = {field: settings.get(field) or "" for field in TAX_ACCOUNT_FIELDS}
+        payment_type = settings.payment_type or "Receive"
+        profiles[get_profile_cache_key(settings.company, settings.party_group, payment_type)] = profile
+        profiles.setdefault(get_profile_cache_key(settings.company, None, payment_type), profile)
+
+    company_names = set(companies or []) | set(rules_by_company)
+    company_names |= {key.split("::", 1)[0] for key in profiles}
+    empty_profile = {field: "" for field in TAX_ACCOUNT_FIELDS}
+
+    cache = frappe.cache()
+    for company in company_names:
+        ranges = ranges_by_rules.get(rules_by_company.get(company), [])
+        cache.hset(BRACKETS_CACHE_KEY, company, compile_brackets(ranges))
+        profiles.setdefault(get_profile_cache_key(company), empty_profile)
+
+    for key, profile in profiles.items():
+        cache.hset(PROFILES_CACHE_KEY, key, profile)
+
+    # Documents read through get_cached_value() on every save
+    existing_companies = frappe.get_all(
+        "Company", filters={"name": ["in", list(company_names)]}, pluck="name"
+    ) if company_names else []
+    for company in existing_companies:
+        frappe.get_cached_doc("Company", company)
+
+    accounts = {
+        account
+        for profile in profiles.values()
+        for account in profile.values()
+        if account
+    }
+    existing_accounts = frappe.get_all(
+        "Account", filters={"name": ["in", list(accounts)]}, pluck="name"
+    ) if accounts else []
+    for account in existing_accounts:
+        frappe.get_cached_doc("Account", account)
+
+    frappe.get_cached_doc("Payment Deductions Settings")
+
+    return {
+        "companies": len(company_names),
+        "profiles": len(profiles),
+        "accounts": len(existing_accounts),
+    }
+
+
+def prewarm_on_boot(bootinfo=None):
+    """
+    Enqueue a prewarm when the shared cache was cleared (boot_session hook)
+    Desk sessions only pay one cache check
+    """
+    if frappe.cache().exists(BRACKETS_CACHE_KEY):
+        return
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.prewarm_deduction_cache",
+        queue="short",
+        job_id="prewarm-deduction-cache",
+        deduplicate=True,
+    )
+
+
+@frappe.whitelist()
+def enqueue_prewarm_deduction_cache():
+    """Prewarm the deduction cache of all companies in a background job"""
+    frappe.only_for("System Manager")
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_engine.prewarm_deduction_cache",
+        queue="short",
+        job_id="prewarm-deduction-cache",
+        deduplicate=True,
+    )
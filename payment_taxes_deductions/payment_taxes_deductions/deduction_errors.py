@@ -0,0 +1,113 @@
+"""
+Deduction Errors
+Deduplicated error logging for the deduction lookups on the save path
+
+The account and stamp rule lookups run several times per Payment Entry save.
+Logging each failure with frappe.log_error inserts one Error Log per call, so
+a misconfigured company floods the table and adds a write to every save.
+
+log_deduction_error counts the failure in the shared cache instead, under a
+signature of the title, exception type and traceback frames (not the
+message, which usually carries document names). The first traceback of each
+signature is kept as a sample. flush_deduction_errors runs from the scheduler
+and writes one Error Log per signature with its count and time range.
+
+If the cache is unreachable the error is logged directly.
+
+Structure:
+1. Recording
+2. Flushing
+"""
+
+import hashlib
+import json
+import sys
+import traceback
+
+import frappe
+from frappe.utils import now
+
+COUNTS_KEY = "payment_deductions_error_counts"
+SAMPLES_KEY = "payment_deductions_error_samples"
+
+# Frames of the traceback that make up the signature
+SIGNATURE_FRAMES = 8
+
+
+# ============================================================================
+# SECTION 1: RECORDING
+# ============================================================================
+
+def get_error_signature(title, exc_info=None):
+    exc_type, _exc, tb = exc_info or sys.exc_info()
+    frames = traceback.extract_tb(tb)[-SIGNATURE_FRAMES:] if tb else []
+    content = "|".join(
+        [title, exc_type.__name__ if exc_type else ""]
+        + [f"{frame.filename}:{frame.lineno}:{frame.name}" for frame in frames]
+    )
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def log_deduction_error(title):
+    """
+    Count the exception being handled under its signature
+
+    Call from an except block in place of frappe.log_error(frappe.get_traceback(), title).
+
+    Args:
+        title: Error Log title (already translated)
+    """
+    signature = get_error_signature(title)
+    cache = frappe.cache()
+    try:
+        # Raw redis commands through a pipeline (MULTI): counter and sample always exist together
+        pipe = cache.pipeline()
+        pipe.hincrby(cache.make_key(COUNTS_KEY), signature, 1)
+        pipe.hsetnx(
+            cache.make_key(SAMPLES_KEY),
+            signature,
+            json.dumps({"title": title, "traceback": frappe.get_traceback(), "first_seen": now()}),
+        )
+        pipe.execute()
+    except Exception:
+        frappe.log_error(title=title, message=frappe.get_traceback())
+
+
+# ============================================================================
+# SECTION 2: FLUSHING
+# ============================================================================
+
+def flush_deduction_errors():
+    """
+    Scheduled job: write one Error Log per error signature counted since the last flush
+    """
+    cache = frappe.cache()
+    counts_key, samples_key = cache.make_key(COUNTS_KEY), cache.make_key(SAMPLES_KEY)
+    if not cache.pipeline().exists(counts_key).execute()[0]:
+        return
+
+    # Move both hashes aside at once, errors counted during the flush start a new batch
+    flushing_counts = cache.make_key(COUNTS_KEY + ":flushing")
+    flushing_samples = cache.make_key(SAMPLES_KEY + ":flushing")
+    cache.pipeline().rename(counts_key, flushing_counts).rename(samples_key, flushing_samples).execute()
+    counts, samples, _deleted = (
+        cache.pipeline()
+        .hgetall(flushing_counts)
+        .hgetall(flushing_samples)
+        .delete(flushing_counts, flushing_samples)
+        .execute()
+    )
+
+    flushed_at = now()
+    for signature, count in counts.items():
+        sample = json.loads(samples.get(signature) or "{}")
+        frappe.log_error(
+            title="{} (x{})".format(sample.get("title") or "Deduction error", int(count)),
+            message="Occurrences: {}\nFirst seen: {}\nFlushed: {}\nSignature: {}\n\n{}".format(
+                int(count),
+                sample.get("first_seen") or "",
+                flushed_at,
+                frappe.safe_decode(signature),
+                sample.get("traceback") or "",
+            ),
+        )
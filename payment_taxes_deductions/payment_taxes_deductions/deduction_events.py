@@ -0,0 +1,228 @@
+"""
+Deduction Events
+Append-only feed of Payment Entry deduction changes for downstream systems
+
+When "Enable Deduction Event Feed" is set, the Payment Entry hooks append a
+Deduction Event (outbox row) in the same transaction as the entry:
+
+- Computed: first save with deductions
+- Changed: a later draft save whose deductions or paid amount differ
+- Submitted / Cancelled: on submit and cancel
+
+Consumers call get_deduction_events with the last offset they have seen and
+receive the next batch in order, instead of polling Payment Entries.
+
+The offset is the event's sequence, not its autoincrement name: names are
+assigned at insert, so a slow transaction can commit a lower name after a
+higher one and a consumer tailing by name would skip it. assign_sequences
+runs after the commit of the Payment Entry transaction and numbers committed
+events under a named lock, one commit at a time, so a sequence only becomes
+visible once every lower one is. Events whose worker died between commit and
+numbering are picked up by the next call or by the scheduler; until then
+they are simply not in the feed yet.
+
+Structure:
+1. Deduction Summary
+2. Hooks
+3. Sequence
+4. API Methods
+"""
+
+import json
+
+import frappe
+from frappe.utils import cint, flt
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    get_deduction_profile,
+    get_profile_direction,
+)
+
+# Named lock serializing assign_sequences across workers
+SEQUENCE_LOCK = "deduction_event_sequence"
+
+MAX_BATCH_SIZE = 5000
+
+EVENT_FIELDS = (
+    "sequence", "event_type", "payment_entry", "company", "payment_type", "party_type",
+    "party", "posting_date", "currency", "paid_amount", "total_deductions",
+    "fingerprint", "deductions", "creation",
+)
+
+
+# ============================================================================
+# SECTION 1: DEDUCTION SUMMARY
+# ============================================================================
+
+def get_deduction_summary(doc):
+    """
+    Deduction amounts of a Payment Entry per tax type
+
+    Accounts are mapped through the entry's deduction profile; rows routed to
+    a clearing account use their real account, and accounts outside the
+    profile are kept under the account name.
+
+    Returns:
+        dict: tax_type (or account) -> amount in the paid amount currency
+    """
+    payment_type, party_group = get_profile_direction(doc)
+    profile = get_deduction_profile(doc.company, party_group, payment_type)
+    tax_types = {account: tax_type for tax_type, account in profile.items() if account}
+
+    summary = {}
+    for tax in doc.get("taxes") or []:
+        if tax.add_deduct_tax != "Deduct" or not flt(tax.tax_amount):
+            continue
+        account = tax.get("custom_deduction_account") or tax.account_head
+        key = tax_types.get(account, account)
+        summary[key] = flt(summary.get(key, 0) + flt(tax.tax_amount), 2)
+
+    return summary
+
+
+def add_event(doc, event_type, summary=None):
+    summary = get_deduction_summary(doc) if summary is None else summary
+    frappe.get_doc({
+        "doctype": "Deduction Event",
+        "event_type": event_type,
+        "payment_entry": doc.name,
+        "company": doc.company,
+        "payment_type": doc.payment_type,
+        "party_type": doc.party_type,
+        "party": doc.party,
+        "posting_date": doc.posting_date,
+        # Deduction rows are in the paid amount currency
+        "currency": doc.paid_from_account_currency,
+        "paid_amount": doc.paid_amount,
+        "total_deductions": sum(summary.values()),
+        "fingerprint": doc.get("custom_deduction_fingerprint"),
+        "deductions": json.dumps(summary, separators=(",", ":"), ensure_ascii=False),
+    }).insert(ignore_permissions=True, ignore_links=True)
+    frappe.db.after_commit.add(assign_sequences)
+
+
+def is_feed_enabled():
+    from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+        get_deduction_settings,
+    )
+
+    return cint(get_deduction_settings().enable_deduction_events)
+
+
+# ============================================================================
+# SECTION 2: HOOKS
+# ============================================================================
+
+def on_update(doc, method=None):
+    """Record Computed or Changed when a draft is saved with new deductions"""
+    # Submit also runs on_update; on_submit records that event
+    if doc.docstatus != 0 or not is_feed_enabled():
+        return
+
+    summary = get_deduction_summary(doc)
+    before = doc.get_doc_before_save()
+    previous = get_deduction_summary(before) if before else {}
+
+    if not previous:
+        if summary:
+            add_event(doc, "Computed", summary)
+    elif summary != previous or flt(doc.paid_amount) != flt(before.paid_amount):
+        add_event(doc, "Changed", summary)
+
+
+def on_submit(doc, method=None):
+    if is_feed_enabled():
+        add_event(doc, "Submitted")
+
+
+def on_cancel(doc, method=None):
+    if is_feed_enabled():
+        add_event(doc, "Cancelled")
+
+
+# ============================================================================
+# SECTION 3: SEQUENCE
+# ============================================================================
+
+def assign_sequences():
+    """
+    Number committed events without a sequence in name order
+
+    Runs after commit (see add_event) and from the scheduler. Only committed
+    rows are visible here, and the lock keeps numbering and commit of one
+    call ahead of the next, so sequences become visible in increasing order.
+    """
+    # Never wait: saves run this after their commit. Events committed while another
+    # worker holds the lock are numbered by the next call or by the scheduler
+    if not cint(frappe.db.sql("select get_lock(%s, 0)", SEQUENCE_LOCK)[0][0]):
+        return
+
+    try:
+        # Locking read: sees the sequences committed by the previous holder
+        last = frappe.db.sql(
+            "select coalesce(max(sequence), 0) from `tabDeduction Event` for update"
+        )[0][0]
+        frappe.db.sql("set @deduction_event_sequence = %s", cint(last))
+        frappe.db.sql(
+            """
+            update `tabDeduction Event`
+            set sequence = (@deduction_event_sequence := @deduction_event_sequence + 1)
+            where sequence is null
+            order by name
+            """
+        )
+        frappe.db.commit()
+    finally:
+        frappe.db.sql("select release_lock(%s)", SEQUENCE_LOCK)
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def get_deduction_events(after=0, limit=500, company=None):
+    """
+    Read the deduction event feed after an offset
+
+    Args:
+        after: Last offset already processed (0 to start from the oldest event kept)
+        limit: Maximum events scanned (up to MAX_BATCH_SIZE)
+        company: Only return events of this company (optional); events of
+            other companies are skipped and the cursor moves past them
+
+    Returns:
+        dict: events (oldest first), cursor to pass as after next time, has_more
+    """
+    frappe.has_permission("Deduction Event", "read", throw=True)
+
+    after = cint(after)
+    limit = min(max(cint(limit), 1), MAX_BATCH_SIZE)
+
+    events = frappe.db.sql(
+        """
+        select {fields}
+        from `tabDeduction Event`
+        where sequence > %(after)s
+        order by sequence
+        limit %(limit)s
+        """.format(fields=", ".join(f"`{field}`" for field in EVENT_FIELDS)),
+        {"after": after, "limit": limit},
+        as_dict=True,
+    )
+
+    cursor = after
+    batch = []
+    for event in events:
+        cursor = cint(event.pop("sequence"))
+        if company and event.company != company:
+            continue
+        event.offset = cursor
+        event.deductions = json.loads(event.deductions) if event.deductions else {}
+        batch.append(event)
+
+    return {
+        "events": batch,
+        "cursor": cursor,
+        "has_more": len(events) == limit,
+    }
@@ -0,0 +1,321 @@
+"""
+Deduction Fingerprint
+Record which rules and inputs the deductions of a Payment Entry were computed with
+
+Every computed Payment Entry stores "<rule version>:<input hash>" in the
+indexed custom_deduction_fingerprint field. The rule version hashes the
+compiled bracket table, the deduction profile (and its company and party
+group), the allocation settings and the app version; its content is saved once as a Deduction Rule Version, so no
+snapshot is stored per document. The input hash covers the paid amount,
+exchange rate, party group, contract papers and each reference with its stored
+invoice expectation (which carries the invoice VAT).
+
+Audits replay entries grouped by rule version: each distinct snapshot is
+loaded once and every entry of that version is recomputed against it.
+
+Structure:
+1. Rule Versions
+2. Payment Entry Fingerprint
+3. Replay
+"""
+
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+from payment_taxes_deductions import __version__
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    get_compiled_brackets,
+    get_content_hash,
+    get_deduction_profile,
+)
+
+FINGERPRINT_FIELD = "custom_deduction_fingerprint"
+
+# Rule versions known to exist, set once the inserting transaction commits
+RULE_VERSIONS_CACHE_KEY = "payment_deductions_rule_versions"
+
+REPLAY_CHUNK_SIZE = 2000
+REPLAY_MISMATCH_LIMIT = 500
+
+
+# ============================================================================
+# SECTION 1: RULE VERSIONS
+# ============================================================================
+
+def get_rule_settings(settings, company):
+    """Settings that change how the deduction rows of a company are computed or posted"""
+    from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+        get_clearing_account,
+    )
+
+    return {
+        "deduction_allocation_mode": settings.deduction_allocation_mode or "Aggregate",
+        "commercial_profits_threshold_basis": settings.commercial_profits_threshold_basis or "Per Payment",
+        # Rows are routed to the clearing account when consolidating
+        "consolidate_deduction_postings": cint(settings.consolidate_deduction_postings),
+        "clearing_account": get_clearing_account(company) or "",
+    }
+
+
+def get_rule_version(company, payment_type, party_group, brackets, profile, rule_settings):
+    # The profile key is part of the version, so a snapshot belongs to one profile
+    return get_content_hash({
+        "company": company,
+        "payment_type": payment_type,
+        "party_group": party_group or "",
+        "brackets": brackets.get("version") or get_content_hash(brackets.get("rules") or []),
+        "profile": profile,
+        "settings": rule_settings,
+        "app_version": __version__,
+    })
+
+
+def register_rule_version(rule_version, company, payment_type, party_group, brackets, profile,
+                          rule_settings):
+    """
+    Save the snapshot of a rule version the first time it is used
+    A cache hit makes this free for every later save
+    """
+    cache = frappe.cache()
+    if cache.hget(RULE_VERSIONS_CACHE_KEY, rule_version):
+        return
+
+    if not frappe.db.exists("Deduction Rule Version", rule_version):
+        frappe.get_doc({
+            "doctype": "Deduction Rule Version",
+            "name": rule_version,
+            "company": company,
+            "payment_type": payment_type,
+            "party_group": party_group,
+            "app_version": __version__,
+            "settings": json.dumps(rule_settings, separators=(",", ":")),
+            "profile": json.dumps(profile, separators=(",", ":"), ensure_ascii=False),
+            "brackets": json.dumps(brackets, separators=(",", ":")),
+        }).insert(ignore_permissions=True, ignore_if_duplicate=True)
+
+    # Only remember it once the snapshot is committed with the Payment Entry.
+    # A rollback to a savepoint drops the insert but keeps this callback
+    def remember_rule_version():
+        if frappe.db.exists("Deduction Rule Version", rule_version):
+            cache.hset(RULE_VERSIONS_CACHE_KEY, rule_version, 1)
+
+    frappe.db.after_commit.add(remember_rule_version)
+
+
+def get_rule_version_context(rule_version):
+    """
+    Rebuild a verifier rule context from a stored snapshot
+
+    Returns:
+        dict: brackets, profiles, allocation mode and threshold basis (None if the snapshot is missing)
+    """
+    snapshot = frappe.db.get_value(
+        "Deduction Rule Version",
+        rule_version,
+        ["party_group", "settings", "profile", "brackets"],
+        as_dict=True,
+    )
+    if not snapshot:
+        return None
+
+    profile = json.loads(snapshot.profile)
+    settings = json.loads(snapshot.settings)
+    return {
+        "brackets": json.loads(snapshot.brackets),
+        # Every entry of a version was computed with this profile
+        "profiles": {snapshot.party_group or "": profile, "": profile},
+        "mode": settings.get("deduction_allocation_mode") or "Aggregate",
+        "threshold_basis": settings.get("commercial_profits_threshold_basis") or "Per Payment",
+    }
+
+
+# ============================================================================
+# SECTION 2: PAYMENT ENTRY FINGERPRINT
+# ============================================================================
+
+def get_fingerprint_inputs(doc, customer_group, payment_type, exchange_rate):
+    from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import (
+        get_invoice_expectation_rows,
+    )
+
+    references = [
+        ref for ref in doc.get("references") or []
+        if ref.reference_doctype == "Sales Invoice" and ref.reference_name
+    ]
+    invoices = get_invoice_expectation_rows(list({ref.reference_name for ref in references}))
+
+    return {
+        "paid_amount": flt(doc.paid_amount),
+        "exchange_rate": flt(exchange_rate),
+        "payment_type": payment_type,
+        "party_group": customer_group or "",
+        "contract_papers_qty": cint(doc.get("contract_papers_qty")),
+        "references": [
+            (
+                ref.reference_name,
+                flt(ref.allocated_amount),
+                (invoices.get(ref.reference_name) or {}).get("custom_expected_deductions")
+                or flt((invoices.get(ref.reference_name) or {}).get("grand_total")),
+            )
+            for ref in references
+        ],
+    }
+
+
+def set_deduction_fingerprint(doc, company, customer_group, payment_type, exchange_rate, settings):
+    """
+    Set custom_deduction_fingerprint from the cached rules and the entry inputs
+    Called at the end of before_validate; brackets and profile come from the shared cache
+
+    Args:
+        doc: Payment Entry document
+        company: Company name
+        customer_group: Customer Group (Supplier Group for Pay)
+        payment_type: "Receive" or "Pay"
+        exchange_rate: Rate used to evaluate the deductions
+        settings: Payment Deductions Settings
+    """
+    brackets = get_compiled_brackets(company)
+    profile = get_deduction_profile(company, customer_group, payment_type)
+    rule_settings = get_rule_settings(settings, company)
+
+    rule_version = get_rule_version(
+        company, payment_type, customer_group, brackets, profile, rule_settings
+    )
+    register_rule_version(
+        rule_version, company, payment_type, customer_group, brackets, profile, rule_settings
+    )
+
+    doc.set(
+        FINGERPRINT_FIELD,
+        get_fingerprint(rule_version, doc, customer_group, payment_type, exchange_rate),
+    )
+
+
+def get_fingerprint(rule_version, doc, customer_group, payment_type, exchange_rate):
+    input_hash = get_content_hash(
+        get_fingerprint_inputs(doc, customer_group, payment_type, exchange_rate)
+    )
+    return f"{rule_version}:{input_hash}"
+
+
+# ============================================================================
+# SECTION 3: REPLAY
+# ============================================================================
+
+def get_rule_versions(company, from_date, to_date):
+    """
+    Count submitted customer Payment Entries per rule version
+
+    Returns:
+        list: (rule_version, entries) ordered by rule version
+    """
+    return frappe.db.sql(
+        """
+        select substring_index(custom_deduction_fingerprint, ':', 1) as rule_version, count(*)
+        from `tabPayment Entry`
+        where company = %(company)s and docstatus = 1
+            and payment_type = 'Receive' and party_type = 'Customer'
+            and posting_date between %(from_date)s and %(to_date)s
+            and ifnull(custom_deduction_fingerprint, '') != ''
+        group by rule_version
+        order by rule_version
+        """,
+        {"company": company, "from_date": from_date, "to_date": to_date},
+    )
+
+
+def iter_version_chunks(filters):
+    """Yield (after_name, upto_name) keyset bounds of the entries of one rule version"""
+    after_name = ""
+    while True:
+        names = frappe.db.sql(
+            """
+            select name from `tabPayment Entry`
+            where company = %(company)s and docstatus = 1
+                and payment_type = 'Receive' and party_type = 'Customer'
+                and posting_date between %(from_date)s and %(to_date)s
+                and custom_deduction_fingerprint like %(fingerprint_prefix)s
+                and name > %(after_name)s
+            order by name
+            limit %(limit)s
+            """,
+            dict(filters, after_name=after_name, limit=REPLAY_CHUNK_SIZE),
+            pluck=True,
+        )
+        if not names:
+            return
+        yield after_name, names[-1]
+        after_name = names[-1]
+
+
+def replay_deductions(company, from_date, to_date):
+    """
+    Recompute submitted deductions against the rules they were computed with
+
+    Entries are grouped by the rule version of their fingerprint; each
+    version's snapshot is loaded once and its entries are verified in
+    keyset chunks with the deduction verifier.
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+
+    Returns:
+        dict: versions (entries, mismatches and unverified amounts per rule version) and report rows
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.deduction_verifier import (
+        NOT_VERIFIED_ISSUE,
+        REPORT_COLUMNS,
+        verify_chunk,
+    )
+
+    versions = {}
+    mismatches = []
+    for rule_version, entries in get_rule_versions(company, from_date, to_date):
+        context = get_rule_version_context(rule_version)
+        versions[rule_version] = {
+            "entries": entries, "mismatches": 0, "not_verified": 0, "snapshot": bool(context)
+        }
+        if not context:
+            continue
+
+        filters = {
+            "company": company,
+            "from_date": from_date,
+            "to_date": to_date,
+            "fingerprint_prefix": rule_version + ":%",
+        }
+        for after_name, upto_name in iter_version_chunks(filters):
+            _upto, _count, rows = verify_chunk(after_name, upto_name, filters, context)
+            not_verified = sum(1 for row in rows if row[8] == NOT_VERIFIED_ISSUE)
+            versions[rule_version]["mismatches"] += len(rows) - not_verified
+            versions[rule_version]["not_verified"] += not_verified
+            mismatches.extend(
+                dict(zip(REPORT_COLUMNS, row, strict=True), rule_version=rule_version)
+                for row in rows[:max(REPLAY_MISMATCH_LIMIT - len(mismatches), 0)]
+            )
+
+    return {"versions": versions, "mismatches": mismatches}
+
+
+@frappe.whitelist()
+@frappe.read_only()
+def replay_deductions_by_fingerprint(company, from_date, to_date):
+    """
+    Replay deductions of a period grouped by rule version
+
+    Returns:
+        dict: versions and the first REPLAY_MISMATCH_LIMIT mismatch rows
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    try:
+        return replay_deductions(company, from_date, to_date)
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), _("Error replaying deductions"))
+        frappe.throw(_("Error replaying deductions: {0}").format(str(e)))
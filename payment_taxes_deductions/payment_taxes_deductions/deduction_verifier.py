@@ -0,0 +1,588 @@
+"""
+Deduction Verifier
+Compare deductions stored on submitted Payment Entries with recomputed ones
+
+Payment Entries are split into keyset chunks on name and verified in a process
+pool; each worker opens its own database connection. Expected deductions are
+recomputed with the current configuration, or with the configuration as of a
+date rebuilt from the Version history of Stamp Tax Calculation Rules and
+Payment Deductions Accounts. Mismatches are written to a CSV report (one row per
+Payment Entry and account with the amount delta) and summarised by account.
+
+Under the "Cumulative per Fiscal Year" threshold basis, commercial profits
+depend on the customer's running total at submit time, which is not rebuilt
+here: those amounts are not verified, and entries whose stored amount differs
+from the per-payment amount are reported with the "Cumulative Basis" issue
+and counted apart from mismatches.
+
+Chunks are written in order and the last finished chunk is recorded in a
+Deduction Job Checkpoint together with the report size, so an interrupted run
+resumes after that chunk without duplicating report rows.
+
+Chunk bounds and worker reads go to the read replica when one is configured
+(see read_replica); the checkpoint and report stay on the primary.
+
+Structure:
+1. Rule Context (current or as of a date)
+2. Chunk Verification (worker processes)
+3. Job
+4. API Methods
+"""
+
+import csv
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, get_datetime
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    TAX_ACCOUNT_FIELDS,
+    compile_brackets,
+    evaluate_deductions,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.deduction_job_checkpoint.deduction_job_checkpoint import (
+    get_checkpoint,
+    get_checkpoint_state,
+    save_checkpoint,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+    get_deduction_settings,
+)
+from payment_taxes_deductions.payment_taxes_deductions.payment_entry import (
+    calculate_reference_deductions,
+    get_settled_deductions,
+)
+from payment_taxes_deductions.payment_taxes_deductions.read_replica import (
+    replica_connection,
+    use_replica,
+)
+from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import (
+    get_reference_expectation_rows,
+)
+
+JOB_TYPE = "Deduction Verification"
+
+CHUNK_SIZE = 2000
+
+# Differences below this are rounding, not mismatches
+TOLERANCE = 0.05
+
+REPORT_COLUMNS = (
+    "payment_entry",
+    "posting_date",
+    "customer",
+    "account",
+    "tax_type",
+    "stored",
+    "expected",
+    "delta",
+    "issue",
+)
+
+CUMULATIVE_BASIS = "Cumulative per Fiscal Year"
+
+# Report issue of amounts the verifier cannot recompute
+NOT_VERIFIED_ISSUE = "Cumulative Basis"
+
+RANGE_FIELDS = (
+    "from_amount",
+    "to_amount",
+    "percentage",
+    "subtract_amount",
+    "add_amount",
+    "check_stamp_amount",
+    "ats_tax_amount",
+    "additional_stamp_multiplier",
+)
+
+
+# ============================================================================
+# SECTION 1: RULE CONTEXT (CURRENT OR AS OF A DATE)
+# ============================================================================
+
+def revert_to(doctype, name, values, tables, as_of):
+    """
+    Undo the Version history of a document recorded after as_of
+
+    Args:
+        doctype: DocType of the document
+        name: Document name
+        values: Field values of the current document (updated in place)
+        tables: {table fieldname: [row dicts with name and idx]} (updated in place)
+        as_of: Datetime to rebuild the document at
+    """
+    for version_data in frappe.get_all(
+        "Version",
+        filters={"ref_doctype": doctype, "docname": name, "creation": [">", as_of]},
+        pluck="data",
+        order_by="creation desc",
+    ):
+        data = json.loads(version_data or "{}")
+
+        for fieldname, old, _new in data.get("changed") or []:
+            values[fieldname] = old
+
+        for table, row in data.get("added") or []:
+            tables[table] = [
+                current for current in tables.get(table, []) if current.get("name") != row.get("name")
+            ]
+
+        for table, row in data.get("removed") or []:
+            tables.setdefault(table, []).append(row)
+
+        for table, _idx, row_name, changes in data.get("row_changed") or []:
+            for current in tables.get(table, []):
+                if current.get("name") == row_name:
+                    for fieldname, old, _new in changes:
+                        current[fieldname] = old
+
+    for rows in tables.values():
+        rows.sort(key=lambda row: cint(row.get("idx")))
+
+
+def build_rule_context(company, as_of=None):
+    """
+    Collect everything a worker needs to recompute deductions of a company
+
+    Args:
+        company: Company name
+        as_of: Rebuild the configuration at this datetime (current when empty)
+
+    Returns:
+        dict: brackets, profiles by customer group, allocation mode and threshold basis
+    """
+    as_of = get_datetime(as_of) if as_of else None
+
+    ranges = []
+    rules = frappe.db.get_value(
+        "Stamp Tax Calculation Rules", {"company": company}, ["name", "creation"], as_dict=True
+    )
+    if rules and not (as_of and rules.creation > as_of):
+        # Keyed by the table fieldname, as in Version data
+        tables = {
+            "stamp_tax_range": frappe.get_all(
+                "Stamp Tax Range",
+                filters={"parent": rules.name, "parenttype": "Stamp Tax Calculation Rules"},
+                fields=["name", "idx", *RANGE_FIELDS],
+                order_by="idx asc",
+            )
+        }
+        if as_of:
+            revert_to("Stamp Tax Calculation Rules", rules.name, {}, tables, as_of)
+        ranges = tables["stamp_tax_range"]
+
+    profiles = {}
+    for profile in frappe.get_all(
+        "Payment Deductions Accounts",
+        filters={"company": company, "payment_type": "Receive"},
+        fields=["name", "creation", "customer_group", *TAX_ACCOUNT_FIELDS],
+    ):
+        if as_of:
+            if profile.creation > as_of:
+                continue
+            revert_to("Payment Deductions Accounts", profile.name, profile, {}, as_of)
+
+        values = {field: profile.get(field) or "" for field in TAX_ACCOUNT_FIELDS}
+        profiles[profile.customer_group or ""] = values
+        # Company-only lookups resolve to the first profile, like frappe.db.get_value
+        profiles.setdefault("", values)
+
+    settings = get_deduction_settings()
+    return {
+        "brackets": compile_brackets(ranges),
+        "profiles": profiles,
+        "mode": settings.deduction_allocation_mode or "Aggregate",
+        "threshold_basis": settings.commercial_profits_threshold_basis or "Per Payment",
+    }
+
+
+# ============================================================================
+# SECTION 2: CHUNK VERIFICATION (WORKER PROCESSES)
+# ============================================================================
+
+def _init_worker(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    # Workers only read
+    use_replica()
+
+
+def calculate_expected(entry, references, context):
+    """
+    Recompute the deductions of one Payment Entry (same rules as before_validate)
+
+    Args:
+        entry: Payment Entry row
+        references: Payment Entry Reference rows of the entry
+        context: Rule context from build_rule_context()
+
+    Returns:
+        tuple: (profile, {tax_type: expected amount})
+    """
+    profile = context["profiles"].get(entry.customer_group or "") or {}
+    if not any(profile.values()):
+        return profile, {}
+
+    # Invoices without stored expectations are evaluated with the same (as-of) rules
+    expected_rows = get_reference_expectation_rows(
+        references, entry.company, entry.customer_group, context
+    )
+    exchange_rate = flt(entry.source_exchange_rate) or 1
+
+    expected = None
+    if context["mode"] != "Aggregate":
+        rows = [(ref, values) for ref, values in expected_rows if flt(ref.allocated_amount) > 0]
+        if rows:
+            reference_amounts, _totals = calculate_reference_deductions(
+                rows, context["brackets"], profile, context["mode"], exchange_rate
+            )
+            expected = get_settled_deductions(
+                reference_amounts, [ref.custom_deduction_amount for ref, _values in rows]
+            )
+
+    if expected is None:
+        expected = evaluate_deductions(
+            entry.paid_amount, context["brackets"], profile, exchange_rate=exchange_rate
+        )
+        if profile.get("vat_20_percent") and profile.get("vat_tax"):
+            vat_20_amount = sum(flt(values.get("vat_20_percent")) for _ref, values in expected_rows)
+            if vat_20_amount > 0:
+                expected["vat_20_percent"] = vat_20_amount
+
+    if profile.get("contract_stamp") and cint(entry.contract_papers_qty) > 0:
+        expected["contract_stamp"] = cint(entry.contract_papers_qty) * 3 * 0.90 / exchange_rate
+
+    return profile, expected
+
+
+def verify_chunk(after_name, upto_name, filters, context):
+    """
+    Verify Payment Entries with after_name < name <= upto_name (runs in a worker)
+
+    Returns:
+        tuple: (upto_name, entries verified, mismatch rows)
+    """
+    values = dict(filters, after_name=after_name, upto_name=upto_name)
+    condition = """
+        pe.company = %(company)s
+        and pe.docstatus = 1
+        and pe.payment_type = 'Receive'
+        and pe.party_type = 'Customer'
+        and pe.posting_date between %(from_date)s and %(to_date)s
+        and pe.name > %(after_name)s and pe.name <= %(upto_name)s
+    """
+    # Fingerprint replay verifies the entries of one rule version only
+    if filters.get("fingerprint_prefix"):
+        condition += " and pe.custom_deduction_fingerprint like %(fingerprint_prefix)s"
+
+    entries = frappe.db.sql(
+        f"""
+        select pe.name, pe.company, pe.posting_date, pe.party, pe.paid_amount,
+            pe.source_exchange_rate, pe.contract_papers_qty,
+            coalesce(nullif(pe.custom_customer_group, ''), customer.customer_group) as customer_group
+        from `tabPayment Entry` pe
+        left join `tabCustomer` customer on customer.name = pe.party
+        where {condition}
+        """,
+        values,
+        as_dict=True,
+    )
+    if not entries:
+        return upto_name, 0, []
+
+    stored = {}
+    for row in frappe.db.sql(
+        f"""
+        select tax.parent,
+            coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head) as account,
+            tax.tax_amount
+        from `tabAdvance Taxes and Charges` tax
+        inner join `tabPayment Entry` pe on pe.name = tax.parent
+        where tax.parenttype = 'Payment Entry' and tax.add_deduct_tax = 'Deduct'
+            and {condition}
+        """,
+        values,
+        as_dict=True,
+    ):
+        accounts = stored.setdefault(row.parent, {})
+        accounts.setdefault(row.account, []).append(flt(row.tax_amount))
+
+    references = {}
+    for row in frappe.db.sql(
+        f"""
+        select ref.parent, ref.reference_doctype, ref.reference_name, ref.allocated_amount,
+            ref.custom_deduction_amount
+        from `tabPayment Entry Reference` ref
+        inner join `tabPayment Entry` pe on pe.name = ref.parent
+        where ref.parenttype = 'Payment Entry' and {condition}
+        order by ref.idx
+        """,
+        values,
+        as_dict=True,
+    ):
+        references.setdefault(row.parent, []).append(row)
+
+    mismatches = []
+    for entry in entries:
+        profile, expected = calculate_expected(entry, references.get(entry.name, []), context)
+        stored_accounts = stored.get(entry.name, {})
+
+        account_tax_types = {
+            account: tax_type
+            for tax_type, account in profile.items()
+            if account and tax_type != "vat_tax"
+        }
+        for account, tax_type in account_tax_types.items():
+            amounts = stored_accounts.get(account, [])
+            stored_amount = sum(amounts)
+            expected_amount = flt(expected.get(tax_type))
+            delta = stored_amount - expected_amount
+
+            if len(amounts) > 1:
+                issue = "Duplicate Rows"
+            elif abs(delta) <= TOLERANCE:
+                continue
+            elif tax_type == "commercial_profits" and context.get("threshold_basis") == CUMULATIVE_BASIS:
+                issue = NOT_VERIFIED_ISSUE
+            elif not amounts:
+                issue = "Missing"
+            elif not expected_amount:
+                issue = "Unexpected"
+            else:
+                issue = "Amount"
+
+            mismatches.append((
+                entry.name,
+                str(entry.posting_date),
+                entry.party,
+                account,
+                tax_type,
+                flt(stored_amount, 2),
+                flt(expected_amount, 2),
+                flt(delta, 2),
+                issue,
+            ))
+
+    return upto_name, len(entries), mismatches
+
+
+def iter_chunk_bounds(filters, after_name="", db=None):
+    """
+    Yield (after_name, upto_name) keyset bounds of CHUNK_SIZE Payment Entries
+
+    Args:
+        filters: company, from_date and to_date
+        after_name: Start after this Payment Entry (from the checkpoint)
+        db: Connection to read from (defaults to frappe.db)
+    """
+    db = db or frappe.db
+    condition = """
+        company = %(company)s
+        and docstatus = 1
+        and payment_type = 'Receive'
+        and party_type = 'Customer'
+        and posting_date between %(from_date)s and %(to_date)s
+        and name > %(after_name)s
+    """
+    while True:
+        values = dict(filters, after_name=after_name)
+        upto_name = db.sql(
+            f"""
+            select name from `tabPayment Entry` where {condition}
+            order by name limit 1 offset {CHUNK_SIZE - 1}
+            """,
+            values,
+        )
+        if not upto_name:
+            last_name = db.sql(
+                f"select max(name) from `tabPayment Entry` where {condition}",
+                values,
+            )[0][0]
+            if last_name:
+                yield after_name, last_name
+            return
+
+        yield after_name, upto_name[0][0]
+        after_name = upto_name[0][0]
+
+
+# ============================================================================
+# SECTION 3: JOB
+# ============================================================================
+
+def get_report_path(checkpoint_name):
+    folder = frappe.get_site_path("private", "files", "deduction_verification")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{frappe.scrub(checkpoint_name)}.csv")
+
+
+def verify_deductions(company, from_date, to_date, as_of=None, workers=None):
+    """
+    Background job: verify all submitted customer Payment Entries of a period
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        as_of: Recompute with the configuration as of this datetime
+        workers: Number of worker processes (defaults to CPU count)
+    """
+    checkpoint = get_checkpoint(JOB_TYPE, get_checkpoint_key(company, from_date, to_date, as_of))
+    if checkpoint.status == "Completed":
+        return
+
+    save_checkpoint(checkpoint, status="Running", error=None)
+
+    state = get_checkpoint_state(checkpoint)
+    summary = state.get("summary") or {}
+    processed = cint(checkpoint.processed_count)
+
+    # Drop report rows written after the last checkpoint
+    report_path = get_report_path(checkpoint.name)
+    with open(report_path, "a+") as report:
+        report.truncate(cint(state.get("offset")))
+
+    filters = {"company": company, "from_date": from_date, "to_date": to_date}
+    context = build_rule_context(company, as_of)
+    workers = cint(workers) or os.cpu_count() or 1
+
+    pending = deque()
+
+    def flush(limit):
+        nonlocal processed
+        while len(pending) > limit:
+            upto_name, count, mismatches = pending.popleft().result()
+            writer.writerows(mismatches)
+            report.flush()
+
+            processed += count
+            for row in mismatches:
+                account = summary.setdefault(row[3], {"tax_type": row[4], "count": 0, "delta": 0})
+                if row[8] == NOT_VERIFIED_ISSUE:
+                    account["not_verified"] = account.get("not_verified", 0) + 1
+                    continue
+                account["count"] += 1
+                account["delta"] = flt(account["delta"] + row[7], 2)
+
+            save_checkpoint(
+                checkpoint,
+                last_value=upto_name,
+                processed_count=processed,
+                state={"offset": report.tell(), "summary": summary},
+            )
+
+    try:
+        with open(report_path, "a", newline="") as report:
+            writer = csv.writer(report)
+            if not report.tell():
+                writer.writerow(REPORT_COLUMNS)
+
+            # spawn, so every worker opens its own database connection
+            with replica_connection() as db, ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(frappe.local.site, frappe.local.sites_path),
+            ) as pool:
+                for after_name, upto_name in iter_chunk_bounds(
+                    filters, checkpoint.last_value or "", db
+                ):
+                    pending.append(pool.submit(verify_chunk, after_name, upto_name, filters, context))
+                    flush(workers * 2)
+
+                flush(0)
+
+        attach_report(company, checkpoint.name, report_path)
+        save_checkpoint(checkpoint, status="Completed")
+
+    except Exception:
+        frappe.db.rollback()
+        save_checkpoint(checkpoint, status="Failed", error=frappe.get_traceback())
+        frappe.log_error(frappe.get_traceback(), _("Error verifying payment deductions"))
+        raise
+
+
+def attach_report(company, checkpoint_name, report_path):
+    file_name = os.path.basename(report_path)
+    file_url = "/private/files/deduction_verification/" + file_name
+    if not frappe.db.exists("File", {"file_url": file_url}):
+        frappe.get_doc({
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": file_url,
+            "attached_to_doctype": "Company",
+            "attached_to_name": company,
+            "is_private": 1,
+        }).insert(ignore_permissions=True)
+
+
+def get_checkpoint_key(company, from_date, to_date, as_of=None):
+    return "{}:{}:{}:{}".format(company, from_date, to_date, as_of or "current")
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def enqueue_deduction_verification(company, from_date, to_date, as_of=None, restart=0):
+    """
+    Enqueue verification of stored deductions for a company and period
+    Re-enqueueing an interrupted run resumes after the last verified chunk
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        as_of: Recompute with the configuration as of this datetime (current when empty)
+        restart: Start over instead of resuming
+
+    Returns:
+        str: Name of the Deduction Job Checkpoint tracking progress
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    checkpoint = get_checkpoint(JOB_TYPE, get_checkpoint_key(company, from_date, to_date, as_of))
+    if cint(restart):
+        save_checkpoint(
+            checkpoint, status="Queued", last_value=None, processed_count=0, state={}, error=None
+        )
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.deduction_verifier.verify_deductions",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id="deduction-verification-" + checkpoint.name,
+        deduplicate=True,
+        company=company,
+        from_date=from_date,
+        to_date=to_date,
+        as_of=as_of,
+    )
+
+    return checkpoint.name
+
+
+@frappe.whitelist()
+def get_verification_summary(company, from_date, to_date, as_of=None):
+    """
+    Get progress and the mismatch summary by account of a verification run
+
+    Returns:
+        dict: status, processed count, summary by account and report URL
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    checkpoint = get_checkpoint(JOB_TYPE, get_checkpoint_key(company, from_date, to_date, as_of))
+    return {
+        "status": checkpoint.status,
+        "processed": cint(checkpoint.processed_count),
+        "summary": get_checkpoint_state(checkpoint).get("summary") or {},
+        "report_url": f"/private/files/deduction_verification/{frappe.scrub(checkpoint.name)}.csv",
+        "error": checkpoint.error,
+    }
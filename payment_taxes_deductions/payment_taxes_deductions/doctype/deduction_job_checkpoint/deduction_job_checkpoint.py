@@ -0,0 +1,64 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe.model.document import Document
+
+
+class DeductionJobCheckpoint(Document):
+    def autoname(self):
+        self.name = get_checkpoint_name(self.job_type, self.checkpoint_key)
+
+
+def get_checkpoint_name(job_type, checkpoint_key):
+    return f"{job_type}-{checkpoint_key}"
+
+
+def get_checkpoint(job_type, checkpoint_key):
+    """
+    Get the checkpoint of a resumable job, creating it on first use
+
+    Args:
+        job_type: Job identifier (e.g. "Withholding Certificates")
+        checkpoint_key: Key of the run within the job (company, period, ...)
+
+    Returns:
+        Document: Deduction Job Checkpoint
+    """
+    name = get_checkpoint_name(job_type, checkpoint_key)
+    if frappe.db.exists("Deduction Job Checkpoint", name):
+        return frappe.get_doc("Deduction Job Checkpoint", name)
+
+    checkpoint = frappe.get_doc({
+        "doctype": "Deduction Job Checkpoint",
+        "job_type": job_type,
+        "checkpoint_key": checkpoint_key,
+        "status": "Queued",
+    })
+    checkpoint.insert(ignore_permissions=True)
+    frappe.db.commit()
+    return checkpoint
+
+
+def save_checkpoint(checkpoint, commit=True, **values):
+    """
+    Persist checkpoint progress without loading or validating the document
+
+    Args:
+        checkpoint: Deduction Job Checkpoint document
+        commit: Commit the transaction so progress survives an interruption
+        values: Fields to update (state is stored as JSON)
+    """
+    if "state" in values and not isinstance(values["state"], str):
+        values["state"] = json.dumps(values["state"], separators=(",", ":"), default=str)
+
+    checkpoint.update(values)
+    frappe.db.set_value("Deduction Job Checkpoint", checkpoint.name, values, update_modified=True)
+    if commit:
+        frappe.db.commit()
+
+
+def get_checkpoint_state(checkpoint):
+    return json.loads(checkpoint.state) if checkpoint.state else {}
@@ -0,0 +1,62 @@
+// Copyright (c) 2026, abdopcnet@gmail.com and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Deduction Profile Log', {
+	refresh(frm) {
+		renderFlameGraph(frm);
+	},
+});
+
+/**
+ * Render the stored call tree as a flame graph (callers on top, width = time)
+ * @param {Object} frm - Frappe form object
+ */
+function renderFlameGraph(frm) {
+	let wrapper = frm.get_field('flame_graph').$wrapper;
+	wrapper.empty();
+
+	let tree = frm.doc.call_tree;
+	if (typeof tree === 'string') {
+		tree = tree ? JSON.parse(tree) : null;
+	}
+	if (!tree || !tree.t) {
+		wrapper.html(`<div class="text-muted">${__('No call tree recorded')}</div>`);
+		return;
+	}
+
+	const row_height = 20;
+	let bars = [];
+	let max_depth = 0;
+
+	// Children are laid out left to right inside their parent's width
+	let walk = (node, left, depth) => {
+		max_depth = Math.max(max_depth, depth);
+		bars.push({ node: node, left: left, depth: depth });
+		let offset = left;
+		(node.c || []).forEach((child) => {
+			walk(child, offset, depth + 1);
+			offset += child.t;
+		});
+	};
+	walk(tree, 0, 0);
+
+	let html = bars
+		.map((bar) => {
+			let width = (bar.node.t / tree.t) * 100;
+			let title = `${bar.node.n} (${bar.node.f}) ${bar.node.t} ms`;
+			let hue = 20 + ((bar.depth * 37) % 40);
+			return `<div title="${frappe.utils.escape_html(title)}"
+				style="position:absolute; top:${bar.depth * row_height}px;
+				left:${(bar.left / tree.t) * 100}%; width:${width}%; height:${row_height - 1}px;
+				background:hsl(${hue}, 85%, 60%); overflow:hidden; white-space:nowrap;
+				font-size:11px; line-height:${row_height - 1}px; padding:0 3px;
+				box-sizing:border-box; border-right:1px solid #fff;">
+				${width > 3 ? frappe.utils.escape_html(bar.node.n) : ''}
+			</div>`;
+		})
+		.join('');
+
+	wrapper.html(
+		`<div style="position:relative; width:100%; height:${(max_depth + 1) * row_height}px;">${html}</div>`,
+	);
+}
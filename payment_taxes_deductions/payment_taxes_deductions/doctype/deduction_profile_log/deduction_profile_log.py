@@ -0,0 +1,15 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class DeductionProfileLog(Document):
+    @staticmethod
+    def clear_old_logs(days=30):
+        from frappe.query_builder import Interval
+        from frappe.query_builder.functions import Now
+
+        table = frappe.qb.DocType("Deduction Profile Log")
+        frappe.db.delete(table, filters=(table.modified < (Now() - Interval(days=days))))
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, abdopcnet@gmail.com and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Deduction Rule Version", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,18 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class DeductionRunningTotal(Document):
+    pass
+
+
+def on_doctype_update():
+    """One running total per company, customer, fiscal year and tax type"""
+    frappe.db.add_unique(
+        "Deduction Running Total",
+        ["company", "customer", "fiscal_year", "tax_type"],
+        constraint_name="unique_running_total",
+    )
@@ -6,9 +6,78 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils import flt
 
+from payment_taxes_deductions.payment_taxes_deductions.config_cache import (
+    get_bracket_table,
+    get_profile_record,
+)
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    TAX_ACCOUNT_FIELDS,
+    clear_deduction_cache,
+    find_bracket,
+)
+from payment_taxes_deductions.payment_taxes_deductions.deduction_errors import (
+    log_deduction_error,
+)
+
 
 class PaymentDeductionsAccounts(Document):
-    pass
+    def autoname(self):
+        self.set_party_group()
+        self.name = f"{self.party_group}-{self.company}"
+        if self.payment_type == "Pay":
+            self.name += "-Pay"
+
+    def validate(self):
+        self.set_party_group()
+        # Bulk saves check the whole set in one pass (deduction_configuration.validate_profiles)
+        if not self.flags.skip_duplicate_check:
+            self.validate_duplicate_profile()
+
+    def set_party_group(self):
+        """Customer Group of Receive profiles, Supplier Group of Pay profiles"""
+        if self.payment_type == "Pay":
+            self.customer_group = None
+            self.party_group = self.supplier_group
+        else:
+            self.supplier_group = None
+            self.party_group = self.customer_group
+
+    def validate_duplicate_profile(self):
+        """One profile per company, payment type and party group"""
+        existing = frappe.db.get_value(
+            "Payment Deductions Accounts",
+            {
+                "company": self.company,
+                "payment_type": self.payment_type,
+                "party_group": self.party_group,
+                "name": ("!=", self.name),
+            },
+            "name",
+        )
+        if existing:
+            frappe.throw(
+                _("Payment Deductions Accounts {0} already exists for company {1} and group {2}").format(
+                    existing, self.company, self.party_group
+                ),
+                frappe.DuplicateEntryError,
+            )
+
+    def on_update(self):
+        clear_deduction_cache()
+
+    def on_trash(self):
+        clear_deduction_cache()
+
+    def after_rename(self, old, new, merge=False):
+        clear_deduction_cache()
+
+
+def on_doctype_update():
+    frappe.db.add_unique(
+        "Payment Deductions Accounts",
+        ["company", "payment_type", "party_group"],
+        constraint_name="unique_company_payment_type_party_group",
+    )
 
 
 @frappe.whitelist()
@@ -35,63 +104,21 @@ def get_tax_accounts(company=None, customer_group=None):
         if not company:
             frappe.throw(_("Company is required"))
 
-        # Build filters: company is required, customer_group is optional
-        filters = {"company": company}
-        if customer_group:
-            filters["customer_group"] = customer_group
+        # Missing profiles are cached too (all accounts empty), so they cost no query
+        return get_tax_accounts_dict(get_profile_record(company, customer_group, "Receive"))
+    except Exception:
+        log_deduction_error(_("Error getting tax accounts"))
 
-        # Get account settings for this company and customer_group
-        settings = frappe.get_value(
-            "Payment Deductions Accounts",
-            filters,
-            [
-                "commercial_profits",
-                "regular_stamp",
-                "additional_stamp",
-                "contract_stamp",
-                "check_stamp",
-                "applied_professions_tax",
-                "medical_professions_tax",
-                "vat_20_percent",
-                "vat_tax",
-                "qaderon_difference",
-            ],
-            as_dict=True,
-        )
+    # Return empty dict if not found
+    return get_tax_accounts_dict()
 
-        if settings:
-            return {
-                "commercial_profits": settings.commercial_profits or "",
-                "regular_stamp": settings.regular_stamp or "",
-                "additional_stamp": settings.additional_stamp or "",
-                "contract_stamp": settings.contract_stamp or "",
-                "check_stamp": settings.check_stamp or "",
-                "applied_professions_tax": settings.applied_professions_tax or "",
-                "medical_professions_tax": settings.medical_professions_tax or "",
-                "vat_20_percent": settings.vat_20_percent or "",
-                "vat_tax": settings.vat_tax or "",
-                "qaderon_difference": settings.qaderon_difference or "",
-            }
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(),
-                         _("Error getting tax accounts"))
 
-    # Return empty dict if not found
-    return {
-        "commercial_profits": "",
-        "regular_stamp": "",
-        "additional_stamp": "",
-        "contract_stamp": "",
-        "check_stamp": "",
-        "applied_professions_tax": "",
-        "medical_professions_tax": "",
-        "vat_20_percent": "",
-        "vat_tax": "",
-        "qaderon_difference": "",
-    }
-
-
-def get_tax_account(tax_type, company=None, customer_group=None):
+def get_tax_accounts_dict(record=None):
+    """All tax types with their account name ("" when not configured)"""
+    return {tax_type: (record.get(tax_type) if record is not None else "") or "" for tax_type in TAX_ACCOUNT_FIELDS}
+
+
+def get_tax_account(tax_type, company=None, customer_group=None, payment_type="Receive"):
     """
     Get tax account name from Payment Deductions Accounts based on company and customer_group
     Returns empty string if not found
@@ -103,6 +130,7 @@ def get_tax_account(tax_type, company=None, customer_group=None):
             tax_type: Type of tax (e.g., 'commercial_profits', 'regular_stamp', etc.)
             company: Company name (optional, uses default company if not provided)
             customer_group: Customer Group name (optional, filters by company only if not provided)
+            payment_type: "Pay" to read the Supplier Group profile named by customer_group
 
     Returns:
             str: Account name or empty string
@@ -115,23 +143,13 @@ def get_tax_account(tax_type, company=None, customer_group=None):
         if not company:
             return ""
 
-        # Build filters: company is required, customer_group is optional
-        filters = {"company": company}
-        if customer_group:
-            filters["customer_group"] = customer_group
-
-        # Get account for this tax type, company and customer_group
-        account = frappe.get_value(
-            "Payment Deductions Accounts",
-            filters,
-            tax_type,
-        )
+        # Get account for this tax type from the worker's config LRU
+        account = get_profile_record(company, customer_group, payment_type).get(tax_type)
 
         return account or ""
 
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(),
-                         _("Error getting tax account"))
+    except Exception:
+        log_deduction_error(_("Error getting tax account"))
         return ""
 
 
@@ -158,52 +176,14 @@ def get_stamp_tax_rule(total, company=None):
         if not company:
             return None
 
-        # Get Stamp Tax Calculation Rules name for this company
-        rules_name = frappe.db.get_value(
-            "Stamp Tax Calculation Rules",
-            {"company": company},
-            "name"
-        )
-
-        if not rules_name:
-            return None
-
-        # Get Stamp Tax Calculation Rules document
-        rules_doc = frappe.get_doc("Stamp Tax Calculation Rules", rules_name)
-
-        if not rules_doc or not rules_doc.stamp_tax_range:
-            return None
-
-        # Find matching range
-        total = flt(total)
-        for range_row in rules_doc.stamp_tax_range:
-            from_amount = flt(range_row.from_amount or 0)
-            to_amount = flt(range_row.to_amount or 999999999)
-
-            # Check if total falls within this range
-            if from_amount <= total <= to_amount:
-                return {
-                    "from_amount": from_amount,
-                    "to_amount": to_amount,
-                    "percentage": flt(range_row.percentage or 0),
-                    "subtract_amount": flt(range_row.subtract_amount or 0),
-                    "add_amount": flt(range_row.add_amount or 0),
-                    "check_stamp_amount": flt(range_row.check_stamp_amount or 0),
-                    "ats_tax_amount": flt(range_row.ats_tax_amount or 0),
-                    "additional_stamp_multiplier": flt(
-                        range_row.additional_stamp_multiplier or 3
-                    ),
-                }
-
-        return None
+        # Find matching range in the compiled bracket table of this company (worker LRU)
+        return find_bracket(get_bracket_table(company), total)
 
     except frappe.DoesNotExistError:
         # No rules found for this company
         return None
-    except Exception as e:
-        frappe.log_error(
-            frappe.get_traceback(), _("Error getting stamp tax rule")
-        )
+    except Exception:
+        log_deduction_error(_("Error getting stamp tax rule"))
         return None
 
 
@@ -231,52 +211,10 @@ def get_tax_accounts_by_customer_group(company=None, customer_group=None):
         if not customer_group:
             frappe.throw(_("Customer Group is required"))
 
-        # Get account settings for this company and customer_group
-        settings = frappe.get_value(
-            "Payment Deductions Accounts",
-            {"company": company, "customer_group": customer_group},
-            [
-                "commercial_profits",
-                "regular_stamp",
-                "additional_stamp",
-                "contract_stamp",
-                "check_stamp",
-                "applied_professions_tax",
-                "medical_professions_tax",
-                "vat_20_percent",
-                "vat_tax",
-                "qaderon_difference",
-            ],
-            as_dict=True,
-        )
-
-        if settings:
-            return {
-                "commercial_profits": settings.commercial_profits or "",
-                "regular_stamp": settings.regular_stamp or "",
-                "additional_stamp": settings.additional_stamp or "",
-                "contract_stamp": settings.contract_stamp or "",
-                "check_stamp": settings.check_stamp or "",
-                "applied_professions_tax": settings.applied_professions_tax or "",
-                "medical_professions_tax": settings.medical_professions_tax or "",
-                "vat_20_percent": settings.vat_20_percent or "",
-                "vat_tax": settings.vat_tax or "",
-                "qaderon_difference": settings.qaderon_difference or "",
-            }
-    except Exception as e:
-        frappe.log_error(frappe.get_traceback(),
-                         _("Error getting tax accounts by customer group"))
+        # Missing profiles are cached too (all accounts empty), so they cost no query
+        return get_tax_accounts_dict(get_profile_record(company, customer_group, "Receive"))
+    except Exception:
+        log_deduction_error(_("Error getting tax accounts by customer group"))
 
     # Return empty dict if not found
-    return {
-        "commercial_profits": "",
-        "regular_stamp": "",
-        "additional_stamp": "",
-        "contract_stamp": "",
-        "check_stamp": "",
-        "applied_professions_tax": "",
-        "medical_professions_tax": "",
-        "vat_20_percent": "",
-        "vat_tax": "",
-        "qaderon_difference": "",
-    }
+    return get_tax_accounts_dict()
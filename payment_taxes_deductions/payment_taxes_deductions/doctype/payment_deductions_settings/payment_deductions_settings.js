@@ -0,0 +1,8 @@
+// Copyright (c) 2026, abdopcnet@gmail.com and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Payment Deductions Settings", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,35 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PaymentDeductionsSettings(Document):
+    pass
+
+
+def get_deduction_settings():
+    """
+    Get Payment Deductions Settings from the document cache
+
+    Returns:
+        Document: Payment Deductions Settings (cleared automatically on save)
+    """
+    return frappe.get_cached_doc("Payment Deductions Settings")
+
+
+def get_clearing_account(company):
+    """
+    Get the clearing account of a company for consolidated deduction posting
+
+    Args:
+        company: Company name
+
+    Returns:
+        str: Clearing account or None if the company has none
+    """
+    for row in get_deduction_settings().clearing_accounts:
+        if row.company == company:
+            return row.clearing_account
+    return None
@@ -5,9 +5,20 @@ import frappe
 from frappe.model.document import Document
 from frappe.utils import flt
 
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    clear_deduction_cache,
+)
+
 
 class StampTaxCalculationRules(Document):
-    pass
+    def on_update(self):
+        clear_deduction_cache()
+
+    def on_trash(self):
+        clear_deduction_cache()
+
+    def after_rename(self, old, new, merge=False):
+        clear_deduction_cache()
 
 
 @frappe.whitelist()
@@ -0,0 +1,173 @@
+"""
+Deduction Exchange Rates
+Resolve exchange rates to company currency for deduction evaluation
+
+Stamp brackets and thresholds are defined in company currency, so amounts in
+another currency are converted before evaluation and the deductions converted
+back. Rates are resolved once per currency pair and date and memoized for the
+request or background job; batch paths can preload all Currency Exchange
+records of a date range in one query.
+
+Structure:
+1. Rate Cache
+2. Payment Entry Helpers
+"""
+
+from bisect import bisect_right
+
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate
+
+# ============================================================================
+# SECTION 1: RATE CACHE
+# ============================================================================
+
+def _get_rate_cache():
+    """Per request/job cache: {"rates": {(from, to, date): rate}, "tables": {(from, to): (dates, rates)}}"""
+    if not hasattr(frappe.local, "deduction_exchange_rates"):
+        frappe.local.deduction_exchange_rates = {"rates": {}, "tables": {}}
+    return frappe.local.deduction_exchange_rates
+
+
+def preload_exchange_rates(to_currency, from_currencies, to_date):
+    """
+    Load Currency Exchange records of several currencies in one query
+
+    Later get_exchange_rate() calls for these pairs resolve the latest record
+    on or before the date from memory.
+
+    Args:
+        to_currency: Company currency
+        from_currencies: Currencies to convert from
+        to_date: Latest date that will be looked up
+    """
+    from_currencies = [
+        currency for currency in set(from_currencies or []) if currency and currency != to_currency
+    ]
+    if not from_currencies:
+        return
+
+    tables = _get_rate_cache()["tables"]
+    for currency in from_currencies:
+        tables[(currency, to_currency)] = ([], [])
+
+    for from_currency, date, rate in frappe.db.sql(
+        """
+        select from_currency, date, exchange_rate
+        from `tabCurrency Exchange`
+        where to_currency = %(to_currency)s
+            and from_currency in %(from_currencies)s
+            and date <= %(to_date)s
+            and for_selling = 1
+        order by from_currency, date
+        """,
+        {"to_currency": to_currency, "from_currencies": from_currencies, "to_date": to_date},
+    ):
+        dates, rates = tables[(from_currency, to_currency)]
+        dates.append(getdate(date))
+        rates.append(flt(rate))
+
+
+def get_exchange_rate(from_currency, to_currency, date):
+    """
+    Get the exchange rate between two currencies on a date
+
+    Args:
+        from_currency: Currency of the amount
+        to_currency: Company currency
+        date: Transaction date
+
+    Returns:
+        float: Exchange rate (1 for the same currency)
+
+    Raises:
+        frappe.ValidationError: When a currency is missing or no rate is found,
+            a rate of 1 would silently mix currencies
+    """
+    if from_currency == to_currency:
+        return 1
+    if not from_currency or not to_currency:
+        frappe.throw(_("Currency is required to convert deductions to {0}").format(
+            to_currency or from_currency))
+
+    date = getdate(date)
+    cache = _get_rate_cache()
+    key = (from_currency, to_currency, date)
+    if key in cache["rates"]:
+        return cache["rates"][key]
+
+    rate = None
+    table = cache["tables"].get((from_currency, to_currency))
+    if table:
+        position = bisect_right(table[0], date) - 1
+        if position >= 0:
+            rate = table[1][position]
+
+    if not rate:
+        from erpnext.setup.utils import get_exchange_rate as get_erpnext_exchange_rate
+
+        rate = flt(get_erpnext_exchange_rate(from_currency, to_currency, date, "for_selling"))
+
+    if not rate:
+        frappe.throw(
+            _("No exchange rate from {0} to {1} on {2}, please create a Currency Exchange record").format(
+                from_currency, to_currency, frappe.format(date, "Date")
+            )
+        )
+
+    cache["rates"][key] = rate
+    return rate
+
+
+# ============================================================================
+# SECTION 2: PAYMENT ENTRY HELPERS
+# ============================================================================
+
+def get_deduction_exchange_rate(doc):
+    """
+    Exchange rate from the paid amount currency of a Payment Entry to company currency
+
+    Deductions are evaluated on paid_amount, which is in the currency of the
+    paid-from account in both directions: the party account when receiving
+    and the bank account when paying. source_exchange_rate converts it.
+
+    Args:
+        doc: Payment Entry document
+
+    Returns:
+        float: Exchange rate
+    """
+    rate = flt(doc.get("source_exchange_rate"))
+    if rate:
+        return rate
+
+    company_currency = frappe.get_cached_value("Company", doc.company, "default_currency")
+    return get_exchange_rate(
+        doc.get("paid_from_account_currency") or company_currency,
+        company_currency,
+        doc.get("posting_date"),
+    )
+
+
+def set_party_amount(doc, amount):
+    """
+    Set paid and received amounts of a Payment Entry from an amount in party account currency
+
+    Allocated amounts are in the currency of the party account; the other side
+    of the entry is converted with the source and target exchange rates the
+    way the Payment Entry form does.
+
+    Args:
+        doc: Payment Entry document with exchange rates set
+        amount: Amount in party account currency
+    """
+    source_rate = flt(doc.get("source_exchange_rate")) or 1
+    target_rate = flt(doc.get("target_exchange_rate")) or 1
+
+    if doc.get("payment_type") == "Pay":
+        doc.received_amount = flt(amount, doc.precision("received_amount"))
+        doc.paid_amount = flt(amount * target_rate / source_rate, doc.precision("paid_amount"))
+    else:
+        doc.paid_amount = flt(amount, doc.precision("paid_amount"))
+        doc.received_amount = flt(amount * source_rate / target_rate, doc.precision("received_amount"))
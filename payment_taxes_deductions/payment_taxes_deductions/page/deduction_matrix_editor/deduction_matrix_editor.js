@@ -0,0 +1,226 @@
+// ============================================================================
+// DEDUCTION MATRIX EDITOR
+// ============================================================================
+// Grid editor for Payment Deductions Accounts (party groups x deduction accounts)
+// and Stamp Tax Range tables, with CSV import/export
+// The whole grid is validated and saved in one call; the server writes it in bulk
+
+const CONFIGURATION_METHOD = 'payment_taxes_deductions.payment_taxes_deductions.deduction_configuration.';
+
+frappe.pages['deduction-matrix-editor'].on_page_load = function (wrapper) {
+	const page = frappe.ui.make_app_page({
+		parent: wrapper,
+		title: __('Deduction Matrix Editor'),
+		single_column: true,
+	});
+
+	wrapper.matrix_editor = new DeductionMatrixEditor(page);
+};
+
+class DeductionMatrixEditor {
+	constructor(page) {
+		this.page = page;
+		this.kind = 'profiles';
+		this.$grid = $('<div class="deduction-matrix-grid"></div>').appendTo(page.main);
+		this.$errors = $('<div class="deduction-matrix-errors mt-3"></div>').appendTo(page.main);
+
+		this.make_fields();
+		this.make_actions();
+		this.load();
+	}
+
+	make_fields() {
+		this.company_field = this.page.add_field({
+			fieldname: 'company',
+			fieldtype: 'Link',
+			options: 'Company',
+			label: __('Company'),
+			change: () => this.load(),
+		});
+
+		this.kind_field = this.page.add_field({
+			fieldname: 'kind',
+			fieldtype: 'Select',
+			label: __('Table'),
+			options: [
+				{ value: 'profiles', label: __('Deduction Profiles') },
+				{ value: 'brackets', label: __('Stamp Tax Ranges') },
+			],
+			default: 'profiles',
+			change: () => {
+				this.kind = this.kind_field.get_value() || 'profiles';
+				this.render();
+			},
+		});
+	}
+
+	make_actions() {
+		this.page.set_primary_action(__('Save'), () => this.save(false));
+		this.page.add_inner_button(__('Validate'), () => this.save(true));
+		this.page.add_inner_button(__('Add Row'), () => this.add_row());
+		this.page.add_menu_item(__('Import CSV'), () => this.import_csv());
+		this.page.add_menu_item(__('Export CSV'), () => this.export_csv());
+	}
+
+	load() {
+		frappe.call({
+			method: CONFIGURATION_METHOD + 'get_deduction_matrix',
+			args: { company: this.company_field.get_value() },
+			freeze: true,
+			callback: (r) => {
+				this.matrix = r.message;
+				this.render();
+			},
+		});
+	}
+
+	get_fields() {
+		return this.kind === 'profiles' ? this.matrix.profile_fields : this.matrix.bracket_fields;
+	}
+
+	get_rows() {
+		return this.kind === 'profiles' ? this.matrix.profiles : this.matrix.brackets;
+	}
+
+	render() {
+		if (!this.matrix) {
+			return;
+		}
+
+		const fields = this.get_fields();
+		const numeric = this.kind === 'brackets';
+		const columns = fields.map((fieldname) => ({
+			id: fieldname,
+			name: frappe.unscrub(fieldname),
+			editable: true,
+			width: fieldname === 'company' || fieldname === 'party_group' ? 180 : 150,
+			format: (value) => (value === undefined || value === null ? '' : value),
+			align: numeric && fieldname !== 'company' ? 'right' : 'left',
+		}));
+		const data = this.get_rows().map((row) => fields.map((fieldname) => row[fieldname]));
+
+		this.$errors.empty();
+		this.$grid.empty();
+		this.datatable = new frappe.DataTable(this.$grid.get(0), {
+			columns: columns,
+			data: data,
+			inlineFilters: true,
+			layout: 'fixed',
+			serialNoColumn: true,
+			checkboxColumn: false,
+		});
+	}
+
+	read_grid() {
+		// The serial number column is not one of the fields
+		const fields = this.get_fields();
+		const columns = this.datatable.getColumns();
+		return this.datatable.datamanager.getRows().map((row) => {
+			const values = {};
+			row.forEach((cell) => {
+				const fieldname = (columns[cell.colIndex] || {}).id;
+				if (fields.includes(fieldname)) {
+					values[fieldname] = cell.content;
+				}
+			});
+			return values;
+		});
+	}
+
+	add_row() {
+		const rows = this.read_grid();
+		const row = { company: this.company_field.get_value() || '' };
+		if (this.kind === 'profiles') {
+			row.payment_type = 'Receive';
+		}
+		rows.push(row);
+
+		if (this.kind === 'profiles') {
+			this.matrix.profiles = rows;
+		} else {
+			this.matrix.brackets = rows;
+		}
+		this.render();
+	}
+
+	save(validate_only) {
+		const rows = this.read_grid();
+		const args = { validate_only: validate_only ? 1 : 0 };
+		args[this.kind] = rows;
+
+		frappe.call({
+			method: CONFIGURATION_METHOD + 'save_deduction_matrix',
+			args: args,
+			freeze: true,
+			freeze_message: validate_only ? __('Validating...') : __('Saving...'),
+			callback: (r) => this.show_result(r.message, validate_only),
+		});
+	}
+
+	show_result(result, validate_only) {
+		const errors = (result.profile_errors || []).concat(result.bracket_errors || []);
+		this.$errors.empty();
+
+		if (errors.length) {
+			const items = errors
+				.map((error) => `<li>${__('Row {0}', [error.row])} · ${frappe.utils.escape_html(frappe.unscrub(error.field))}: ${frappe.utils.escape_html(error.message)}</li>`)
+				.join('');
+			this.$errors.html(`<div class="alert alert-danger"><b>${__('{0} errors', [errors.length])}</b><ul class="mb-0">${items}</ul></div>`);
+			return;
+		}
+
+		if (validate_only) {
+			frappe.show_alert({ message: __('No errors found'), indicator: 'green' });
+			return;
+		}
+
+		frappe.show_alert({ message: __('Deduction configuration saved'), indicator: 'green' });
+		this.load();
+	}
+
+	import_csv() {
+		const dialog = new frappe.ui.Dialog({
+			title: __('Import {0} from CSV', [this.kind === 'profiles' ? __('Deduction Profiles') : __('Stamp Tax Ranges')]),
+			fields: [
+				{
+					fieldname: 'file_url',
+					fieldtype: 'Attach',
+					label: __('CSV File'),
+					reqd: 1,
+					description: __('Same columns as Export CSV. Stamp Tax Ranges replace the table of each company in the file.'),
+				},
+				{
+					fieldname: 'validate_only',
+					fieldtype: 'Check',
+					label: __('Validate Only'),
+				},
+			],
+			primary_action_label: __('Import'),
+			primary_action: (values) => {
+				frappe.call({
+					method: CONFIGURATION_METHOD + 'import_deduction_csv',
+					args: {
+						kind: this.kind,
+						file_url: values.file_url,
+						validate_only: values.validate_only,
+					},
+					freeze: true,
+					freeze_message: __('Importing...'),
+					callback: (r) => {
+						dialog.hide();
+						this.show_result(r.message, values.validate_only);
+					},
+				});
+			},
+		});
+		dialog.show();
+	}
+
+	export_csv() {
+		const args = { kind: this.kind };
+		if (this.company_field.get_value()) {
+			args.company = this.company_field.get_value();
+		}
+		window.open(`/api/method/${CONFIGURATION_METHOD}export_deduction_csv?${$.param(args)}`);
+	}
+}
@@ -11,17 +11,44 @@ Structure:
 2. Tax Calculation Functions (for API)
 3. Contract Stamp Handling
 4. VAT 20% Handling
-5. Hook Functions (before_validate)
-6. API Methods
+5. Per-Reference Allocation
+6. Hook Functions (before_validate)
+7. API Methods
 """
 
 import frappe
 from frappe import _
 from frappe.utils import flt
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    evaluate_deductions,
+    get_compiled_brackets,
+    get_deduction_profile,
+    get_profile_direction,
+)
 from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_accounts.payment_deductions_accounts import (
+    get_stamp_tax_rule,
     get_tax_account,
-    get_stamp_tax_rule
 )
+from payment_taxes_deductions.payment_taxes_deductions.save_profiler import profile_slow_calls
+
+# Tax types computed per reference in per-reference allocation mode
+REFERENCE_TAX_TYPES = (
+    "commercial_profits",
+    "regular_stamp",
+    "additional_stamp",
+    "check_stamp",
+    "vat_20_percent",
+)
+
+# The settled amount of a reference includes its own deductions: fixed-point
+# iterations until it moves less than the tolerance
+SETTLEMENT_ITERATIONS = 10
+SETTLEMENT_TOLERANCE = 0.005
+
+# Settings, clearing, exchange rate, running total and invoice expectation
+# modules are imported where they are used, so API requests that only need
+# the calculators do not load them
 
 
 # ============================================================================
@@ -29,40 +56,46 @@ from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deduction
 # ============================================================================
 # Functions that update existing tax rows in the taxes table
 
-def calculate_commercial_profits_tax(taxes, total, company=None, customer_group=None):
+def calculate_commercial_profits_tax(taxes, total, company=None, customer_group=None,
+                                     exchange_rate=1, payment_type="Receive"):
     """
     Calculate commercial profits tax (ارباح تجارية)
     Tax rate: 1% if total > 300
 
     Args:
         taxes: Payment Entry taxes table
-        total: Paid amount
+        total: Paid amount in company currency
         company: Company name
         customer_group: Customer Group name (optional, for filtering accounts)
+        exchange_rate: Rate of the paid amount currency (tax rows are in that currency)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
     """
     commercial_profits_account = get_tax_account(
-        "commercial_profits", company, customer_group)
+        "commercial_profits", company, customer_group, payment_type)
     if not commercial_profits_account:
         return
 
     for tax in taxes:
         if tax.account_head == commercial_profits_account and total > 300:
-            tax.tax_amount = total * 0.01
+            tax.tax_amount = total * 0.01 / exchange_rate
 
 
-def calculate_regular_stamp_tax(taxes, total, company=None, customer_group=None):
+def calculate_regular_stamp_tax(taxes, total, company=None, customer_group=None,
+                                exchange_rate=1, payment_type="Receive"):
     """
     Calculate regular stamp tax (دمغة عادية) based on rules from Stamp Tax Calculation Rules DocType
     Formula: ((total - subtract_amount) * percentage / 100 + add_amount) / 4
 
     Args:
         taxes: Payment Entry taxes table
-        total: Paid amount
+        total: Paid amount in company currency
         company: Company name
         customer_group: Customer Group name (optional, for filtering accounts)
+        exchange_rate: Rate of the paid amount currency (tax rows are in that currency)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
     """
     regular_stamp_account = get_tax_account(
-        "regular_stamp", company, customer_group)
+        "regular_stamp", company, customer_group, payment_type)
     if not regular_stamp_account:
         return
 
@@ -85,22 +118,25 @@ def calculate_regular_stamp_tax(taxes, total, company=None, customer_group=None)
     # Update regular stamp tax amount
     for tax in taxes:
         if tax.account_head == regular_stamp_account:
-            tax.tax_amount = regular_stamp_amount
+            tax.tax_amount = regular_stamp_amount / exchange_rate
 
 
-def calculate_additional_stamp_tax(taxes, total, company=None, customer_group=None):
+def calculate_additional_stamp_tax(taxes, total, company=None, customer_group=None,
+                                   exchange_rate=1, payment_type="Receive"):
     """
     Calculate additional stamp tax (دمغة اضافية)
     Formula: regular_stamp_amount * multiplier (from rule)
 
     Args:
         taxes: Payment Entry taxes table
-        total: Paid amount
+        total: Paid amount in company currency
         company: Company name
         customer_group: Customer Group name (optional, for filtering accounts)
+        exchange_rate: Rate of the paid amount currency (tax rows are in that currency)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
     """
     additional_stamp_account = get_tax_account(
-        "additional_stamp", company, customer_group)
+        "additional_stamp", company, customer_group, payment_type)
     if not additional_stamp_account:
         return
 
@@ -127,19 +163,22 @@ def calculate_additional_stamp_tax(taxes, total, company=None, customer_group=No
     # Update additional stamp tax amount
     for tax in taxes:
         if tax.account_head == additional_stamp_account:
-            tax.tax_amount = additional_stamp_amount
+            tax.tax_amount = additional_stamp_amount / exchange_rate
 
 
-def handle_check_stamp_and_ats_tax(doc, total, company=None, customer_group=None):
+def handle_check_stamp_and_ats_tax(doc, total, company=None, customer_group=None,
+                                   exchange_rate=1, payment_type="Receive"):
     """
     Handle check stamp (دمغة شيك) and ATS tax (ضرائب أ ت ص) from rules
     These are fixed amounts that apply only to specific ranges
 
     Args:
         doc: Payment Entry document
-        total: Paid amount
+        total: Paid amount in company currency
         company: Company name
         customer_group: Customer Group name (optional, for filtering accounts)
+        exchange_rate: Rate of the paid amount currency (tax rows are in that currency)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
     """
     # Get rule from DocType
     rule = get_stamp_tax_rule(total, company)
@@ -154,13 +193,13 @@ def handle_check_stamp_and_ats_tax(doc, total, company=None, customer_group=None
     # Handle check stamp
     if rule.get("check_stamp_amount", 0) > 0:
         check_stamp_account = get_tax_account(
-            "check_stamp", company, customer_group)
+            "check_stamp", company, customer_group, payment_type)
         if check_stamp_account:
             # Check if check stamp row already exists
             found = False
             for tax in doc.taxes:
                 if tax.account_head == check_stamp_account:
-                    tax.tax_amount = rule["check_stamp_amount"]
+                    tax.tax_amount = rule["check_stamp_amount"] / exchange_rate
                     found = True
                     break
 
@@ -170,7 +209,7 @@ def handle_check_stamp_and_ats_tax(doc, total, company=None, customer_group=None
                     "add_deduct_tax": "Deduct",
                     "charge_type": "Actual",
                     "account_head": check_stamp_account,
-                    "tax_amount": rule["check_stamp_amount"],
+                    "tax_amount": rule["check_stamp_amount"] / exchange_rate,
                     "description": "دمغة شيك"
                 })
 
@@ -282,23 +321,61 @@ def calculate_additional_stamp(total, company=None):
     return additional_stamp_amount
 
 
+def build_deduction_rows(amounts, company, customer_group=None, payment_type="Receive"):
+    """
+    Build taxes table rows (Advance Taxes and Charges format) from engine amounts
+
+    Args:
+        amounts: tax_type -> amount, as returned by evaluate_deductions()
+        company: Company name
+        customer_group: Customer Group name (optional, for filtering accounts)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
+
+    Returns:
+        list: List of dictionaries with tax rows
+    """
+    profile = get_deduction_profile(company, customer_group, payment_type)
+    cost_center = frappe.get_cached_value("Company", company, "cost_center")
+
+    rows = []
+    for tax_type, amount in amounts.items():
+        account = profile.get(tax_type)
+        if not account or flt(amount) <= 0:
+            continue
+
+        rows.append({
+            "add_deduct_tax": "Deduct",
+            "charge_type": "Actual",
+            "account_head": account,
+            "description": frappe.get_cached_value("Account", account, "account_name") or account,
+            "cost_center": cost_center,
+            "tax_amount": flt(amount),
+            "rate": 0,
+        })
+
+    return rows
+
+
 # ============================================================================
 # SECTION 3: CONTRACT STAMP HANDLING
 # ============================================================================
 
-def handle_contract_stamp(doc, company=None, customer_group=None):
+def handle_contract_stamp(doc, company=None, customer_group=None, exchange_rate=1,
+                          payment_type="Receive"):
     """
     Handle contract stamp (دمغة عقد) tax row
     Adds or updates contract stamp row based on contract_papers_qty
-    Formula: contract_papers_qty * 3 * 0.90
+    Formula: contract_papers_qty * 3 * 0.90 (company currency)
 
     Args:
         doc: Payment Entry document
         company: Company name
         customer_group: Customer Group name (optional, for filtering accounts)
+        exchange_rate: Rate of the paid amount currency (tax rows are in that currency)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
     """
     contract_account = get_tax_account(
-        "contract_stamp", company, customer_group)
+        "contract_stamp", company, customer_group, payment_type)
     if not contract_account:
         return
 
@@ -307,7 +384,7 @@ def handle_contract_stamp(doc, company=None, customer_group=None):
         doc.taxes = []
 
     if doc.contract_papers_qty and doc.contract_papers_qty > 0:
-        contract_amount = doc.contract_papers_qty * 3 * 0.90
+        contract_amount = doc.contract_papers_qty * 3 * 0.90 / exchange_rate
         found = False
 
         # Update existing contract stamp row if found
@@ -336,18 +413,22 @@ def handle_contract_stamp(doc, company=None, customer_group=None):
 # SECTION 4: VAT 20% HANDLING
 # ============================================================================
 
-def handle_vat_20_percent(doc, company=None, customer_group=None):
+def handle_vat_20_percent(doc, company=None, customer_group=None, payment_type="Receive"):
     """
-    Add VAT 20% tax row if Sales Invoice has VAT tax
-    Formula: tax_inv.tax_amount * 0.20
+    Add VAT 20% tax row if referenced Sales Invoices have VAT tax
+    Formula: tax_inv.tax_amount * 0.20, prorated by allocated_amount
+
+    Uses the expectations stored on each Sales Invoice at submit, so no
+    referenced invoice document is loaded.
 
     Args:
         doc: Payment Entry document
         company: Company name
         customer_group: Customer Group name (optional, for filtering accounts)
+        payment_type: "Pay" to use the Supplier Group profile named by customer_group
     """
-    vat_20_account = get_tax_account("vat_20_percent", company, customer_group)
-    vat_tax_account = get_tax_account("vat_tax", company, customer_group)
+    vat_20_account = get_tax_account("vat_20_percent", company, customer_group, payment_type)
+    vat_tax_account = get_tax_account("vat_tax", company, customer_group, payment_type)
 
     if not vat_20_account or not vat_tax_account:
         return
@@ -360,78 +441,344 @@ def handle_vat_20_percent(doc, company=None, customer_group=None):
     vat_exists = any(tax.account_head == vat_20_account for tax in doc.taxes)
 
     if not vat_exists:
-        # Process all references to find VAT tax
-        for ref in doc.references:
-            if ref.reference_name and ref.reference_doctype == "Sales Invoice":
-                try:
-                    inv = frappe.get_doc(
-                        ref.reference_doctype, ref.reference_name)
-                    for tax_inv in inv.taxes:
-                        if tax_inv.account_head == vat_tax_account:
-                            doc.append("taxes", {
-                                "add_deduct_tax": "Deduct",
-                                "charge_type": "Actual",
-                                "account_head": vat_20_account,
-                                "tax_amount": tax_inv.tax_amount * 0.20,
-                                "description": "20% من القيمة المضافة"
-                            })
-                            vat_exists = True
-                            break
-                    if vat_exists:
-                        break
-                except frappe.DoesNotExistError:
-                    continue
+        # Aggregate stored expectations of all references
+        from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import get_reference_expectations
+
+        expected = get_reference_expectations(doc.references, company, customer_group)
+        vat_20_amount = flt(expected.get("vat_20_percent"))
+
+        if vat_20_amount > 0:
+            doc.append("taxes", {
+                "add_deduct_tax": "Deduct",
+                "charge_type": "Actual",
+                "account_head": vat_20_account,
+                "tax_amount": vat_20_amount,
+                "description": "20% من القيمة المضافة"
+            })
 
 
 # ============================================================================
-# SECTION 5: HOOK FUNCTIONS
+# SECTION 5: PER-REFERENCE ALLOCATION
 # ============================================================================
 
+def allocate_deductions_per_reference(doc, company=None, customer_group=None, mode="Proportional",
+                                      exchange_rate=1):
+    """
+    Compute deductions per Sales Invoice reference and settle them against each invoice
+
+    The allocated amount of a reference is the cash applied to the invoice
+    plus the deductions settled on it (kept in custom_deduction_amount), so an
+    invoice paid net of its deductions is fully settled. Deductions are
+    evaluated on the settled amount, which includes them, so the settlement is
+    solved by a few fixed-point iterations, capped at the outstanding amount.
+    The deduction calculated for each invoice is kept in
+    custom_calculated_deduction_amount; when the cash already covers part of
+    it, only the settled part is deducted.
+    The paid amount grows by the added allocation; the taxes rows take the
+    settled deductions back out of the bank side, so the amount received is
+    unchanged. The taxes table receives the sum per account; rows of reference
+    deduction accounts that no longer apply are removed.
+
+    Modes:
+    - Per Invoice Brackets: stamp brackets and thresholds evaluated on each allocated_amount
+    - Proportional: deductions evaluated on the total, split by allocated_amount
+
+    Args:
+        doc: Payment Entry document
+        company: Company name
+        customer_group: Customer Group name (optional, for filtering accounts)
+        mode: Deduction Allocation Mode from Payment Deductions Settings
+        exchange_rate: Rate of the paid amount currency to company currency
+
+    Returns:
+        bool: False if the Payment Entry has no allocated Sales Invoice references
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import set_party_amount
+    from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import get_reference_expectation_rows
+
+    rows = [
+        (ref, expected)
+        for ref, expected in get_reference_expectation_rows(doc.references, company, customer_group)
+        if flt(ref.allocated_amount) > 0
+    ]
+    if not rows:
+        return False
+
+    profile = get_deduction_profile(company, customer_group)
+    brackets = get_compiled_brackets(company)
+
+    # A reference edited in the form since the last save only holds cash
+    before = doc.get_doc_before_save()
+    before_allocated = {ref.name: flt(ref.allocated_amount) for ref in before.references} if before else {}
+
+    allocated = [flt(ref.allocated_amount) for ref, _expected in rows]
+    cash = []
+    for ref, _expected in rows:
+        settled_deduction = flt(ref.custom_deduction_amount)
+        if ref.name in before_allocated and before_allocated[ref.name] != flt(ref.allocated_amount):
+            settled_deduction = 0
+        cash.append(max(flt(ref.allocated_amount) - settled_deduction, 0))
+
+    # Expected VAT 20% shares are prorated on the allocated amount
+    shares = [
+        {tax_type: amount / amount_allocated for tax_type, amount in expected.items()}
+        for (_ref, expected), amount_allocated in zip(rows, allocated, strict=True)
+    ]
+
+    settled = list(allocated)
+    for _iteration in range(SETTLEMENT_ITERATIONS):
+        for (ref, _expected), amount in zip(rows, settled, strict=True):
+            ref.allocated_amount = amount
+        reference_amounts, _totals = calculate_reference_deductions(
+            [
+                (ref, {tax_type: share * amount for tax_type, share in unit.items()})
+                for (ref, _expected), unit, amount in zip(rows, shares, settled, strict=True)
+            ],
+            brackets, profile, mode, exchange_rate
+        )
+        next_settled = [
+            get_settled_amount(ref, paid, sum(amounts.values()))
+            for (ref, _expected), paid, amounts in zip(rows, cash, reference_amounts, strict=True)
+        ]
+        if _iteration == SETTLEMENT_ITERATIONS - 1 or max(
+            abs(new - old) for new, old in zip(next_settled, settled, strict=True)
+        ) < SETTLEMENT_TOLERANCE:
+            break
+        settled = next_settled
+
+    added = 0
+    for (ref, _expected), paid, previous, amount, amounts in zip(
+        rows, cash, allocated, settled, reference_amounts, strict=True
+    ):
+        precision = ref.precision("allocated_amount")
+        ref.allocated_amount = flt(amount, precision)
+        ref.custom_deduction_amount = flt(ref.allocated_amount - paid, precision)
+        ref.custom_calculated_deduction_amount = flt(sum(amounts.values()), precision)
+        added += ref.allocated_amount - previous
+
+    totals = get_settled_deductions(
+        reference_amounts, [ref.custom_deduction_amount for ref, _expected in rows]
+    )
+
+    # The party is credited with the settled deductions as well
+    if flt(added, doc.precision("paid_amount")):
+        set_party_amount(doc, flt(doc.paid_amount) + added)
+
+    # Accounts can be shared by several tax types
+    account_amounts = {}
+    for tax_type, amount in totals.items():
+        account_amounts[profile[tax_type]] = account_amounts.get(profile[tax_type], 0) + amount
+    # Deductions the cash already covers are not withheld
+    account_amounts = {
+        account: amount for account, amount in account_amounts.items()
+        if flt(amount, doc.precision("paid_amount"))
+    }
+
+    stale_accounts = {
+        profile.get(tax_type) for tax_type in REFERENCE_TAX_TYPES if profile.get(tax_type)
+    } - set(account_amounts) - {profile.get("contract_stamp")}
+    doc.taxes = [tax for tax in doc.taxes if tax.account_head not in stale_accounts]
+
+    # Update existing rows of each account, add the missing ones
+    for account, amount in account_amounts.items():
+        row = next((tax for tax in doc.taxes if tax.account_head == account), None)
+        if row:
+            row.tax_amount = amount
+        else:
+            doc.append("taxes", {
+                "add_deduct_tax": "Deduct",
+                "charge_type": "Actual",
+                "account_head": account,
+                "tax_amount": amount,
+                "description": frappe.get_cached_value("Account", account, "account_name") or account,
+            })
+
+    return True
+
+
+def get_settled_amount(ref, cash, deduction):
+    """Cash applied to an invoice plus its deductions, within the outstanding amount"""
+    outstanding = flt(ref.outstanding_amount)
+    if outstanding <= 0:
+        return cash + deduction
+    return max(cash, min(outstanding, cash + deduction))
+
+
+def get_settled_deductions(reference_amounts, settled_deductions):
+    """
+    Totals per tax type of the deductions settled on each reference
+    A reference that settles only part of its deductions withholds each tax type pro rata
+
+    Args:
+        reference_amounts: [{tax_type: amount} per reference] from calculate_reference_deductions()
+        settled_deductions: Deduction settled on each reference (custom_deduction_amount)
+
+    Returns:
+        dict: {tax_type: settled amount}
+    """
+    totals = {}
+    for amounts, settled in zip(reference_amounts, settled_deductions, strict=True):
+        deduction = sum(amounts.values())
+        if deduction <= 0:
+            continue
+        # Settled amounts are rounded to the currency precision
+        ratio = 1 if flt(settled) >= deduction - SETTLEMENT_TOLERANCE else max(flt(settled), 0) / deduction
+        for tax_type, amount in amounts.items():
+            totals[tax_type] = totals.get(tax_type, 0) + amount * ratio
+    return totals
+
+
+def calculate_reference_deductions(rows, brackets, profile, mode="Proportional", exchange_rate=1):
+    """
+    Compute the deductions of each allocated reference without touching the document
+    Shared by allocate_deductions_per_reference() and the deduction verifier
+
+    Args:
+        rows: (reference row, expected deductions) with allocated_amount > 0
+        brackets: Compiled bracket index of the company
+        profile: Deduction profile from get_deduction_profile()
+        mode: "Per Invoice Brackets" or "Proportional"
+        exchange_rate: Rate of the allocated amounts currency to company currency
+
+    Returns:
+        tuple: ([{tax_type: amount} per row], {tax_type: total amount})
+    """
+    total = sum(flt(ref.allocated_amount) for ref, _expected in rows)
+
+    if mode == "Proportional":
+        total_amounts = evaluate_deductions(total, brackets, profile, exchange_rate=exchange_rate)
+
+    reference_amounts = []
+    totals = {}
+    for ref, expected in rows:
+        allocated = flt(ref.allocated_amount)
+        if mode == "Proportional":
+            amounts = {
+                tax_type: amount * allocated / total for tax_type, amount in total_amounts.items()
+            }
+        else:
+            amounts = evaluate_deductions(allocated, brackets, profile, exchange_rate=exchange_rate)
+
+        if profile.get("vat_20_percent") and expected.get("vat_20_percent"):
+            amounts["vat_20_percent"] = expected["vat_20_percent"]
+
+        reference_amounts.append(amounts)
+        for tax_type, amount in amounts.items():
+            totals[tax_type] = totals.get(tax_type, 0) + amount
+
+    return reference_amounts, totals
+
+
+# ============================================================================
+# SECTION 6: HOOK FUNCTIONS
+# ============================================================================
+
+@profile_slow_calls("Payment Entry.before_validate")
 def before_validate(doc, method=None):
     """
     Calculate and update tax amounts before Payment Entry validation
     Runs automatically when Payment Entry is saved
 
+    Receipts from customers use the Customer Group profile; payments to
+    suppliers (Pay) use the Supplier Group profile of the same company.
+
     Args:
         doc: Payment Entry document
         method: Method name (not used, required for hooks)
     """
+    # Deductions already set by bulk creation, or kept by batch submit (fingerprint current)
+    if doc.flags.deductions_prefilled:
+        return
+
+    from payment_taxes_deductions.payment_taxes_deductions.consolidated_posting import (
+        restore_deduction_accounts,
+        route_to_clearing_account,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.deduction_fingerprint import (
+        set_deduction_fingerprint,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+        get_deduction_settings,
+    )
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import get_deduction_exchange_rate
+
     # Get company from Payment Entry
     company = doc.company or frappe.defaults.get_global_default("company")
 
-    # Get customer_group from custom field (for filtering accounts)
-    customer_group = getattr(doc, "custom_customer_group", None)
+    # Pay-side entries are keyed by Supplier Group (kept on the entry after the first save)
+    if doc.payment_type == "Pay" and doc.party_type == "Supplier" and doc.party \
+            and not doc.get("custom_supplier_group"):
+        doc.custom_supplier_group = frappe.get_cached_value("Supplier", doc.party, "supplier_group")
+
+    # Get customer_group (supplier group for Pay) for filtering accounts
+    payment_type, customer_group = get_profile_direction(doc)
+
+    # Rows routed to the clearing account are matched by their real account
+    restore_deduction_accounts(doc)
+
+    # Brackets are in company currency, tax rows in the paid amount currency
+    exchange_rate = get_deduction_exchange_rate(doc)
 
     # Handle contract stamp first (works even if taxes table is empty)
-    handle_contract_stamp(doc, company, customer_group)
+    handle_contract_stamp(doc, company, customer_group, exchange_rate, payment_type)
 
     # Initialize taxes table if it doesn't exist
     if not doc.taxes:
         doc.taxes = []
 
-    total = flt(doc.paid_amount or 0)
-
-    # Calculate commercial profits tax
-    calculate_commercial_profits_tax(doc.taxes, total, company, customer_group)
-
-    # Calculate regular stamp tax
-    calculate_regular_stamp_tax(doc.taxes, total, company, customer_group)
+    # Per-reference allocation mode: deductions attributed to each invoice
+    settings = get_deduction_settings()
+    mode = settings.deduction_allocation_mode or "Aggregate"
+    if payment_type == "Pay" or mode == "Aggregate" or not allocate_deductions_per_reference(
+        doc, company, customer_group, mode, exchange_rate
+    ):
+        # base_paid_amount is only refreshed in validate, so convert here
+        total = flt(doc.paid_amount or 0) * exchange_rate
+
+        # Calculate commercial profits tax
+        calculate_commercial_profits_tax(
+            doc.taxes, total, company, customer_group, exchange_rate, payment_type)
+
+        # Calculate regular stamp tax
+        calculate_regular_stamp_tax(
+            doc.taxes, total, company, customer_group, exchange_rate, payment_type)
+
+        # Calculate additional stamp tax
+        calculate_additional_stamp_tax(
+            doc.taxes, total, company, customer_group, exchange_rate, payment_type)
+
+        # Handle check stamp and ATS tax from rules
+        handle_check_stamp_and_ats_tax(
+            doc, total, company, customer_group, exchange_rate, payment_type)
+
+        # Handle VAT 20%
+        handle_vat_20_percent(doc, company, customer_group, payment_type)
+
+    # Commercial profits threshold on the customer's fiscal year running total
+    if settings.commercial_profits_threshold_basis == "Cumulative per Fiscal Year":
+        from payment_taxes_deductions.payment_taxes_deductions.running_totals import (
+            apply_cumulative_commercial_profits,
+        )
 
-    # Calculate additional stamp tax
-    calculate_additional_stamp_tax(doc.taxes, total, company, customer_group)
+        apply_cumulative_commercial_profits(doc, company, customer_group)
 
-    # Handle check stamp and ATS tax from rules
-    handle_check_stamp_and_ats_tax(doc, total, company, customer_group)
+    # Consolidated posting mode: deductions accrue into the clearing account
+    profile = get_deduction_profile(company, customer_group, payment_type)
+    deduction_accounts = {
+        account for tax_type, account in profile.items() if account and tax_type != "vat_tax"
+    }
+    route_to_clearing_account(doc, company, deduction_accounts)
 
-    # Handle VAT 20%
-    handle_vat_20_percent(doc, company, customer_group)
+    # Audit fingerprint of the rules and inputs used above
+    set_deduction_fingerprint(doc, company, customer_group, payment_type, exchange_rate, settings)
 
 
 # ============================================================================
-# SECTION 6: API METHODS
+# SECTION 7: API METHODS
 # ============================================================================
 
 @frappe.whitelist()
+@profile_slow_calls("payment_entry.test")
 def test(total, company=None, customer_group=None):
     """
     API method to calculate tax amounts for Payment Entry
@@ -475,17 +822,39 @@ def test(total, company=None, customer_group=None):
         frappe.throw(_("Error calculating taxes: {0}").format(str(e)))
 
 
+def get_api_exchange_rate(company, exchange_rate=None, paid_from_account_currency=None, posting_date=None):
+    """
+    Exchange rate of the paid amount sent by the form, as get_deduction_exchange_rate() reads it on save
+    The rate is looked up when the form has no source exchange rate yet
+    """
+    from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import get_deduction_exchange_rate
+
+    return get_deduction_exchange_rate(frappe._dict(
+        company=company,
+        source_exchange_rate=exchange_rate,
+        paid_from_account_currency=paid_from_account_currency,
+        posting_date=posting_date,
+    )) or 1
+
+
 @frappe.whitelist()
-def get_deductions_by_customer_group(company=None, customer_group=None, paid_amount=0):
+@profile_slow_calls("payment_entry.get_deductions_by_customer_group")
+def get_deductions_by_customer_group(company=None, customer_group=None, paid_amount=0,
+                                     exchange_rate=None, paid_from_account_currency=None,
+                                     posting_date=None):
     """
     Get taxes for Payment Entry based on company and customer_group
     Returns data in Advance Taxes and Charges format (for taxes table)
-    Simple calculation: account * percentage * paid_amount
+
+    Amounts are in the currency of paid_amount, like the rows before_validate writes.
 
     Args:
         company: Company name (optional, uses default company if not provided)
         customer_group: Customer Group name (required)
-        paid_amount: Paid amount to calculate taxes (required)
+        paid_amount: Paid amount in the paid-from account currency (required)
+        exchange_rate: Source exchange rate of the entry, paid-from currency to company currency
+        paid_from_account_currency: Currency of paid_amount, to look the rate up when it is not set
+        posting_date: Date of that lookup
 
     Returns:
         list: List of dictionaries with tax rows (Advance Taxes and Charges format)
@@ -505,143 +874,73 @@ def get_deductions_by_customer_group(company=None, customer_group=None, paid_amo
         if paid_amount <= 0:
             frappe.throw(_("Paid amount must be greater than 0"))
 
-        # Get Payment Deductions Accounts document
-        filters = {"company": company, "customer_group": customer_group}
-        settings_name = frappe.db.get_value(
-            "Payment Deductions Accounts", filters, "name")
+        # Same cached bracket index and profiles as the before_validate hook
+        profile = get_deduction_profile(company, customer_group)
+        amounts = evaluate_deductions(
+            paid_amount,
+            get_compiled_brackets(company),
+            profile,
+            exchange_rate=get_api_exchange_rate(
+                company, exchange_rate, paid_from_account_currency, posting_date
+            ),
+        )
+        return build_deduction_rows(amounts, company, customer_group)
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), _(
+            "Error getting taxes by customer group"))
+        frappe.throw(_("Error getting taxes: {0}").format(str(e)))
+
 
-        if not settings_name:
-            # Return empty list if no settings found (user can configure it)
-            return []
+@frappe.whitelist()
+@profile_slow_calls("payment_entry.get_deductions_by_supplier_group")
+def get_deductions_by_supplier_group(company=None, supplier_group=None, paid_amount=0,
+                                     exchange_rate=None, paid_from_account_currency=None,
+                                     posting_date=None):
+    """
+    Get withholding taxes for a Pay Payment Entry based on company and supplier_group
+    Returns data in Advance Taxes and Charges format (for taxes table)
 
-        settings = frappe.get_doc("Payment Deductions Accounts", settings_name)
+    Amounts are in the currency of paid_amount, like the rows before_validate writes.
 
-        # Get company cost center
-        cost_center = frappe.get_cached_value(
-            "Company", company, "cost_center")
-        if not cost_center:
-            frappe.throw(
-                _("Cost Center is not set for company {0}").format(company))
+    Args:
+        company: Company name (optional, uses default company if not provided)
+        supplier_group: Supplier Group name (required)
+        paid_amount: Paid amount in the paid-from account currency (required)
+        exchange_rate: Source exchange rate of the entry, paid-from currency to company currency
+        paid_from_account_currency: Currency of paid_amount, to look the rate up when it is not set
+        posting_date: Date of that lookup
 
-        # Get stamp tax calculation rule from Stamp Tax Calculation Rules
-        from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_accounts.payment_deductions_accounts import (
-            get_stamp_tax_rule
-        )
-        rule = get_stamp_tax_rule(paid_amount, company)
-
-        taxes = []
-
-        # Handle taxes that use Stamp Tax Calculation Rules (complex calculations)
-        if rule:
-            # Regular stamp tax (دمغة عادية)
-            # Formula: ((paid_amount - subtract_amount) * percentage / 100 + add_amount) / 4
-            if settings.regular_stamp:
-                regular_stamp_amount = (
-                    (paid_amount - rule["subtract_amount"]
-                     ) * rule["percentage"] / 100
-                    + rule["add_amount"]
-                ) / 4
-                if regular_stamp_amount > 0:
-                    account_name = frappe.db.get_value(
-                        "Account", settings.regular_stamp, "account_name") or settings.regular_stamp
-                    taxes.append({
-                        "add_deduct_tax": "Deduct",
-                        "charge_type": "Actual",
-                        "account_head": settings.regular_stamp,
-                        "description": account_name,
-                        "cost_center": cost_center,
-                        "tax_amount": regular_stamp_amount,
-                        "rate": 0,
-                    })
-
-            # Additional stamp tax (دمغة اضافية)
-            # Formula: regular_stamp_amount * multiplier
-            if settings.additional_stamp and regular_stamp_amount > 0:
-                multiplier = rule.get("additional_stamp_multiplier", 3)
-                additional_stamp_amount = regular_stamp_amount * multiplier
-                if additional_stamp_amount > 0:
-                    account_name = frappe.db.get_value(
-                        "Account", settings.additional_stamp, "account_name") or settings.additional_stamp
-                    taxes.append({
-                        "add_deduct_tax": "Deduct",
-                        "charge_type": "Actual",
-                        "account_head": settings.additional_stamp,
-                        "description": account_name,
-                        "cost_center": cost_center,
-                        "tax_amount": additional_stamp_amount,
-                        "rate": 0,
-                    })
-
-            # Check stamp (دمغة شيك) - fixed amount from rule
-            if settings.check_stamp and rule.get("check_stamp_amount", 0) > 0:
-                account_name = frappe.db.get_value(
-                    "Account", settings.check_stamp, "account_name") or settings.check_stamp
-                taxes.append({
-                    "add_deduct_tax": "Deduct",
-                    "charge_type": "Actual",
-                    "account_head": settings.check_stamp,
-                    "description": account_name,
-                    "cost_center": cost_center,
-                    "tax_amount": rule["check_stamp_amount"],
-                    "rate": 0,
-                })
+    Returns:
+        list: List of dictionaries with tax rows (Advance Taxes and Charges format)
+    """
+    try:
+        if not company:
+            company = frappe.defaults.get_global_default("company")
 
-            # ATS tax (دمغة المهن التطبيقية) - fixed amount from rule
-            if settings.applied_professions_tax and rule.get("ats_tax_amount", 0) > 0:
-                account_name = frappe.db.get_value(
-                    "Account", settings.applied_professions_tax, "account_name") or settings.applied_professions_tax
-                taxes.append({
-                    "add_deduct_tax": "Deduct",
-                    "charge_type": "Actual",
-                    "account_head": settings.applied_professions_tax,
-                    "description": account_name,
-                    "cost_center": cost_center,
-                    "tax_amount": rule["ats_tax_amount"],
-                    "rate": 0,
-                })
+        if not company:
+            frappe.throw(_("Company is required"))
 
-        # Handle taxes that use simple percentage from Payment Deductions Accounts
-        # Note: Database field names use "_percent" suffix (not "_percentage")
-        simple_percentage_fields = [
-            ("commercial_profits", "commercial_profits_percent"),
-            ("contract_stamp", "contract_stamp_percent"),
-            ("medical_professions_tax", "medical_professions_tax_percent"),
-            ("vat_20_percent", "vat_20_percent_percent"),
-            ("qaderon_difference", "qaderon_difference_percent"),
-        ]
+        if not supplier_group:
+            frappe.throw(_("Supplier Group is required"))
 
-        # Loop through simple percentage fields
-        for account_field, percentage_field in simple_percentage_fields:
-            account = getattr(settings, account_field, None)
-            if account:
-                # Get percentage (default to 0 if not set)
-                percentage = flt(
-                    getattr(settings, percentage_field, None) or 0)
-
-                # Calculate amount: paid_amount * (percentage / 100)
-                tax_amount = paid_amount * \
-                    (percentage / 100) if percentage > 0 else 0
-
-                # Only add if amount > 0 or percentage > 0
-                if tax_amount > 0 or percentage > 0:
-                    # Get account name for description
-                    account_name = frappe.db.get_value(
-                        "Account", account, "account_name") or account
-
-                    # Return in Advance Taxes and Charges format (for taxes table)
-                    taxes.append({
-                        "add_deduct_tax": "Deduct",
-                        "charge_type": "Actual",
-                        "account_head": account,
-                        "description": account_name,
-                        "cost_center": cost_center,
-                        "tax_amount": tax_amount,
-                        "rate": percentage,
-                    })
-
-        return taxes
+        paid_amount = flt(paid_amount or 0)
+        if paid_amount <= 0:
+            frappe.throw(_("Paid amount must be greater than 0"))
+
+        # Same cached bracket index and profiles as the before_validate hook
+        profile = get_deduction_profile(company, supplier_group, "Pay")
+        amounts = evaluate_deductions(
+            paid_amount,
+            get_compiled_brackets(company),
+            profile,
+            exchange_rate=get_api_exchange_rate(
+                company, exchange_rate, paid_from_account_currency, posting_date
+            ),
+        )
+        return build_deduction_rows(amounts, company, supplier_group, payment_type="Pay")
 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), _(
-            "Error getting taxes by customer group"))
+            "Error getting taxes by supplier group"))
         frappe.throw(_("Error getting taxes: {0}").format(str(e)))
@@ -0,0 +1,165 @@
+"""
+Read Replica
+Route heavy deduction reads to a read-only database replica
+
+Verification, fingerprint replay, certificates, tax authority files, bank
+matching, consolidation and the configuration exports scan Payment Entry and
+Advance Taxes and Charges over whole periods. When the site config sets
+"read_from_replica", these reads run on the replica so cashier saves on the
+primary keep their latency during month-end reporting. Without it every read
+stays on the primary.
+
+- Read-only API methods are wrapped in frappe.read_only(), which swaps
+  frappe.db to the replica for the request (report execute already runs
+  through frappe.desk.query_report.run, which does the same)
+- Background jobs keep frappe.db on the primary for checkpoints and files and
+  scan through a second connection from replica_connection()
+- Worker processes that only read call use_replica() after connecting
+
+Replica data lags the primary by the replication delay. Reads whose result is
+kept or written back stay on the primary: shared cache loads of the deduction
+configuration go through on_primary() (a stale load would outlive the cache
+clear of a configuration save), and the running total rebuild, batch submit,
+the matrix editor and the event feed cursor are not routed.
+
+Local test with a second MariaDB instance replicating the site database
+(site_config.json of the site):
+
+    "read_from_replica": 1,
+    "replica_host": "127.0.0.1",
+    "replica_db_port": 3307,
+    "different_credentials_for_replica": 1,   (optional, e.g. a SELECT-only user)
+    "replica_db_name": "replica_user",
+    "replica_db_password": "..."
+
+then run "bench --site <site> check-deduction-replica" to see which server
+each path reads from.
+
+Incremental jobs (tax authority file, deduction columns) read from a
+high-water mark of Payment Entry.modified. modified is set at save, not at
+commit, and the replica applies commits with a delay, so rows below the mark
+can show up after a run passed it. get_read_from starts each read an overlap
+("deduction_read_overlap_seconds", default 10 minutes) before the mark; the
+jobs merge re-read entries idempotently.
+
+Structure:
+1. Configuration
+2. Connections
+3. Incremental Reads
+"""
+
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import add_to_date, cint, get_datetime
+
+# Seconds re-read below a high-water mark (replica lag and late commits)
+DEFAULT_READ_OVERLAP = 600
+
+
+# ============================================================================
+# SECTION 1: CONFIGURATION
+# ============================================================================
+
+def is_replica_configured():
+    # read_from_replica is the switch frappe.read_only() uses
+    return bool(cint(frappe.conf.get("read_from_replica")) and frappe.conf.get("replica_host"))
+
+
+def get_replica_credentials():
+    conf = frappe.conf
+    if cint(conf.get("different_credentials_for_replica")):
+        return conf.replica_db_name, conf.replica_db_password
+    return conf.db_name, conf.db_password
+
+
+# ============================================================================
+# SECTION 2: CONNECTIONS
+# ============================================================================
+
+def use_replica():
+    """
+    Switch frappe.db of a read-only worker process to the replica
+
+    Returns:
+        bool: True when frappe.db now reads from the replica
+    """
+    if not is_replica_configured():
+        return False
+    return bool(frappe.connect_replica())
+
+
+def on_primary(fn, *args, **kwargs):
+    """Call fn with frappe.db on the primary, also inside frappe.read_only()"""
+    primary = getattr(frappe.local, "primary_db", None)
+    replica = frappe.local.db
+    if not primary or replica is primary:
+        return fn(*args, **kwargs)
+
+    frappe.local.db = primary
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        frappe.local.db = replica
+
+
+@contextmanager
+def replica_connection():
+    """
+    Second connection for heavy reads of a job that writes on the primary
+
+    Yields the replica connection when configured, else frappe.db itself, so
+    callers read through it unconditionally. The replica connection is closed
+    on exit; frappe.db is left untouched.
+    """
+    if not is_replica_configured():
+        yield frappe.db
+        return
+
+    from frappe.database import get_db
+
+    user, password = get_replica_credentials()
+    db = get_db(
+        host=frappe.conf.replica_host,
+        user=user,
+        password=password,
+        port=frappe.conf.get("replica_db_port"),
+    )
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_server_info(db=None):
+    """
+    Server a connection reads from
+
+    Returns:
+        dict: hostname, port, read_only
+    """
+    hostname, port, read_only = (db or frappe.db).sql("select @@hostname, @@port, @@read_only")[0]
+    return {"hostname": hostname, "port": cint(port), "read_only": cint(read_only)}
+
+
+# ============================================================================
+# SECTION 3: INCREMENTAL READS
+# ============================================================================
+
+def get_read_overlap():
+    return cint(frappe.conf.get("deduction_read_overlap_seconds")) or DEFAULT_READ_OVERLAP
+
+
+def get_read_from(since):
+    """
+    Start of an incremental read after a high-water mark of modified
+
+    Args:
+        since: High-water mark of the last run, None for a full read
+
+    Returns:
+        str: the mark moved back by the read overlap, None for a full read
+    """
+    if not since:
+        return None
+    return str(add_to_date(get_datetime(since), seconds=-get_read_overlap()))
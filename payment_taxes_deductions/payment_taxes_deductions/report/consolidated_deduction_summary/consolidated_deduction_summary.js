@@ -0,0 +1,42 @@
+// Copyright (c) 2026, abdopcnet@gmail.com and contributors
+// For license information, please see license.txt
+
+frappe.query_reports['Consolidated Deduction Summary'] = {
+	filters: [
+		{
+			fieldname: 'from_date',
+			label: __('From Date'),
+			fieldtype: 'Date',
+			default: frappe.datetime.month_start(),
+			reqd: 1,
+		},
+		{
+			fieldname: 'to_date',
+			label: __('To Date'),
+			fieldtype: 'Date',
+			default: frappe.datetime.month_end(),
+			reqd: 1,
+		},
+		{
+			fieldname: 'companies',
+			label: __('Companies'),
+			fieldtype: 'MultiSelectList',
+			get_data: function (txt) {
+				return frappe.db.get_link_options('Company', txt);
+			},
+		},
+		{
+			fieldname: 'presentation_currency',
+			label: __('Currency'),
+			fieldtype: 'Link',
+			options: 'Currency',
+			default: frappe.defaults.get_user_default('Currency'),
+		},
+		{
+			fieldname: 'payment_type',
+			label: __('Payment Type'),
+			fieldtype: 'Select',
+			options: '\nReceive\nPay',
+		},
+	],
+};
@@ -0,0 +1,118 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and contributors
+# For license information, please see license.txt
+
+"""
+Consolidated Deduction Summary
+Withholding per tax type across the companies of the group
+
+One row per payment type and tax type with a column per company and the group
+total, all in the presentation currency. Companies are aggregated in parallel
+by consolidated_deductions, so the report takes about as long as its slowest
+company.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from payment_taxes_deductions.payment_taxes_deductions.consolidated_deductions import (
+    get_consolidation,
+)
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    TAX_TYPE_LABELS,
+)
+
+PAYMENT_TYPE_LABELS = {"Receive": "Withheld by Customers", "Pay": "Withheld from Suppliers"}
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    consolidation = get_consolidation(
+        filters.from_date,
+        filters.to_date,
+        frappe.parse_json(filters.companies) if filters.companies else None,
+        filters.presentation_currency,
+    )
+
+    companies = list(consolidation["companies"])
+    currency = consolidation["currency"]
+
+    data = []
+    for (payment_type, tax_type), amounts in sorted(consolidation["rows"].items()):
+        if filters.payment_type and payment_type != filters.payment_type:
+            continue
+
+        row = frappe._dict({
+            "payment_type": _(PAYMENT_TYPE_LABELS.get(payment_type, payment_type)),
+            "tax_type": TAX_TYPE_LABELS.get(tax_type, tax_type),
+            "total": sum(amounts.values()),
+            "currency": currency,
+        })
+        for company in companies:
+            row[get_company_field(company)] = amounts.get(company, 0)
+        data.append(row)
+
+    return get_columns(companies, consolidation["companies"]), data, None, get_chart(
+        companies, data
+    ), get_report_summary(data, consolidation, currency)
+
+
+def get_company_field(company):
+    return "company_" + frappe.scrub(company)
+
+
+def get_columns(companies, company_info):
+    columns = [
+        {"label": _("Payment Type"), "fieldname": "payment_type", "fieldtype": "Data", "width": 170},
+        {"label": _("Tax Type"), "fieldname": "tax_type", "fieldtype": "Data", "width": 170},
+    ]
+    for company in companies:
+        label = company
+        if company_info[company]["rate"] != 1:
+            label = "{} ({} @ {})".format(
+                company, company_info[company]["currency"], flt(company_info[company]["rate"], 4)
+            )
+        columns.append({
+            "label": label,
+            "fieldname": get_company_field(company),
+            "fieldtype": "Currency",
+            "options": "currency",
+            "width": 160,
+        })
+    columns += [
+        {"label": _("Group Total"), "fieldname": "total", "fieldtype": "Currency", "options": "currency", "width": 160},
+        {"label": _("Currency"), "fieldname": "currency", "fieldtype": "Link", "options": "Currency", "hidden": 1},
+    ]
+    return columns
+
+
+def get_chart(companies, data):
+    if not data:
+        return None
+
+    return {
+        "data": {
+            "labels": companies,
+            "datasets": [{
+                "name": _("Withholding"),
+                "values": [
+                    flt(sum(row[get_company_field(company)] for row in data), 2)
+                    for company in companies
+                ],
+            }],
+        },
+        "type": "bar",
+        "fieldtype": "Currency",
+    }
+
+
+def get_report_summary(data, consolidation, currency):
+    slowest = max(
+        (info["duration_ms"] for info in consolidation["companies"].values()), default=0
+    )
+    return [
+        {"value": sum(row.total for row in data), "label": _("Group Withholding"), "datatype": "Currency", "currency": currency, "indicator": "Red"},
+        {"value": len(consolidation["companies"]), "label": _("Companies"), "datatype": "Int"},
+        {"value": consolidation["elapsed_ms"], "label": _("Elapsed (ms)"), "datatype": "Float"},
+        {"value": slowest, "label": _("Slowest Company (ms)"), "datatype": "Float"},
+    ]
@@ -0,0 +1,54 @@
+// Copyright (c) 2026, abdopcnet@gmail.com and contributors
+// For license information, please see license.txt
+
+frappe.query_reports['Receivables Deduction Forecast'] = {
+	filters: [
+		{
+			fieldname: 'company',
+			label: __('Company'),
+			fieldtype: 'Link',
+			options: 'Company',
+			default: frappe.defaults.get_user_default('Company'),
+			reqd: 1,
+		},
+		{
+			fieldname: 'from_date',
+			label: __('Due From'),
+			fieldtype: 'Date',
+			default: frappe.datetime.get_today(),
+			reqd: 1,
+		},
+		{
+			fieldname: 'to_date',
+			label: __('Due To'),
+			fieldtype: 'Date',
+			default: frappe.datetime.add_months(frappe.datetime.get_today(), 1),
+			reqd: 1,
+		},
+		{
+			fieldname: 'include_overdue',
+			label: __('Include Overdue'),
+			fieldtype: 'Check',
+			default: 1,
+		},
+		{
+			fieldname: 'group_by',
+			label: __('Group By'),
+			fieldtype: 'Select',
+			options: 'Customer\nAccount',
+			default: 'Customer',
+		},
+		{
+			fieldname: 'customer_group',
+			label: __('Customer Group'),
+			fieldtype: 'Link',
+			options: 'Customer Group',
+		},
+		{
+			fieldname: 'customer',
+			label: __('Customer'),
+			fieldtype: 'Link',
+			options: 'Customer',
+		},
+	],
+};
@@ -0,0 +1,287 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and contributors
+# For license information, please see license.txt
+
+"""
+Receivables Deduction Forecast
+Expected cash and withholding on open Sales Invoices due in a period
+
+Open invoices and their payment schedules are read in one query, with the
+amount due in the period computed in SQL. Deductions come from the expectation
+stored on each invoice at submit (computed in bulk for older invoices), are
+prorated to the amount due and converted to company currency, then summed per
+customer or per deduction account of the customer group's profile. No invoice
+document is loaded.
+
+The forecast assumes each due amount is paid as its own receipt under the
+current allocation, like Payment Entry references.
+"""
+
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    TAX_ACCOUNT_FIELDS,
+    TAX_TYPE_LABELS,
+    get_deduction_profile,
+)
+from payment_taxes_deductions.payment_taxes_deductions.sales_invoice import (
+    calculate_invoice_expectations,
+)
+
+# Invoices per bulk expectation calculation (bounds the VAT query)
+EXPECTATION_CHUNK_SIZE = 10000
+
+FORECAST_TAX_TYPES = tuple(tax_type for tax_type in TAX_ACCOUNT_FIELDS if tax_type != "vat_tax")
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    currency = frappe.get_cached_value("Company", filters.company, "default_currency")
+
+    invoices = get_due_invoices(filters)
+    forecasts = get_invoice_forecasts(invoices, filters.company)
+
+    if filters.group_by == "Account":
+        columns, data = get_account_rows(invoices, forecasts, filters.company, currency)
+    else:
+        columns, data = get_customer_rows(invoices, forecasts, currency)
+
+    due_amount = sum(flt(invoice.base_due_amount) for invoice in invoices)
+    withholding = sum(sum(deductions.values()) for deductions in forecasts.values())
+
+    return columns, data, None, get_chart(forecasts), get_report_summary(
+        due_amount, withholding, currency
+    )
+
+
+# ============================================================================
+# DATA
+# ============================================================================
+
+def get_invoice_conditions(filters, alias):
+    conditions = [
+        "{0}.company = %(company)s",
+        "{0}.docstatus = 1",
+        "{0}.outstanding_amount > 0",
+    ]
+    if filters.customer_group:
+        conditions.append("{0}.customer_group = %(customer_group)s")
+    if filters.customer:
+        conditions.append("{0}.customer = %(customer)s")
+    return " and ".join(condition.format(alias) for condition in conditions)
+
+
+def get_due_invoices(filters):
+    """
+    Open invoices with the amount due in the period
+
+    Invoices with a payment schedule use the outstanding of schedule rows due
+    in the period, others their own due date; both are capped at the invoice
+    outstanding (credit notes reduce it without touching the schedule).
+    """
+    due_condition = "{0}.due_date <= %(to_date)s"
+    if not cint(filters.include_overdue):
+        due_condition += " and {0}.due_date >= %(from_date)s"
+
+    invoices = frappe.db.sql(
+        """
+        select si.name, si.customer, si.customer_name, si.customer_group, si.grand_total,
+            si.conversion_rate, si.custom_expected_deductions,
+            if(schedule.parent is null,
+                if({invoice_due}, si.outstanding_amount, 0),
+                least(schedule.due_amount, si.outstanding_amount)) as due_amount
+        from `tabSales Invoice` si
+        left join (
+            select ps.parent, sum(if({schedule_due}, ps.outstanding, 0)) as due_amount
+            from `tabPayment Schedule` ps
+            inner join `tabSales Invoice` open_invoice on open_invoice.name = ps.parent
+            where ps.parenttype = 'Sales Invoice' and {open_invoice_conditions}
+            group by ps.parent
+        ) schedule on schedule.parent = si.name
+        where {invoice_conditions}
+        having due_amount > 0
+        """.format(
+            invoice_due=due_condition.format("si"),
+            schedule_due=due_condition.format("ps"),
+            open_invoice_conditions=get_invoice_conditions(filters, "open_invoice"),
+            invoice_conditions=get_invoice_conditions(filters, "si"),
+        ),
+        filters,
+        as_dict=True,
+    )
+
+    for invoice in invoices:
+        invoice.base_due_amount = flt(invoice.due_amount) * (flt(invoice.conversion_rate) or 1)
+
+    return invoices
+
+
+def get_invoice_forecasts(invoices, company):
+    """
+    Deductions expected on the amount due of each invoice, in company currency
+
+    Returns:
+        dict: invoice name -> {tax_type: amount}
+    """
+    expectations = {}
+    missing = []
+    for invoice in invoices:
+        if invoice.custom_expected_deductions:
+            expectations[invoice.name] = json.loads(invoice.custom_expected_deductions)
+        else:
+            missing.append(invoice)
+
+    for start in range(0, len(missing), EXPECTATION_CHUNK_SIZE):
+        expectations.update(
+            calculate_invoice_expectations(missing[start:start + EXPECTATION_CHUNK_SIZE], company)
+        )
+
+    forecasts = {}
+    for invoice in invoices:
+        expectation = expectations.get(invoice.name)
+        if not expectation or not flt(expectation.get("base")):
+            continue
+
+        ratio = flt(invoice.due_amount) / flt(expectation["base"]) * (flt(invoice.conversion_rate) or 1)
+        forecasts[invoice.name] = {
+            tax_type: flt(amount) * ratio
+            for tax_type, amount in expectation["deductions"].items()
+            if flt(amount)
+        }
+
+    return forecasts
+
+
+# ============================================================================
+# ROWS
+# ============================================================================
+
+def get_used_tax_types(forecasts):
+    used = {tax_type for deductions in forecasts.values() for tax_type in deductions}
+    return [tax_type for tax_type in FORECAST_TAX_TYPES if tax_type in used]
+
+
+def get_customer_rows(invoices, forecasts, currency):
+    tax_types = get_used_tax_types(forecasts)
+
+    rows = {}
+    for invoice in invoices:
+        row = rows.get(invoice.customer)
+        if not row:
+            row = rows[invoice.customer] = frappe._dict({
+                "customer": invoice.customer,
+                "customer_name": invoice.customer_name,
+                "customer_group": invoice.customer_group,
+                "invoices": 0,
+                "due_amount": 0,
+                "withholding": 0,
+                "currency": currency,
+                **{tax_type: 0 for tax_type in tax_types},
+            })
+
+        row.invoices += 1
+        row.due_amount += flt(invoice.base_due_amount)
+        for tax_type, amount in forecasts.get(invoice.name, {}).items():
+            row[tax_type] += amount
+            row.withholding += amount
+
+    data = sorted(rows.values(), key=lambda row: -row.due_amount)
+    for row in data:
+        row.expected_net = row.due_amount - row.withholding
+
+    columns = [
+        {"label": _("Customer"), "fieldname": "customer", "fieldtype": "Link", "options": "Customer", "width": 180},
+        {"label": _("Customer Name"), "fieldname": "customer_name", "fieldtype": "Data", "width": 180},
+        {"label": _("Customer Group"), "fieldname": "customer_group", "fieldtype": "Link", "options": "Customer Group", "width": 140},
+        {"label": _("Invoices"), "fieldname": "invoices", "fieldtype": "Int", "width": 80},
+        {"label": _("Due Amount"), "fieldname": "due_amount", "fieldtype": "Currency", "options": "currency", "width": 130},
+    ]
+    columns += [
+        {"label": TAX_TYPE_LABELS.get(tax_type, tax_type), "fieldname": tax_type, "fieldtype": "Currency", "options": "currency", "width": 120}
+        for tax_type in tax_types
+    ]
+    columns += [
+        {"label": _("Withholding"), "fieldname": "withholding", "fieldtype": "Currency", "options": "currency", "width": 130},
+        {"label": _("Expected Net"), "fieldname": "expected_net", "fieldtype": "Currency", "options": "currency", "width": 130},
+        {"label": _("Currency"), "fieldname": "currency", "fieldtype": "Link", "options": "Currency", "hidden": 1},
+    ]
+    return columns, data
+
+
+def get_account_rows(invoices, forecasts, company, currency):
+    # One profile per customer group, read from the shared cache
+    profiles = {}
+    rows = {}
+    for invoice in invoices:
+        deductions = forecasts.get(invoice.name)
+        if not deductions:
+            continue
+
+        group = invoice.customer_group or ""
+        if group not in profiles:
+            profiles[group] = get_deduction_profile(company, invoice.customer_group)
+
+        for tax_type, amount in deductions.items():
+            account = profiles[group].get(tax_type) or ""
+            row = rows.get((account, tax_type))
+            if not row:
+                row = rows[(account, tax_type)] = frappe._dict({
+                    "account": account,
+                    "tax_type": TAX_TYPE_LABELS.get(tax_type, tax_type),
+                    "invoices": 0,
+                    "customers": set(),
+                    "withholding": 0,
+                    "currency": currency,
+                })
+            row.invoices += 1
+            row.customers.add(invoice.customer)
+            row.withholding += amount
+
+    data = sorted(rows.values(), key=lambda row: -row.withholding)
+    for row in data:
+        row.customers = len(row.customers)
+
+    columns = [
+        {"label": _("Account"), "fieldname": "account", "fieldtype": "Link", "options": "Account", "width": 220},
+        {"label": _("Tax Type"), "fieldname": "tax_type", "fieldtype": "Data", "width": 160},
+        {"label": _("Invoices"), "fieldname": "invoices", "fieldtype": "Int", "width": 90},
+        {"label": _("Customers"), "fieldname": "customers", "fieldtype": "Int", "width": 90},
+        {"label": _("Withholding Liability"), "fieldname": "withholding", "fieldtype": "Currency", "options": "currency", "width": 150},
+        {"label": _("Currency"), "fieldname": "currency", "fieldtype": "Link", "options": "Currency", "hidden": 1},
+    ]
+    return columns, data
+
+
+# ============================================================================
+# SUMMARY
+# ============================================================================
+
+def get_chart(forecasts):
+    totals = {}
+    for deductions in forecasts.values():
+        for tax_type, amount in deductions.items():
+            totals[tax_type] = totals.get(tax_type, 0) + amount
+
+    tax_types = get_used_tax_types(forecasts)
+    if not tax_types:
+        return None
+
+    return {
+        "data": {
+            "labels": [TAX_TYPE_LABELS.get(tax_type, tax_type) for tax_type in tax_types],
+            "datasets": [{"name": _("Withholding"), "values": [flt(totals[tax_type], 2) for tax_type in tax_types]}],
+        },
+        "type": "bar",
+        "fieldtype": "Currency",
+    }
+
+
+def get_report_summary(due_amount, withholding, currency):
+    return [
+        {"value": due_amount, "label": _("Due Amount"), "datatype": "Currency", "currency": currency},
+        {"value": withholding, "label": _("Withholding Liability"), "datatype": "Currency", "currency": currency, "indicator": "Red"},
+        {"value": due_amount - withholding, "label": _("Expected Net Receivable"), "datatype": "Currency", "currency": currency, "indicator": "Green"},
+    ]
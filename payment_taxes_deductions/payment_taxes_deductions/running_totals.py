@@ -0,0 +1,324 @@
+"""
+Deduction Running Totals
+Cumulative paid and deducted amounts per company, customer, fiscal year and tax type
+
+Deduction Running Total rows are maintained incrementally: submitting a
+customer Payment Entry adds its amounts and cancelling subtracts them, with one
+INSERT ... ON DUPLICATE KEY UPDATE per entry so concurrent submits never lose
+an increment. Threshold rules read a single row by its unique key instead of
+scanning past payments, and the store can be rebuilt from the ledger.
+
+Structure:
+1. Store Access
+2. Hook Functions (on_submit, on_cancel)
+3. Cumulative Threshold Rules
+4. Rebuild
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt, now
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    get_account_tax_types,
+    get_deduction_profile,
+    get_profile_tax_types,
+)
+from payment_taxes_deductions.payment_taxes_deductions.exchange_rates import (
+    get_deduction_exchange_rate,
+)
+
+# Tax type of the row holding all payments of the customer, deducted or not
+PAYMENTS_TOTAL = "payments"
+
+# Commercial profits: 1% once the cumulative amount exceeds the threshold
+COMMERCIAL_PROFITS_THRESHOLD = 300
+COMMERCIAL_PROFITS_RATE = 0.01
+
+
+# ============================================================================
+# SECTION 1: STORE ACCESS
+# ============================================================================
+
+def get_fiscal_year_name(posting_date, company):
+    """Fiscal year of a posting date (ERPNext caches the lookup)"""
+    from erpnext.accounts.utils import get_fiscal_year
+
+    return get_fiscal_year(posting_date, company=company)[0]
+
+
+def increment_running_totals(company, customer, fiscal_year, amounts, sign=1):
+    """
+    Atomically add amounts to the running totals of a customer
+
+    Args:
+        company: Company name
+        customer: Customer name
+        fiscal_year: Fiscal Year name
+        amounts: {tax_type: (base_amount, deducted_amount)}
+        sign: 1 on submit, -1 on cancel
+    """
+    if not amounts:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    values = []
+    for tax_type, (base_amount, deducted_amount) in amounts.items():
+        values.append((
+            frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+            company, customer, fiscal_year, tax_type,
+            sign * flt(base_amount), sign * flt(deducted_amount), sign,
+        ))
+
+    # Rows are matched on the unique (company, customer, fiscal_year, tax_type) key
+    frappe.db.sql(
+        """
+        insert into `tabDeduction Running Total`
+            (name, creation, modified, owner, modified_by,
+            company, customer, fiscal_year, tax_type,
+            base_amount, deducted_amount, entry_count)
+        values {placeholders}
+        on duplicate key update
+            base_amount = base_amount + values(base_amount),
+            deducted_amount = deducted_amount + values(deducted_amount),
+            entry_count = entry_count + values(entry_count),
+            modified = values(modified)
+        """.format(placeholders=", ".join(["%s"] * len(values))),
+        values,
+    )
+
+
+def get_running_total(company, customer, fiscal_year, tax_type):
+    """
+    Read one running total by its unique key
+
+    Returns:
+        dict: base_amount, deducted_amount and entry_count (zeros when missing)
+    """
+    return frappe.db.get_value(
+        "Deduction Running Total",
+        {
+            "company": company,
+            "customer": customer,
+            "fiscal_year": fiscal_year,
+            "tax_type": tax_type,
+        },
+        ["base_amount", "deducted_amount", "entry_count"],
+        as_dict=True,
+    ) or frappe._dict(base_amount=0, deducted_amount=0, entry_count=0)
+
+
+# ============================================================================
+# SECTION 2: HOOK FUNCTIONS (ON_SUBMIT, ON_CANCEL)
+# ============================================================================
+
+def get_entry_amounts(doc):
+    """
+    Amounts a customer Payment Entry contributes to the running totals
+
+    Args:
+        doc: Payment Entry document
+
+    Returns:
+        dict: {tax_type: (base_amount, deducted_amount)}
+    """
+    base_paid_amount = flt(doc.base_paid_amount or doc.paid_amount)
+    profile = get_deduction_profile(doc.company, doc.get("custom_customer_group"))
+    # Same mapping as get_account_tax_types() used by the rebuild
+    account_tax_types = get_profile_tax_types(profile)
+
+    amounts = {PAYMENTS_TOTAL: (base_paid_amount, 0)}
+    for tax in doc.get("taxes") or []:
+        tax_type = account_tax_types.get(tax.get("custom_deduction_account") or tax.account_head)
+        if not tax_type or tax.add_deduct_tax != "Deduct":
+            continue
+        deducted = amounts.get(tax_type, (base_paid_amount, 0))[1]
+        amounts[tax_type] = (base_paid_amount, deducted + flt(tax.base_tax_amount or tax.tax_amount))
+
+    return amounts
+
+
+def update_running_totals(doc, sign):
+    if doc.payment_type != "Receive" or doc.party_type != "Customer":
+        return
+
+    increment_running_totals(
+        doc.company,
+        doc.party,
+        get_fiscal_year_name(doc.posting_date, doc.company),
+        get_entry_amounts(doc),
+        sign,
+    )
+
+
+def on_submit(doc, method=None):
+    """Add a submitted Payment Entry to the running totals"""
+    update_running_totals(doc, 1)
+
+
+def on_cancel(doc, method=None):
+    """Remove a cancelled Payment Entry from the running totals"""
+    update_running_totals(doc, -1)
+
+
+# ============================================================================
+# SECTION 3: CUMULATIVE THRESHOLD RULES
+# ============================================================================
+
+def apply_cumulative_commercial_profits(doc, company, customer_group=None):
+    """
+    Set commercial profits from the customer's fiscal year running totals
+
+    The 300 threshold applies to the cumulative amount of the fiscal year. Once
+    it is crossed, 1% of the cumulative amount is due, less what earlier
+    payments already withheld, so amounts below the threshold are caught up.
+
+    Args:
+        doc: Payment Entry document
+        company: Company name
+        customer_group: Customer Group name (optional, for filtering accounts)
+    """
+    if doc.payment_type != "Receive" or doc.party_type != "Customer" or not doc.party:
+        return
+
+    account = get_deduction_profile(company, customer_group).get("commercial_profits")
+    rows = [tax for tax in doc.get("taxes") or [] if tax.account_head == account]
+    if not account or not rows:
+        return
+
+    fiscal_year = get_fiscal_year_name(doc.posting_date, company)
+    payments = get_running_total(company, doc.party, fiscal_year, PAYMENTS_TOTAL)
+    withheld = get_running_total(company, doc.party, fiscal_year, "commercial_profits")
+
+    # Running totals are in company currency, the row is in account currency
+    exchange_rate = get_deduction_exchange_rate(doc)
+
+    cumulative = flt(payments.base_amount) + flt(doc.paid_amount) * exchange_rate
+    amount = 0
+    if cumulative > COMMERCIAL_PROFITS_THRESHOLD:
+        amount = max(cumulative * COMMERCIAL_PROFITS_RATE - flt(withheld.deducted_amount), 0)
+
+    rows[0].tax_amount = amount / exchange_rate
+    for tax in rows[1:]:
+        tax.tax_amount = 0
+
+
+# ============================================================================
+# SECTION 4: REBUILD
+# ============================================================================
+
+def rebuild_running_totals(company=None, fiscal_year=None):
+    """
+    Rebuild running totals from submitted Payment Entries
+
+    Args:
+        company: Only rebuild this company (all companies when empty)
+        fiscal_year: Only rebuild this fiscal year (all years when empty)
+
+    Returns:
+        int: Number of running total rows written
+    """
+    companies = [company] if company else frappe.get_all("Company", pluck="name")
+    fiscal_years = frappe.get_all(
+        "Fiscal Year",
+        filters={"name": fiscal_year} if fiscal_year else {},
+        fields=["name", "year_start_date", "year_end_date"],
+    )
+
+    count = 0
+    for company_name in companies:
+        account_tax_types = get_account_tax_types(company_name)
+
+        for year in fiscal_years:
+            frappe.db.delete(
+                "Deduction Running Total", {"company": company_name, "fiscal_year": year.name}
+            )
+
+            values = {
+                "company": company_name,
+                "from_date": year.year_start_date,
+                "to_date": year.year_end_date,
+            }
+            totals = {}
+            for party, base_amount, entries in frappe.db.sql(
+                """
+                select party, sum(base_paid_amount), count(*)
+                from `tabPayment Entry`
+                where company = %(company)s and docstatus = 1
+                    and payment_type = 'Receive' and party_type = 'Customer'
+                    and posting_date between %(from_date)s and %(to_date)s
+                group by party
+                """,
+                values,
+            ):
+                totals[(party, PAYMENTS_TOTAL)] = [flt(base_amount), 0, entries]
+
+            if account_tax_types:
+                # Accounts sharing a tax type count the paid amount of an entry once
+                account = "coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head)"
+                cases = []
+                for position, (account_name, tax_type) in enumerate(account_tax_types.items()):
+                    values[f"account_{position}"] = account_name
+                    values[f"tax_type_{position}"] = tax_type
+                    cases.append(f"when %(account_{position})s then %(tax_type_{position})s")
+
+                for party, tax_type, base_amount, deducted, entries in frappe.db.sql(
+                    """
+                    select party, tax_type, sum(base_paid_amount), sum(deducted), count(*)
+                    from (
+                        select pe.party, pe.base_paid_amount,
+                            case {account} {cases} end as tax_type,
+                            sum(tax.base_tax_amount) as deducted
+                        from `tabPayment Entry` pe
+                        inner join `tabAdvance Taxes and Charges` tax
+                            on tax.parent = pe.name and tax.parenttype = 'Payment Entry'
+                        where pe.company = %(company)s and pe.docstatus = 1
+                            and pe.payment_type = 'Receive' and pe.party_type = 'Customer'
+                            and pe.posting_date between %(from_date)s and %(to_date)s
+                            and tax.add_deduct_tax = 'Deduct'
+                            and {account} in %(accounts)s
+                        group by pe.name, tax_type
+                    ) entry_deductions
+                    group by party, tax_type
+                    """.format(account=account, cases=" ".join(cases)),
+                    dict(values, accounts=tuple(account_tax_types)),
+                ):
+                    totals[(party, tax_type)] = [flt(base_amount), flt(deducted), entries]
+
+            timestamp = now()
+            user = frappe.session.user
+            frappe.db.bulk_insert(
+                "Deduction Running Total",
+                fields=[
+                    "name", "creation", "modified", "owner", "modified_by",
+                    "company", "customer", "fiscal_year", "tax_type",
+                    "base_amount", "deducted_amount", "entry_count",
+                ],
+                values=[
+                    (
+                        frappe.generate_hash(length=10), timestamp, timestamp, user, user,
+                        company_name, party, year.name, tax_type, base_amount, deducted, entries,
+                    )
+                    for (party, tax_type), (base_amount, deducted, entries) in totals.items()
+                ],
+            )
+            frappe.db.commit()
+            count += len(totals)
+
+    return count
+
+
+@frappe.whitelist()
+def enqueue_rebuild_running_totals(company=None, fiscal_year=None):
+    """Rebuild running totals in a background job"""
+    frappe.only_for("System Manager")
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.running_totals.rebuild_running_totals",
+        queue="long",
+        timeout=60 * 60,
+        company=company,
+        fiscal_year=fiscal_year,
+    )
+    frappe.msgprint(_("Rebuilding deduction running totals in the background"))
@@ -0,0 +1,287 @@
+"""
+Sales Invoice Expected Deductions
+Precompute the deductions expected on a Sales Invoice when it is submitted
+
+The expectation is computed once for the full invoice amount (VAT 20% share,
+stamp brackets, commercial profits) and stored as compact JSON in the
+custom_expected_deductions field. Payment Entry then aggregates the stored
+expectations across its references, prorated by allocated_amount, instead of
+loading every referenced invoice.
+
+Structure:
+1. Expectation Calculation
+2. Hook Functions (on_submit)
+3. Payment Entry Aggregation
+"""
+
+import json
+
+import frappe
+from frappe.utils import flt
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    evaluate_deductions,
+    get_compiled_brackets,
+    get_deduction_profile,
+)
+
+# Invoice rows memoized per request or job
+EXPECTATION_MEMO_SIZE = 20000
+
+
+# ============================================================================
+# SECTION 1: EXPECTATION CALCULATION
+# ============================================================================
+
+def calculate_expected_deductions(grand_total, vat_amount, company, customer_group=None,
+                                  conversion_rate=1, rules=None):
+    """
+    Calculate the deductions expected for a full invoice amount
+
+    Args:
+        grand_total: Invoice grand total
+        vat_amount: VAT charged on the invoice
+        company: Company name
+        customer_group: Customer Group name (optional, for filtering accounts)
+        conversion_rate: Invoice currency to company currency (brackets are in company currency)
+        rules: Rule context with brackets and profiles to use instead of the current
+            configuration (see get_rules_profile)
+
+    Returns:
+        dict: {"base": grand_total, "deductions": {tax_type: amount}} or None
+    """
+    profile = get_rules_profile(company, customer_group, rules)
+    if not any(profile.values()):
+        return None
+
+    brackets = rules["brackets"] if rules else get_compiled_brackets(company)
+    deductions = evaluate_deductions(grand_total, brackets, profile, vat_amount, conversion_rate)
+
+    return {
+        "base": flt(grand_total),
+        "deductions": {tax_type: flt(amount, 6) for tax_type, amount in deductions.items()},
+    }
+
+
+def get_rules_profile(company, customer_group=None, rules=None):
+    """
+    Deduction profile of a customer group, from a rule context when given
+
+    The deduction verifier passes the context of build_rule_context(), whose
+    brackets and profiles may be reverted to an earlier date; without one the
+    current configuration is read from the cache.
+
+    Returns:
+        dict: tax_type -> account
+    """
+    if rules is None:
+        return get_deduction_profile(company, customer_group)
+    return rules["profiles"].get(customer_group or "") or {}
+
+
+def get_invoice_vat_amount(taxes, vat_tax_account):
+    """
+    Sum the VAT charged on an invoice taxes table
+
+    Args:
+        taxes: Sales Taxes and Charges rows
+        vat_tax_account: VAT account from Payment Deductions Accounts
+
+    Returns:
+        float: Total VAT amount
+    """
+    if not vat_tax_account:
+        return 0
+
+    return sum(
+        flt(tax.tax_amount) for tax in taxes or [] if tax.account_head == vat_tax_account
+    )
+
+
+# ============================================================================
+# SECTION 2: HOOK FUNCTIONS
+# ============================================================================
+
+def on_submit(doc, method=None):
+    """
+    Store expected deductions on the Sales Invoice when it is submitted
+
+    Args:
+        doc: Sales Invoice document
+        method: Method name (not used, required for hooks)
+    """
+    customer_group = doc.get("customer_group")
+    profile = get_deduction_profile(doc.company, customer_group)
+    vat_amount = get_invoice_vat_amount(doc.get("taxes"), profile.get("vat_tax"))
+
+    expectations = calculate_expected_deductions(
+        doc.grand_total, vat_amount, doc.company, customer_group, doc.get("conversion_rate") or 1
+    )
+
+    doc.db_set(
+        "custom_expected_deductions",
+        json.dumps(expectations, separators=(",", ":")) if expectations else None,
+        update_modified=False,
+    )
+
+
+# ============================================================================
+# SECTION 3: PAYMENT ENTRY AGGREGATION
+# ============================================================================
+
+def get_reference_expectations(references, company, customer_group=None):
+    """
+    Aggregate expected deductions across Payment Entry references
+    Each invoice expectation is prorated by allocated_amount / base
+
+    Args:
+        references: Payment Entry references table
+        company: Company name
+        customer_group: Customer Group name (optional, for filtering accounts)
+
+    Returns:
+        dict: tax_type -> prorated expected amount
+    """
+    totals = {}
+    for _ref, deductions in get_reference_expectation_rows(references, company, customer_group):
+        for tax_type, amount in deductions.items():
+            totals[tax_type] = totals.get(tax_type, 0) + amount
+
+    return totals
+
+
+def get_reference_expectation_rows(references, company, customer_group=None, rules=None):
+    """
+    Get the prorated expected deductions of each Sales Invoice reference
+
+    Invoices submitted before expectations were stored are computed on the fly
+    from their taxes rows in bulk, so no invoice document is ever loaded.
+
+    Args:
+        references: Payment Entry references table
+        company: Company name
+        customer_group: Customer Group name (optional, for filtering accounts)
+        rules: Rule context for computed expectations (optional, see get_rules_profile)
+
+    Returns:
+        list: (reference row, {tax_type: prorated amount}) per Sales Invoice reference
+    """
+    invoice_names = list({
+        ref.reference_name
+        for ref in references or []
+        if ref.reference_doctype == "Sales Invoice" and ref.reference_name
+    })
+    if not invoice_names:
+        return []
+
+    invoices = get_invoice_expectation_rows(invoice_names)
+
+    expectations = {}
+    missing = []
+    for name, row in invoices.items():
+        if row.custom_expected_deductions:
+            expectations[name] = json.loads(row.custom_expected_deductions)
+        else:
+            missing.append(row)
+
+    if missing:
+        expectations.update(calculate_invoice_expectations(missing, company, customer_group, rules))
+
+    rows = []
+    for ref in references:
+        if ref.reference_doctype != "Sales Invoice":
+            continue
+
+        expectation = expectations.get(ref.reference_name)
+        if not expectation or not flt(expectation.get("base")):
+            rows.append((ref, {}))
+            continue
+
+        ratio = flt(ref.allocated_amount) / flt(expectation["base"])
+        rows.append((ref, {
+            tax_type: amount * ratio for tax_type, amount in expectation["deductions"].items()
+        }))
+
+    return rows
+
+
+def get_invoice_expectation_rows(invoice_names):
+    """
+    Read grand total and stored expectation of submitted invoices
+
+    Rows are memoized for the request or job: a Payment Entry save reads its
+    references once for VAT 20%, per-reference allocation and the fingerprint,
+    and expectations never change after submit.
+
+    Returns:
+        dict: invoice name -> row
+    """
+    if not hasattr(frappe.local, "deduction_invoice_expectations"):
+        frappe.local.deduction_invoice_expectations = {}
+    cache = frappe.local.deduction_invoice_expectations
+
+    # Long jobs read many invoices, keep the memo bounded
+    if len(cache) > EXPECTATION_MEMO_SIZE:
+        cache.clear()
+
+    missing = [name for name in invoice_names if name not in cache]
+    if missing:
+        for row in frappe.get_all(
+            "Sales Invoice",
+            filters={"name": ["in", missing], "docstatus": 1},
+            fields=["name", "grand_total", "conversion_rate", "custom_expected_deductions"],
+        ):
+            cache[row.name] = row
+
+    return {name: cache[name] for name in invoice_names if name in cache}
+
+
+def calculate_invoice_expectations(invoices, company, customer_group=None, rules=None):
+    """
+    Calculate expectations in bulk for invoices without stored ones
+    VAT rows of all invoices are read in a single query
+
+    Args:
+        invoices: Rows with name, grand_total and optionally conversion_rate and customer_group
+        company: Company name
+        customer_group: Fallback Customer Group for rows without one
+        rules: Rule context to use instead of the current configuration (optional)
+
+    Returns:
+        dict: invoice name -> expectation
+    """
+    groups = {invoice.name: invoice.get("customer_group") or customer_group for invoice in invoices}
+    vat_accounts = {
+        get_rules_profile(company, group, rules).get("vat_tax") for group in set(groups.values())
+    }
+    vat_accounts.discard("")
+
+    vat_by_invoice = {}
+    if vat_accounts:
+        for tax in frappe.get_all(
+            "Sales Taxes and Charges",
+            filters={
+                "parenttype": "Sales Invoice",
+                "parent": ["in", list(groups)],
+                "account_head": ["in", list(vat_accounts)],
+            },
+            fields=["parent", "account_head", "tax_amount"],
+        ):
+            profile = get_rules_profile(company, groups[tax.parent], rules)
+            if tax.account_head == profile.get("vat_tax"):
+                vat_by_invoice[tax.parent] = vat_by_invoice.get(tax.parent, 0) + flt(tax.tax_amount)
+
+    expectations = {}
+    for invoice in invoices:
+        expectation = calculate_expected_deductions(
+            invoice.grand_total,
+            vat_by_invoice.get(invoice.name, 0),
+            company,
+            groups[invoice.name],
+            invoice.get("conversion_rate") or 1,
+            rules,
+        )
+        if expectation:
+            expectations[invoice.name] = expectation
+
+    return expectations
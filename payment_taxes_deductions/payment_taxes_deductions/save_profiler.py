@@ -0,0 +1,207 @@
+"""
+Save Profiler
+Opt-in sampling profiler for slow Payment Entry saves and deduction API calls
+
+When "Enable Save Profiler" is set in Payment Deductions Settings, decorated
+functions run under a pyinstrument sampling profiler while their SQL queries
+are recorded. Calls slower than the threshold are kept: the call tree (pruned
+to frames above PRUNE_SHARE of the total) and the query list are stored as a
+Deduction Profile Log, whose form draws the tree as a flame graph. Faster calls
+are discarded, and nothing is sampled while the setting is off.
+
+Logs are written from a short background job, so a save that fails (and rolls
+back) is still recorded.
+
+Structure:
+1. Call Tree
+2. SQL Capture
+3. Decorator
+4. Log Storage
+"""
+
+import functools
+import json
+import time
+
+import frappe
+from frappe.utils import cint, flt
+
+# Frames below this share of the total time are dropped from the stored tree
+PRUNE_SHARE = 0.005
+MAX_DEPTH = 80
+
+MAX_QUERIES = 500
+QUERY_LENGTH = 1000
+
+
+# ============================================================================
+# SECTION 1: CALL TREE
+# ============================================================================
+
+def compact_frame(frame, total, depth=0):
+    """
+    Convert a pyinstrument frame into a compact nested dict
+
+    Returns:
+        dict: {"n": function, "f": file:line, "t": time in ms, "c": [children]}
+    """
+    children = []
+    if depth < MAX_DEPTH:
+        children = [
+            compact_frame(child, total, depth + 1)
+            for child in frame.children
+            if child.time >= total * PRUNE_SHARE
+        ]
+
+    return {
+        "n": frame.function,
+        "f": "{}:{}".format(frame.file_path_short or "", frame.line_no or ""),
+        "t": round(frame.time * 1000, 2),
+        "c": children,
+    }
+
+
+def get_call_tree(session):
+    root = session.root_frame() if session else None
+    if not root or not root.time:
+        return None
+    return compact_frame(root, root.time)
+
+
+# ============================================================================
+# SECTION 2: SQL CAPTURE
+# ============================================================================
+
+def capture_queries(queries):
+    """
+    Record every frappe.db.sql call of this request into queries
+    Same approach as frappe.recorder: the bound method is swapped on frappe.db
+
+    Args:
+        queries: List receiving [duration_ms, query] (capped at MAX_QUERIES)
+
+    Returns:
+        tuple: (counters dict with count and time_ms, restore function)
+    """
+    db = frappe.db
+    original_sql = db.sql
+    counters = {"count": 0, "time_ms": 0.0}
+
+    def sql(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_sql(*args, **kwargs)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            counters["count"] += 1
+            counters["time_ms"] += duration_ms
+            if len(queries) < MAX_QUERIES:
+                query = db.last_query or (args[0] if args else "")
+                queries.append([round(duration_ms, 3), str(query)[:QUERY_LENGTH]])
+
+    def restore():
+        db.sql = original_sql
+
+    db.sql = sql
+    return counters, restore
+
+
+# ============================================================================
+# SECTION 3: DECORATOR
+# ============================================================================
+
+def profile_slow_calls(label):
+    """
+    Profile the decorated function when the save profiler is enabled
+
+    Put it under @frappe.whitelist() so the whitelisted function is the wrapper.
+
+    Args:
+        label: Name stored on the log (e.g. "Payment Entry.before_validate")
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Nested profiled calls are part of the outer profile
+            if getattr(frappe.local, "deduction_profiling", False):
+                return fn(*args, **kwargs)
+
+            from payment_taxes_deductions.payment_taxes_deductions.doctype.payment_deductions_settings.payment_deductions_settings import (
+                get_deduction_settings,
+            )
+
+            settings = get_deduction_settings()
+            if not cint(settings.enable_save_profiler):
+                return fn(*args, **kwargs)
+
+            return run_profiled(label, fn, args, kwargs, settings)
+
+        return wrapper
+
+    return decorator
+
+
+def run_profiled(label, fn, args, kwargs, settings):
+    from pyinstrument import Profiler
+
+    profiler = Profiler(interval=(flt(settings.profiler_interval_ms) or 1) / 1000)
+    queries = []
+    counters, restore_sql = capture_queries(queries)
+
+    frappe.local.deduction_profiling = True
+    start = time.perf_counter()
+    profiler.start()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        session = profiler.stop()
+        duration_ms = (time.perf_counter() - start) * 1000
+        restore_sql()
+        frappe.local.deduction_profiling = False
+
+        if duration_ms >= cint(settings.profiler_threshold_ms):
+            enqueue_profile_log(label, args, duration_ms, get_call_tree(session), queries, counters)
+
+
+# ============================================================================
+# SECTION 4: LOG STORAGE
+# ============================================================================
+
+def enqueue_profile_log(label, args, duration_ms, call_tree, queries, counters):
+    doc = args[0] if args and hasattr(args[0], "doctype") else None
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.save_profiler.save_profile_log",
+        queue="short",
+        method_name=label,
+        reference_doctype=doc.doctype if doc else None,
+        reference_name=doc.name if doc else None,
+        reference_count=len(doc.get("references") or []) if doc else 0,
+        user=frappe.session.user,
+        duration_ms=duration_ms,
+        call_tree=call_tree,
+        queries=queries,
+        sql_count=counters["count"],
+        sql_time_ms=counters["time_ms"],
+    )
+
+
+def save_profile_log(method_name, duration_ms, call_tree, queries, sql_count, sql_time_ms,
+                     reference_doctype=None, reference_name=None, reference_count=0, user=None):
+    """
+    Insert a Deduction Profile Log (background job)
+    Links are not validated: the profiled save may not be committed yet, or rolled back
+    """
+    frappe.get_doc({
+        "doctype": "Deduction Profile Log",
+        "method": method_name,
+        "reference_doctype": reference_doctype if reference_name else None,
+        "reference_name": reference_name,
+        "reference_count": reference_count,
+        "user": user,
+        "duration_ms": flt(duration_ms, 2),
+        "sql_count": sql_count,
+        "sql_time_ms": flt(sql_time_ms, 2),
+        "call_tree": json.dumps(call_tree, separators=(",", ":")) if call_tree else None,
+        "queries": json.dumps(queries, separators=(",", ":")),
+    }).insert(ignore_permissions=True, ignore_links=True)
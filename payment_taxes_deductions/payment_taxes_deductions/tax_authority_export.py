@@ -0,0 +1,423 @@
+"""
+Tax Authority Submission File
+Build the monthly withholding/stamp return listing every deduction with party tax IDs
+
+Each company and period keeps a staging file (one JSON line per deduction,
+grouped by Payment Entry) and a high-water mark of Payment Entry.modified in a
+Deduction Job Checkpoint. A run only reads Payment Entries modified since the
+checkpoint, merges them into the staging file (cancelled entries are dropped),
+then streams the submission file (JSON or XML) from the staging file without
+touching the database again. A local validator stands in for the portal.
+The delta is read from the read replica when one is configured, starting an
+overlap before the mark (read_replica.get_read_from) so entries committed
+late or not yet replicated at the last run are merged again.
+
+Files are built in a background job, one at a time per company and period
+(the job id is the checkpoint name), so two requests never write the same
+staging file. Paid amounts are reported in company currency like the
+deduction amounts.
+
+Structure:
+1. Delta Reading
+2. Staging Merge
+3. Streaming Writers
+4. Validation (local stub)
+5. API Methods
+"""
+
+import json
+import os
+import re
+from xml.sax.saxutils import XMLGenerator
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, get_last_day, getdate
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    TAX_TYPE_LABELS,
+    get_account_tax_types,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.deduction_job_checkpoint.deduction_job_checkpoint import (
+    get_checkpoint,
+    save_checkpoint,
+)
+from payment_taxes_deductions.payment_taxes_deductions.read_replica import (
+    get_read_from,
+    replica_connection,
+)
+
+JOB_TYPE = "Tax Authority Export"
+
+CHUNK_SIZE = 20000
+
+# Egyptian tax registration numbers are 9 digits (dashes allowed)
+TAX_ID_PATTERN = re.compile(r"^\d{3}-?\d{3}-?\d{3}$")
+
+
+# ============================================================================
+# SECTION 1: DELTA READING
+# ============================================================================
+
+def read_changed_entries(company, from_date, to_date, since, accounts, db=None):
+    """
+    Read deduction rows of Payment Entries modified after the high-water mark
+
+    Rows are read in keyset chunks on (modified, name); rows of cancelled or
+    draft entries are returned with docstatus so they can be dropped.
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        since: High-water mark (Payment Entry.modified), None for a full read; the
+            read starts the overlap of get_read_from before it
+        accounts: account -> tax_type of the company
+        db: Connection to read from (defaults to frappe.db)
+
+    Returns:
+        tuple: ({payment_entry: [rows]}, highest modified seen)
+    """
+    db = db or frappe.db
+    changed = {}
+    last_modified, last_name = get_read_from(since) or "1900-01-01", ""
+    highest = since
+
+    while True:
+        chunk = db.sql(
+            """
+            select pe.name, pe.modified, pe.docstatus, pe.posting_date, pe.party_type,
+                pe.party, pe.base_paid_amount,
+                coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head),
+                tax.base_tax_amount,
+                coalesce(customer.tax_id, supplier.tax_id, '')
+            from `tabPayment Entry` pe
+            left join `tabAdvance Taxes and Charges` tax
+                on tax.parent = pe.name and tax.parenttype = 'Payment Entry'
+            left join `tabCustomer` customer
+                on pe.party_type = 'Customer' and customer.name = pe.party
+            left join `tabSupplier` supplier
+                on pe.party_type = 'Supplier' and supplier.name = pe.party
+            where pe.company = %(company)s
+                and pe.posting_date between %(from_date)s and %(to_date)s
+                and (pe.modified > %(last_modified)s
+                    or (pe.modified = %(last_modified)s and pe.name > %(last_name)s))
+            order by pe.modified, pe.name
+            limit %(limit)s
+            """,
+            {
+                "company": company,
+                "from_date": from_date,
+                "to_date": to_date,
+                "last_modified": last_modified,
+                "last_name": last_name,
+                "limit": CHUNK_SIZE,
+            },
+        )
+
+        # Re-read a Payment Entry whose tax rows were cut by the limit
+        has_more = len(chunk) == CHUNK_SIZE
+        if has_more:
+            cut = chunk[-1][0]
+            chunk = [row for row in chunk if row[0] != cut] or chunk
+
+        for (name, modified, docstatus, posting_date, party_type, party, base_paid_amount,
+                account, tax_amount, tax_id) in chunk:
+            rows = changed.setdefault(name, [])
+            if docstatus == 1 and account in accounts:
+                rows.append({
+                    "payment_entry": name,
+                    "posting_date": str(posting_date),
+                    "party_type": party_type,
+                    "party": party,
+                    "tax_id": tax_id,
+                    "tax_type": accounts[account],
+                    "account": account,
+                    "paid_amount": flt(base_paid_amount),
+                    "tax_amount": flt(tax_amount),
+                })
+            if highest is None or str(modified) > str(highest):
+                highest = str(modified)
+
+        if not has_more:
+            break
+
+        last_modified, last_name = str(chunk[-1][1]), chunk[-1][0]
+
+    return changed, highest
+
+
+# ============================================================================
+# SECTION 2: STAGING MERGE
+# ============================================================================
+
+def get_export_folder(company):
+    folder = frappe.get_site_path("private", "files", "tax_authority", frappe.scrub(company))
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def merge_staging(staging_path, changed):
+    """
+    Merge changed Payment Entries into the staging file
+    Lines of changed entries are replaced, everything else is copied as is
+
+    Args:
+        staging_path: Path of the JSON lines staging file
+        changed: {payment_entry: [rows]} from read_changed_entries()
+
+    Returns:
+        int: Number of deduction lines in the merged file
+    """
+    temp_path = staging_path + ".tmp"
+    count = 0
+
+    with open(temp_path, "w") as output:
+        if os.path.exists(staging_path):
+            with open(staging_path) as staging:
+                for line in staging:
+                    if json.loads(line)["payment_entry"] in changed:
+                        continue
+                    output.write(line)
+                    count += 1
+
+        for rows in changed.values():
+            for row in rows:
+                output.write(json.dumps(row, separators=(",", ":"), ensure_ascii=False) + "\n")
+                count += 1
+
+    os.replace(temp_path, staging_path)
+    return count
+
+
+def attach_submission_file(company, file_name):
+    """
+    Register the written submission file as a private File on the Company
+    The file is written in place, so the File document only points to it
+
+    Returns:
+        str: file_url of the submission file
+    """
+    file_url = f"/private/files/tax_authority/{frappe.scrub(company)}/{file_name}"
+    if not frappe.db.exists("File", {"file_url": file_url}):
+        frappe.get_doc({
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": file_url,
+            "attached_to_doctype": "Company",
+            "attached_to_name": company,
+            "is_private": 1,
+        }).insert(ignore_permissions=True)
+    return file_url
+
+
+def iter_staging(staging_path):
+    if not os.path.exists(staging_path):
+        return
+    with open(staging_path) as staging:
+        for line in staging:
+            yield json.loads(line)
+
+
+# ============================================================================
+# SECTION 3: STREAMING WRITERS
+# ============================================================================
+
+def write_json(path, header, entries):
+    """Stream the submission file as JSON, one entry at a time"""
+    totals = {}
+    count = 0
+    with open(path, "w") as output:
+        output.write('{"header":')
+        output.write(json.dumps(header, ensure_ascii=False))
+        output.write(',"entries":[')
+        for entry in entries:
+            if count:
+                output.write(",")
+            output.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False))
+            totals[entry["tax_type"]] = totals.get(entry["tax_type"], 0) + entry["tax_amount"]
+            count += 1
+        output.write('],"totals":')
+        output.write(json.dumps({key: flt(value, 2) for key, value in totals.items()}))
+        output.write(f',"count":{count}}}')
+    return count
+
+
+def write_xml(path, header, entries):
+    """Stream the submission file as XML with a SAX generator"""
+    totals = {}
+    count = 0
+    with open(path, "w", encoding="utf-8") as output:
+        xml = XMLGenerator(output, encoding="utf-8")
+        xml.startDocument()
+        xml.startElement("WithholdingReturn", {key: str(value) for key, value in header.items()})
+        xml.startElement("Entries", {})
+        for entry in entries:
+            xml.startElement("Entry", {})
+            for key, value in entry.items():
+                xml.startElement(key, {})
+                xml.characters(str(value))
+                xml.endElement(key)
+            xml.endElement("Entry")
+            totals[entry["tax_type"]] = totals.get(entry["tax_type"], 0) + entry["tax_amount"]
+            count += 1
+        xml.endElement("Entries")
+        xml.startElement("Totals", {"count": str(count)})
+        for tax_type, amount in totals.items():
+            xml.startElement("Total", {"tax_type": tax_type, "label": TAX_TYPE_LABELS.get(tax_type, "")})
+            xml.characters(f"{amount:.2f}")
+            xml.endElement("Total")
+        xml.endElement("Totals")
+        xml.endElement("WithholdingReturn")
+        xml.endDocument()
+    return count
+
+
+# ============================================================================
+# SECTION 4: VALIDATION (LOCAL STUB)
+# ============================================================================
+
+def validate_entries(entries, limit=100):
+    """
+    Local stand-in for the tax authority portal validation
+
+    Checks party tax IDs and amounts of every entry.
+
+    Args:
+        entries: Iterable of submission entries
+        limit: Maximum number of errors reported
+
+    Returns:
+        list: Error messages (empty when the file would be accepted)
+    """
+    errors = []
+    for entry in entries:
+        problems = []
+        if not entry.get("tax_id"):
+            problems.append(_("missing tax ID"))
+        elif not TAX_ID_PATTERN.match(entry["tax_id"]):
+            problems.append(_("invalid tax ID {0}").format(entry["tax_id"]))
+        if flt(entry.get("tax_amount")) <= 0:
+            problems.append(_("non-positive tax amount"))
+        if flt(entry.get("paid_amount")) <= 0:
+            problems.append(_("non-positive paid amount"))
+
+        if problems:
+            errors.append("{} ({}): {}".format(
+                entry["payment_entry"], entry.get("party"), ", ".join(problems)
+            ))
+            if len(errors) >= limit:
+                break
+
+    return errors
+
+
+# ============================================================================
+# SECTION 5: API METHODS
+# ============================================================================
+
+def build_submission_file(company, period, file_format="JSON", rebuild=0):
+    """
+    Background job: build the withholding/stamp return of a company for one month
+    The result (file_url, count, validation errors) is kept in the checkpoint state
+
+    Args:
+        company: Company name
+        period: Month as YYYY-MM
+        file_format: "JSON" or "XML"
+        rebuild: Ignore the checkpoint and read the whole period again
+
+    Returns:
+        dict: file_url, count and validation errors
+    """
+    from_date = getdate(period + "-01")
+    to_date = get_last_day(from_date)
+
+    checkpoint = get_checkpoint(JOB_TYPE, f"{company}:{period}")
+    folder = get_export_folder(company)
+    staging_path = os.path.join(folder, f"{period}.jsonl")
+
+    since = checkpoint.last_value
+    if cint(rebuild):
+        since = None
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    accounts = {
+        account: tax_type
+        for account, tax_type in get_account_tax_types(company).items()
+        if tax_type != "vat_tax"
+    }
+
+    save_checkpoint(checkpoint, status="Running", error=None)
+    try:
+        with replica_connection() as db:
+            changed, highest = read_changed_entries(company, from_date, to_date, since, accounts, db)
+        count = merge_staging(staging_path, changed)
+
+        header = {
+            "company": company,
+            "tax_id": frappe.get_cached_value("Company", company, "tax_id") or "",
+            "period": period,
+            "from_date": str(from_date),
+            "to_date": str(to_date),
+        }
+        extension = "xml" if file_format == "XML" else "json"
+        file_name = f"withholding-return-{frappe.scrub(company)}-{period}.{extension}"
+        writer = write_xml if file_format == "XML" else write_json
+        writer(os.path.join(folder, file_name), header, iter_staging(staging_path))
+        file_url = attach_submission_file(company, file_name)
+
+        errors = validate_entries(iter_staging(staging_path))
+        save_checkpoint(
+            checkpoint,
+            status="Completed",
+            last_value=highest,
+            processed_count=count,
+            state={"file_url": file_url, "changed": len(changed), "errors": errors},
+        )
+    except Exception:
+        frappe.db.rollback()
+        save_checkpoint(checkpoint, status="Failed", error=frappe.get_traceback())
+        frappe.log_error(frappe.get_traceback(), _("Error building tax authority file"))
+        raise
+
+    return {
+        "file_url": file_url,
+        "count": count,
+        "changed": len(changed),
+        "errors": errors,
+    }
+
+
+@frappe.whitelist()
+def enqueue_submission_file(company, period, file_format="JSON", rebuild=0):
+    """
+    Enqueue the withholding/stamp return of a company for one month
+    A run already queued or running for the same company and period is not duplicated
+
+    Args:
+        company: Company name
+        period: Month as YYYY-MM
+        file_format: "JSON" or "XML"
+        rebuild: Ignore the checkpoint and read the whole period again
+
+    Returns:
+        str: Name of the Deduction Job Checkpoint holding the result
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    checkpoint = get_checkpoint(JOB_TYPE, f"{company}:{period}")
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.tax_authority_export.build_submission_file",
+        queue="long",
+        timeout=60 * 60,
+        job_id="tax-authority-export-" + checkpoint.name,
+        deduplicate=True,
+        company=company,
+        period=period,
+        file_format=file_format,
+        rebuild=rebuild,
+    )
+
+    return checkpoint.name
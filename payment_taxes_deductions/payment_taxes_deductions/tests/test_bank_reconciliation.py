@@ -0,0 +1,34 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from payment_taxes_deductions.payment_taxes_deductions.bank_reconciliation import _find_combinations
+
+
+def find(nets, amount, window=0.01, max_invoices=3):
+	entries = [(net, f"INV-{position}") for position, net in enumerate(nets)]
+	return [
+		sorted(entry[1] for entry in combination)
+		for combination in _find_combinations(entries, nets, amount, window, max_invoices)
+	]
+
+
+class TestBankReconciliation(FrappeTestCase):
+	def test_pairs_and_triples(self):
+		combinations = find([10, 15, 25, 35], 50)
+
+		self.assertIn(["INV-1", "INV-3"], combinations)
+		self.assertIn(["INV-0", "INV-1", "INV-2"], combinations)
+		self.assertEqual(len(combinations), 2)
+
+	def test_max_invoices_limits_combinations(self):
+		self.assertEqual(find([10, 15, 25, 35], 50, max_invoices=2), [["INV-1", "INV-3"]])
+
+	def test_window(self):
+		self.assertEqual(find([10, 20.02], 30, window=0.01), [])
+		self.assertEqual(find([10, 20.02], 30, window=0.05), [["INV-0", "INV-1"]])
+
+	def test_invoice_used_once_per_combination(self):
+		self.assertEqual(find([25], 50), [])
+		self.assertEqual(find([25, 25], 50), [["INV-0", "INV-1"]])
@@ -0,0 +1,153 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+import os
+import shutil
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_columns import (
+	NO_BRACKET,
+	append_rows,
+	build_month_columns,
+	get_archive_folder,
+	get_archived_entries,
+	get_month_folder,
+	get_reversal_columns,
+	load_month,
+	query_deductions,
+	read_meta,
+)
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import compile_brackets
+
+COMPANY = "_Test Deduction Columns"
+
+ACCOUNT_TAX_TYPES = {
+	"Stamp - _TC": "regular_stamp",
+	"Profits - _TC": "commercial_profits",
+}
+
+
+BRACKETS = compile_brackets(
+	[
+		{"from_amount": 0, "to_amount": 1000, "percentage": 1},
+		{"from_amount": 1000, "to_amount": 0, "percentage": 2},
+	]
+)
+
+
+def make_row(
+	name, posting_date, party, account, amount, payment_type="Receive", party_group="Group A", paid_amount=500
+):
+	return frappe._dict(
+		name=name,
+		posting_date=posting_date,
+		payment_type=payment_type,
+		party_type="Customer" if payment_type == "Receive" else "Supplier",
+		party=party,
+		party_group=party_group,
+		base_paid_amount=paid_amount,
+		account=account,
+		amount=amount,
+	)
+
+
+class TestDeductionColumns(FrappeTestCase):
+	def setUp(self):
+		shutil.rmtree(get_archive_folder(COMPANY), ignore_errors=True)
+
+	def tearDown(self):
+		shutil.rmtree(get_archive_folder(COMPANY), ignore_errors=True)
+
+	def append(self, month, rows, brackets=None):
+		folder = get_month_folder(COMPANY, month)
+		meta = read_meta(folder)
+		append_rows(folder, meta, build_month_columns(rows, meta, ACCOUNT_TAX_TYPES, brackets))
+
+	def test_append_and_query(self):
+		self.append(
+			"2026-01",
+			[
+				make_row("PE-1", "2026-01-05", "A", "Stamp - _TC", 5),
+				make_row("PE-1", "2026-01-05", "A", "Profits - _TC", 10),
+				make_row("PE-2", "2026-01-20", "B", "Stamp - _TC", 7),
+			],
+		)
+		self.append(
+			"2026-01",
+			[make_row("PE-3", "2026-01-25", "S", "Stamp - _TC", 2, payment_type="Pay")],
+		)
+		self.append("2026-02", [make_row("PE-4", "2026-02-01", "A", "Profits - _TC", 4)])
+
+		self.assertEqual(load_month(COMPANY, "2026-01").rows, 4)
+
+		result = query_deductions(COMPANY, "2026-01-01", "2026-02-28")
+		self.assertEqual(result["rows_scanned"], 5)
+		self.assertEqual(result["totals"], {"regular_stamp": 14, "commercial_profits": 14})
+
+		result = query_deductions(COMPANY, "2026-01-01", "2026-01-31", group_by="party")
+		self.assertEqual(result["totals"], {"Customer: A": 15, "Customer: B": 7, "Supplier: S": 2})
+
+		result = query_deductions(COMPANY, "2026-01-10", "2026-01-31", payment_type="Receive")
+		self.assertEqual(result["totals"], {"regular_stamp": 7})
+
+	def test_party_group_paid_amount_and_bracket_columns(self):
+		self.append(
+			"2026-01",
+			[
+				make_row("PE-1", "2026-01-05", "A", "Stamp - _TC", 5, paid_amount=500),
+				make_row("PE-1", "2026-01-05", "A", "Profits - _TC", 10, paid_amount=500),
+				make_row(
+					"PE-2", "2026-01-20", "B", "Stamp - _TC", 7, party_group="Group B", paid_amount=4000
+				),
+			],
+			BRACKETS,
+		)
+		self.append("2026-01", [make_row("PE-3", "2026-01-25", "C", "Stamp - _TC", 2)])
+
+		data = load_month(COMPANY, "2026-01")
+		self.assertEqual(data.columns["paid_amount"].tolist(), [500, 500, 4000, 500])
+		self.assertEqual(data.party_groups, ["Group A", "Group B"])
+		self.assertEqual(data.columns["bracket"].tolist(), [0, 0, 1, NO_BRACKET])
+
+		result = query_deductions(COMPANY, "2026-01-01", "2026-01-31", group_by="party_group")
+		self.assertEqual(result["totals"], {"Group A": 17, "Group B": 7})
+
+		result = query_deductions(COMPANY, "2026-01-01", "2026-01-31", group_by="bracket")
+		self.assertEqual(result["totals"], {"0 - 1000": 15, "1000+": 7, "No Bracket": 2})
+
+	def test_reversal_rows_cancel_archived_amounts(self):
+		self.append(
+			"2026-01",
+			[
+				make_row("PE-1", "2026-01-05", "A", "Stamp - _TC", 5),
+				make_row("PE-2", "2026-01-06", "B", "Stamp - _TC", 7),
+			],
+		)
+		data = load_month(COMPANY, "2026-01")
+		folder = get_month_folder(COMPANY, "2026-01")
+		append_rows(folder, read_meta(folder), get_reversal_columns(data, ["PE-1"]))
+
+		submitted, reversed_entries = get_archived_entries(load_month(COMPANY, "2026-01"))
+		self.assertEqual(submitted, {"PE-1", "PE-2"})
+		self.assertEqual(reversed_entries, {"PE-1"})
+		self.assertEqual(
+			query_deductions(COMPANY, "2026-01-01", "2026-01-31")["totals"], {"regular_stamp": 7}
+		)
+
+	def test_uncommitted_append_is_discarded(self):
+		self.append("2026-01", [make_row("PE-1", "2026-01-05", "A", "Stamp - _TC", 5)])
+
+		# An append that wrote column bytes but never reached meta.json
+		folder = get_month_folder(COMPANY, "2026-01")
+		with open(os.path.join(folder, "amount.bin"), "ab") as column_file:
+			column_file.write(b"\0" * 8 * 3)
+
+		self.assertEqual(load_month(COMPANY, "2026-01").rows, 1)
+
+		self.append("2026-01", [make_row("PE-2", "2026-01-06", "B", "Stamp - _TC", 7)])
+		data = load_month(COMPANY, "2026-01")
+		self.assertEqual(data.rows, 2)
+		self.assertEqual(os.path.getsize(os.path.join(folder, "amount.bin")), 2 * 8)
+		self.assertEqual(data.columns["amount"].tolist(), [5, 7])
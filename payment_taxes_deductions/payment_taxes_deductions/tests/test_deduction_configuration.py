@@ -0,0 +1,139 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_configuration import (
+	read_csv_rows,
+	save_configuration,
+)
+from payment_taxes_deductions.payment_taxes_deductions.deduction_verifier import revert_to
+
+COMPANY = "_Test Company"
+COMPANY_WITHOUT_RULES = "_Test Company 1"
+CUSTOMER_GROUP = "_Test Customer Group"
+COMMERCIAL_PROFITS_ACCOUNT = "_Test Account Excise Duty - _TC"
+
+BRACKETS_CSV = """Company,From Amount,To Amount,Percentage,Subtract Amount
+{company},0,1000,1,0
+{company},1000,0,2,10
+"""
+
+
+def get_ranges(company):
+	return frappe.get_all(
+		"Stamp Tax Range",
+		filters={"parenttype": "Stamp Tax Calculation Rules", "parent": company},
+		fields=["name", "idx", "from_amount", "to_amount", "percentage", "subtract_amount"],
+		order_by="idx asc",
+	)
+
+
+class TestDeductionConfiguration(FrappeTestCase):
+	def delete_rules(self, company):
+		for name in frappe.get_all("Stamp Tax Calculation Rules", {"company": company}, pluck="name"):
+			frappe.db.delete("Stamp Tax Range", {"parenttype": "Stamp Tax Calculation Rules", "parent": name})
+			frappe.db.delete("Stamp Tax Calculation Rules", name)
+
+	def import_brackets(self, company, content=BRACKETS_CSV):
+		return save_configuration(brackets=read_csv_rows("brackets", content.format(company=company)))
+
+	def test_import_brackets_creates_missing_rules(self):
+		self.delete_rules(COMPANY_WITHOUT_RULES)
+
+		result = self.import_brackets(COMPANY_WITHOUT_RULES)
+
+		self.assertFalse(result["bracket_errors"])
+		self.assertEqual(result["brackets"], {"companies": 1, "ranges": 2})
+
+		rules = frappe.db.get_value(
+			"Stamp Tax Calculation Rules",
+			COMPANY_WITHOUT_RULES,
+			["company", "creation", "modified", "modified_by", "owner"],
+			as_dict=True,
+		)
+		self.assertEqual(rules.company, COMPANY_WITHOUT_RULES)
+		self.assertEqual(rules.creation, rules.modified)
+		self.assertEqual(rules.modified_by, frappe.session.user)
+		self.assertEqual(rules.owner, frappe.session.user)
+
+		ranges = get_ranges(COMPANY_WITHOUT_RULES)
+		self.assertEqual([row.to_amount for row in ranges], [1000, 0])
+		self.assertEqual([row.percentage for row in ranges], [1, 2])
+
+		# A new parent needs no Version
+		self.assertFalse(
+			frappe.db.exists(
+				"Version",
+				{"ref_doctype": "Stamp Tax Calculation Rules", "docname": COMPANY_WITHOUT_RULES},
+			)
+		)
+
+	def test_reimport_brackets_records_revertible_version(self):
+		self.delete_rules(COMPANY_WITHOUT_RULES)
+		self.import_brackets(COMPANY_WITHOUT_RULES)
+		before = get_ranges(COMPANY_WITHOUT_RULES)
+		as_of = now_datetime()
+
+		self.import_brackets(
+			COMPANY_WITHOUT_RULES,
+			"Company,From Amount,To Amount,Percentage\n{company},0,0,3\n",
+		)
+		self.assertEqual([row.percentage for row in get_ranges(COMPANY_WITHOUT_RULES)], [3])
+
+		tables = {"stamp_tax_range": [dict(row) for row in get_ranges(COMPANY_WITHOUT_RULES)]}
+		revert_to("Stamp Tax Calculation Rules", COMPANY_WITHOUT_RULES, {}, tables, as_of)
+
+		self.assertEqual(
+			[(row["from_amount"], row["to_amount"], row["percentage"]) for row in tables["stamp_tax_range"]],
+			[(row.from_amount, row.to_amount, row.percentage) for row in before],
+		)
+
+	def test_profile_update_records_changed_version(self):
+		profile = {
+			"company": COMPANY,
+			"payment_type": "Receive",
+			"party_group": CUSTOMER_GROUP,
+			"commercial_profits": COMMERCIAL_PROFITS_ACCOUNT,
+		}
+		save_configuration(profiles=[profile])
+		name = frappe.db.get_value(
+			"Payment Deductions Accounts",
+			{"company": COMPANY, "payment_type": "Receive", "party_group": CUSTOMER_GROUP},
+		)
+
+		result = save_configuration(profiles=[{**profile, "commercial_profits": None}])
+
+		self.assertEqual(result["profiles"], {"inserted": 0, "updated": 1})
+		self.assertEqual(
+			frappe.db.get_value(
+				"Payment Deductions Accounts",
+				{"company": COMPANY, "payment_type": "Receive", "party_group": CUSTOMER_GROUP},
+			),
+			name,
+		)
+		data = json.loads(
+			frappe.get_all(
+				"Version",
+				filters={"ref_doctype": "Payment Deductions Accounts", "docname": name},
+				pluck="data",
+				order_by="creation desc",
+				limit=1,
+			)[0]
+		)
+		self.assertIn(["commercial_profits", COMMERCIAL_PROFITS_ACCOUNT, None], data["changed"])
+
+	def test_duplicate_profiles_are_reported(self):
+		profile = {"company": COMPANY, "payment_type": "Receive", "party_group": CUSTOMER_GROUP}
+
+		result = save_configuration(profiles=[profile, profile])
+
+		self.assertEqual(
+			[(error["row"], error["field"]) for error in result["profile_errors"]],
+			[(2, "party_group")],
+		)
+		self.assertNotIn("profiles", result)
@@ -0,0 +1,58 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+	OPEN_RANGE_LIMIT,
+	compile_brackets,
+	find_bracket,
+)
+
+
+def make_range(from_amount, to_amount, percentage, **values):
+	return dict(from_amount=from_amount, to_amount=to_amount, percentage=percentage, **values)
+
+
+class TestDeductionEngine(FrappeTestCase):
+	def test_compile_brackets_sorts_by_from_amount(self):
+		brackets = compile_brackets(
+			[make_range(1000, 5000, 2), make_range(0, 999.99, 1), make_range(5000.01, 0, 3)]
+		)
+
+		self.assertEqual(brackets["starts"], [0, 1000, 5000.01])
+		self.assertEqual([rule["percentage"] for rule in brackets["rules"]], [1, 2, 3])
+		# An empty to_amount is an open range
+		self.assertEqual(brackets["rules"][-1]["to_amount"], OPEN_RANGE_LIMIT)
+		self.assertEqual(brackets["rules"][0]["additional_stamp_multiplier"], 3)
+
+	def test_find_bracket_boundaries(self):
+		brackets = compile_brackets(
+			[make_range(100, 999.99, 1), make_range(1000, 5000, 2), make_range(5000.01, 0, 3)]
+		)
+
+		self.assertIsNone(find_bracket(brackets, 99.99))
+		self.assertEqual(find_bracket(brackets, 100)["percentage"], 1)
+		self.assertEqual(find_bracket(brackets, 999.99)["percentage"], 1)
+		self.assertEqual(find_bracket(brackets, 1000)["percentage"], 2)
+		self.assertEqual(find_bracket(brackets, 5000)["percentage"], 2)
+		self.assertEqual(find_bracket(brackets, 10_000_000)["percentage"], 3)
+
+	def test_find_bracket_gap(self):
+		brackets = compile_brackets([make_range(0, 100, 1), make_range(200, 300, 2)])
+
+		self.assertIsNone(find_bracket(brackets, 150))
+		self.assertIsNone(find_bracket(brackets, 301))
+
+	def test_overlapping_ranges_resolve_to_first_row(self):
+		# A wide range listed first wins over a narrower one starting later
+		brackets = compile_brackets([make_range(0, 10000, 1), make_range(500, 1000, 2)])
+		self.assertEqual(find_bracket(brackets, 750)["percentage"], 1)
+
+		brackets = compile_brackets([make_range(500, 1000, 2), make_range(0, 10000, 1)])
+		self.assertEqual(find_bracket(brackets, 750)["percentage"], 2)
+		self.assertEqual(find_bracket(brackets, 2000)["percentage"], 1)
+
+	def test_empty_brackets(self):
+		self.assertIsNone(find_bracket(compile_brackets([]), 100))
+		self.assertIsNone(find_bracket(None, 100))
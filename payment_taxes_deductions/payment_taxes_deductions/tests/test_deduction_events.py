@@ -0,0 +1,101 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_events import (
+	assign_sequences,
+	get_deduction_events,
+)
+
+COMPANY = "_Test Company"
+OTHER_COMPANY = "_Test Company 1"
+
+
+class TestDeductionEvents(FrappeTestCase):
+	def setUp(self):
+		# assign_sequences commits: start from a numbered feed
+		assign_sequences()
+		self.after = frappe.db.sql("select coalesce(max(sequence), 0) from `tabDeduction Event`")[0][0]
+		self.events = []
+
+	def tearDown(self):
+		if self.events:
+			frappe.db.delete("Deduction Event", {"name": ["in", self.events]})
+			frappe.db.commit()
+
+	def add_event(self, payment_entry, company=COMPANY, event_type="Computed"):
+		event = frappe.get_doc(
+			{
+				"doctype": "Deduction Event",
+				"event_type": event_type,
+				"payment_entry": payment_entry,
+				"company": company,
+				"payment_type": "Receive",
+				"party_type": "Customer",
+				"party": "_Test Customer",
+				"paid_amount": 1000,
+				"total_deductions": 10,
+				"deductions": json.dumps({"commercial_profits": 10}),
+			}
+		).insert(ignore_permissions=True, ignore_links=True)
+		self.events.append(event.name)
+		return event
+
+	def test_events_enter_the_feed_once_numbered(self):
+		first = self.add_event("ACC-PAY-TEST-0001")
+		second = self.add_event("ACC-PAY-TEST-0002", event_type="Changed")
+		frappe.db.commit()
+
+		self.assertEqual(get_deduction_events(after=self.after)["events"], [])
+
+		assign_sequences()
+
+		sequences = [frappe.db.get_value("Deduction Event", name, "sequence") for name in self.events]
+		self.assertEqual(sequences, [self.after + 1, self.after + 2])
+
+		feed = get_deduction_events(after=self.after)
+		self.assertEqual(
+			[event.payment_entry for event in feed["events"]], [first.payment_entry, second.payment_entry]
+		)
+		self.assertEqual([event.offset for event in feed["events"]], sequences)
+		self.assertEqual(feed["events"][0].deductions, {"commercial_profits": 10})
+		self.assertEqual(feed["cursor"], self.after + 2)
+		self.assertFalse(feed["has_more"])
+
+	def test_sequences_are_not_renumbered(self):
+		self.add_event("ACC-PAY-TEST-0001")
+		frappe.db.commit()
+		assign_sequences()
+		first_sequence = frappe.db.get_value("Deduction Event", self.events[0], "sequence")
+
+		self.add_event("ACC-PAY-TEST-0002", event_type="Submitted")
+		frappe.db.commit()
+		assign_sequences()
+
+		self.assertEqual(frappe.db.get_value("Deduction Event", self.events[0], "sequence"), first_sequence)
+		self.assertEqual(
+			frappe.db.get_value("Deduction Event", self.events[1], "sequence"), first_sequence + 1
+		)
+
+		feed = get_deduction_events(after=first_sequence)
+		self.assertEqual([event.event_type for event in feed["events"]], ["Submitted"])
+
+	def test_company_filter_moves_the_cursor_past_other_companies(self):
+		self.add_event("ACC-PAY-TEST-0001", company=OTHER_COMPANY)
+		self.add_event("ACC-PAY-TEST-0002")
+		self.add_event("ACC-PAY-TEST-0003", company=OTHER_COMPANY)
+		frappe.db.commit()
+		assign_sequences()
+
+		feed = get_deduction_events(after=self.after, limit=2, company=COMPANY)
+		self.assertEqual([event.payment_entry for event in feed["events"]], ["ACC-PAY-TEST-0002"])
+		self.assertEqual(feed["cursor"], self.after + 2)
+		self.assertTrue(feed["has_more"])
+
+		feed = get_deduction_events(after=feed["cursor"], company=COMPANY)
+		self.assertEqual(feed["events"], [])
+		self.assertEqual(feed["cursor"], self.after + 3)
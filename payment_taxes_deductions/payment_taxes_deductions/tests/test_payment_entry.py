@@ -0,0 +1,167 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+import frappe
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from payment_taxes_deductions.payment_taxes_deductions.payment_entry import get_deductions_by_customer_group
+
+COMPANY = "_Test Company"
+CUSTOMER_GROUP = "_Test Customer Group"
+COMMERCIAL_PROFITS_ACCOUNT = "_Test Account Excise Duty - _TC"
+
+
+class TestPaymentEntryDeductions(FrappeTestCase):
+	def setUp(self):
+		profile = frappe.db.get_value(
+			"Payment Deductions Accounts",
+			{"company": COMPANY, "payment_type": "Receive", "party_group": CUSTOMER_GROUP},
+		)
+		profile = (
+			frappe.get_doc("Payment Deductions Accounts", profile)
+			if profile
+			else frappe.new_doc("Payment Deductions Accounts")
+		)
+		profile.update(
+			{
+				"company": COMPANY,
+				"payment_type": "Receive",
+				"customer_group": CUSTOMER_GROUP,
+				"commercial_profits": COMMERCIAL_PROFITS_ACCOUNT,
+				"regular_stamp": None,
+				"additional_stamp": None,
+				"check_stamp": None,
+				"contract_stamp": None,
+				"vat_20_percent": None,
+			}
+		)
+		profile.save()
+
+	def set_allocation_mode(self, mode):
+		settings = frappe.get_single("Payment Deductions Settings")
+		settings.deduction_allocation_mode = mode
+		settings.commercial_profits_threshold_basis = "Per Payment"
+		settings.consolidate_deduction_postings = 0
+		settings.save()
+
+	def get_deduction_rows(self, payment_entry):
+		return [tax for tax in payment_entry.taxes if tax.account_head == COMMERCIAL_PROFITS_ACCOUNT]
+
+	def test_save_calculates_deduction_rows(self):
+		self.set_allocation_mode("Aggregate")
+		invoice = create_sales_invoice(rate=1000, qty=1)
+
+		payment_entry = get_payment_entry("Sales Invoice", invoice.name)
+		payment_entry.append(
+			"taxes",
+			{
+				"add_deduct_tax": "Deduct",
+				"charge_type": "Actual",
+				"account_head": COMMERCIAL_PROFITS_ACCOUNT,
+				"description": "Commercial profits",
+				"tax_amount": 0,
+			},
+		)
+		payment_entry.insert()
+
+		rows = self.get_deduction_rows(payment_entry)
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(flt(rows[0].tax_amount, 2), 10)
+
+	def test_per_reference_deductions_settle_the_invoice(self):
+		self.set_allocation_mode("Per Invoice Brackets")
+		invoice = create_sales_invoice(rate=1000, qty=1)
+
+		# Customer transferred the invoice net of its 1% commercial profits deduction
+		payment_entry = get_payment_entry("Sales Invoice", invoice.name)
+		payment_entry.paid_amount = payment_entry.received_amount = 990
+		payment_entry.references[0].allocated_amount = 990
+		payment_entry.insert()
+
+		rows = self.get_deduction_rows(payment_entry)
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(flt(rows[0].tax_amount, 2), 10)
+
+		reference = payment_entry.references[0]
+		self.assertEqual(flt(reference.allocated_amount, 2), 1000)
+		self.assertEqual(flt(reference.custom_deduction_amount, 2), 10)
+		self.assertEqual(flt(reference.custom_calculated_deduction_amount, 2), 10)
+		self.assertEqual(flt(payment_entry.paid_amount, 2), 1000)
+
+		# Saving again keeps the settlement
+		payment_entry.save()
+		self.assertEqual(flt(payment_entry.references[0].allocated_amount, 2), 1000)
+		self.assertEqual(flt(payment_entry.paid_amount, 2), 1000)
+		self.assertEqual(len(self.get_deduction_rows(payment_entry)), 1)
+
+		payment_entry.submit()
+		self.assertEqual(flt(frappe.db.get_value("Sales Invoice", invoice.name, "outstanding_amount")), 0)
+
+	def test_per_reference_deductions_covered_by_cash(self):
+		self.set_allocation_mode("Per Invoice Brackets")
+		invoice = create_sales_invoice(rate=1000, qty=1)
+
+		# Customer transferred the full invoice: nothing is withheld
+		payment_entry = get_payment_entry("Sales Invoice", invoice.name)
+		payment_entry.insert()
+
+		reference = payment_entry.references[0]
+		self.assertEqual(flt(reference.allocated_amount, 2), 1000)
+		self.assertEqual(flt(reference.custom_deduction_amount, 2), 0)
+		self.assertEqual(flt(reference.custom_calculated_deduction_amount, 2), 10)
+		self.assertEqual(flt(payment_entry.paid_amount, 2), 1000)
+		self.assertEqual(self.get_deduction_rows(payment_entry), [])
+
+	def test_per_reference_deductions_partly_covered_by_cash(self):
+		self.set_allocation_mode("Per Invoice Brackets")
+		invoice = create_sales_invoice(rate=1000, qty=1)
+
+		# Customer withheld only 4 of the 10 commercial profits deduction
+		payment_entry = get_payment_entry("Sales Invoice", invoice.name)
+		payment_entry.paid_amount = payment_entry.received_amount = 996
+		payment_entry.references[0].allocated_amount = 996
+		payment_entry.insert()
+
+		reference = payment_entry.references[0]
+		self.assertEqual(flt(reference.allocated_amount, 2), 1000)
+		self.assertEqual(flt(reference.custom_deduction_amount, 2), 4)
+		self.assertEqual(flt(reference.custom_calculated_deduction_amount, 2), 10)
+		self.assertEqual(flt(payment_entry.paid_amount, 2), 1000)
+
+		rows = self.get_deduction_rows(payment_entry)
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(flt(rows[0].tax_amount, 2), 4)
+
+	def test_per_reference_removes_stale_rows(self):
+		self.set_allocation_mode("Per Invoice Brackets")
+		invoice = create_sales_invoice(rate=200, qty=1)
+
+		# Below the commercial profits threshold of 300
+		payment_entry = get_payment_entry("Sales Invoice", invoice.name)
+		payment_entry.append(
+			"taxes",
+			{
+				"add_deduct_tax": "Deduct",
+				"charge_type": "Actual",
+				"account_head": COMMERCIAL_PROFITS_ACCOUNT,
+				"description": "Commercial profits",
+				"tax_amount": 5,
+			},
+		)
+		payment_entry.insert()
+
+		self.assertEqual(self.get_deduction_rows(payment_entry), [])
+		self.assertEqual(flt(payment_entry.references[0].allocated_amount, 2), 200)
+
+	def test_receive_api_converts_the_paid_amount(self):
+		rows = get_deductions_by_customer_group(COMPANY, CUSTOMER_GROUP, 1000)
+		self.assertEqual(
+			[(row["account_head"], flt(row["tax_amount"], 2)) for row in rows], [(COMMERCIAL_PROFITS_ACCOUNT, 10)]
+		)
+
+		# 200 at rate 2 is 400 in company currency: above the 300 threshold, in the paid currency
+		rows = get_deductions_by_customer_group(COMPANY, CUSTOMER_GROUP, 200, exchange_rate=2)
+		self.assertEqual([flt(row["tax_amount"], 2) for row in rows], [2])
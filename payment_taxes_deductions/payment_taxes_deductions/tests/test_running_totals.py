@@ -0,0 +1,85 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from payment_taxes_deductions.payment_taxes_deductions.running_totals import (
+	PAYMENTS_TOTAL,
+	get_entry_amounts,
+)
+
+PROFILE = {
+	"commercial_profits": "Profits - _TC",
+	"regular_stamp": "Stamp - _TC",
+	"additional_stamp": "Stamp - _TC",
+	"vat_tax": "VAT - _TC",
+}
+
+
+def make_tax(account, amount, add_deduct_tax="Deduct", custom_deduction_account=None):
+	return frappe._dict(
+		account_head=account,
+		custom_deduction_account=custom_deduction_account,
+		add_deduct_tax=add_deduct_tax,
+		tax_amount=amount,
+		base_tax_amount=amount,
+	)
+
+
+@patch(
+	"payment_taxes_deductions.payment_taxes_deductions.running_totals.get_deduction_profile",
+	lambda company, customer_group=None, payment_type="Receive": PROFILE,
+)
+class TestRunningTotals(FrappeTestCase):
+	def make_entry(self, taxes, base_paid_amount=1000):
+		return frappe._dict(
+			company="_Test Company",
+			custom_customer_group="_Test Customer Group",
+			base_paid_amount=base_paid_amount,
+			paid_amount=base_paid_amount,
+			taxes=taxes,
+		)
+
+	def test_entry_amounts_per_tax_type(self):
+		amounts = get_entry_amounts(
+			self.make_entry([make_tax("Profits - _TC", 10), make_tax("Stamp - _TC", 4)])
+		)
+
+		self.assertEqual(amounts[PAYMENTS_TOTAL], (1000, 0))
+		self.assertEqual(amounts["commercial_profits"], (1000, 10))
+		self.assertEqual(sum(amount[1] for amount in amounts.values()), 14)
+
+	def test_shared_account_maps_to_first_tax_type(self):
+		# Same mapping as the rebuild (get_account_tax_types)
+		amounts = get_entry_amounts(self.make_entry([make_tax("Stamp - _TC", 4)]))
+
+		self.assertEqual(amounts["regular_stamp"], (1000, 4))
+		self.assertNotIn("additional_stamp", amounts)
+
+	def test_entry_amounts_skip_vat_and_added_rows(self):
+		amounts = get_entry_amounts(
+			self.make_entry(
+				[
+					make_tax("VAT - _TC", 140),
+					make_tax("Profits - _TC", 3, add_deduct_tax="Add"),
+					make_tax("Other - _TC", 2),
+				]
+			)
+		)
+
+		self.assertEqual(amounts, {PAYMENTS_TOTAL: (1000, 0)})
+
+	def test_entry_amounts_of_rows_routed_to_clearing(self):
+		amounts = get_entry_amounts(
+			self.make_entry(
+				[
+					make_tax("Clearing - _TC", 6, custom_deduction_account="Profits - _TC"),
+					make_tax("Clearing - _TC", 4, custom_deduction_account="Profits - _TC"),
+				]
+			)
+		)
+
+		self.assertEqual(amounts["commercial_profits"], (1000, 10))
@@ -0,0 +1,95 @@
+# Copyright (c) 2026, abdopcnet@gmail.com and Contributors
+# See license.txt
+
+import json
+import os
+import shutil
+import tempfile
+
+from frappe.tests.utils import FrappeTestCase
+
+from payment_taxes_deductions.payment_taxes_deductions.tax_authority_export import (
+	iter_staging,
+	merge_staging,
+	write_json,
+)
+
+
+def make_row(payment_entry, tax_type, tax_amount):
+	return {
+		"payment_entry": payment_entry,
+		"party": "Customer " + payment_entry,
+		"tax_type": tax_type,
+		"paid_amount": 1000,
+		"tax_amount": tax_amount,
+	}
+
+
+class TestTaxAuthorityExport(FrappeTestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		self.staging_path = os.path.join(self.folder, "2026-01.jsonl")
+
+	def tearDown(self):
+		shutil.rmtree(self.folder, ignore_errors=True)
+
+	def test_merge_staging_replaces_changed_entries(self):
+		count = merge_staging(
+			self.staging_path,
+			{
+				"PE-1": [make_row("PE-1", "regular_stamp", 5), make_row("PE-1", "commercial_profits", 10)],
+				"PE-2": [make_row("PE-2", "regular_stamp", 7)],
+			},
+		)
+		self.assertEqual(count, 3)
+
+		# PE-1 amended, PE-2 cancelled (no rows), PE-3 new
+		count = merge_staging(
+			self.staging_path,
+			{
+				"PE-1": [make_row("PE-1", "regular_stamp", 6)],
+				"PE-2": [],
+				"PE-3": [make_row("PE-3", "check_stamp", 1)],
+			},
+		)
+		self.assertEqual(count, 2)
+
+		rows = list(iter_staging(self.staging_path))
+		self.assertEqual(
+			sorted((row["payment_entry"], row["tax_amount"]) for row in rows),
+			[("PE-1", 6), ("PE-3", 1)],
+		)
+		self.assertFalse(os.path.exists(self.staging_path + ".tmp"))
+
+	def test_merge_staging_keeps_unchanged_entries(self):
+		merge_staging(self.staging_path, {"PE-1": [make_row("PE-1", "regular_stamp", 5)]})
+		merge_staging(self.staging_path, {"PE-2": [make_row("PE-2", "regular_stamp", 7)]})
+
+		self.assertEqual(
+			sorted(row["payment_entry"] for row in iter_staging(self.staging_path)), ["PE-1", "PE-2"]
+		)
+
+	def test_write_json(self):
+		path = os.path.join(self.folder, "return.json")
+		entries = [
+			make_row("PE-1", "regular_stamp", 5.004),
+			make_row("PE-1", "commercial_profits", 10),
+			make_row("PE-2", "regular_stamp", 7),
+		]
+
+		count = write_json(path, {"company": "_Test Company", "period": "2026-01"}, iter(entries))
+
+		with open(path) as output:
+			submission = json.load(output)
+		self.assertEqual(count, 3)
+		self.assertEqual(submission["count"], 3)
+		self.assertEqual(submission["header"]["period"], "2026-01")
+		self.assertEqual(submission["entries"], entries)
+		self.assertEqual(submission["totals"], {"regular_stamp": 12, "commercial_profits": 10})
+
+	def test_write_json_without_entries(self):
+		path = os.path.join(self.folder, "return.json")
+		self.assertEqual(write_json(path, {}, iter([])), 0)
+
+		with open(path) as output:
+			self.assertEqual(json.load(output), {"header": {}, "entries": [], "totals": {}, "count": 0})
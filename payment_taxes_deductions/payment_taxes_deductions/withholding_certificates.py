@@ -0,0 +1,392 @@
+"""
+Withholding Certificates
+Generate deduction certificates per customer per quarter in a background job
+
+Submitted Payment Entry tax rows are streamed in keyset-paginated chunks
+ordered by customer, so only one customer's rows are held in memory at a
+time. Certificates are rendered (and optionally converted to PDF) in a
+process pool and stored as private File attachments on the Customer. The
+last finished customer is recorded in a Deduction Job Checkpoint, so an
+interrupted run resumes where it stopped. Tax rows are streamed from the read
+replica when one is configured.
+
+Structure:
+1. Rendering (process pool)
+2. Streaming
+3. Job
+4. API Methods
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, add_months, cint, flt, getdate
+
+from payment_taxes_deductions.payment_taxes_deductions.deduction_engine import (
+    TAX_TYPE_LABELS,
+    get_account_tax_types,
+)
+from payment_taxes_deductions.payment_taxes_deductions.doctype.deduction_job_checkpoint.deduction_job_checkpoint import (
+    get_checkpoint,
+    save_checkpoint,
+)
+from payment_taxes_deductions.payment_taxes_deductions.read_replica import (
+    replica_connection,
+)
+
+JOB_TYPE = "Withholding Certificates"
+
+# Tax types withheld from customers that appear on certificates
+CERTIFICATE_TAX_TYPES = (
+    "regular_stamp",
+    "additional_stamp",
+    "check_stamp",
+    "commercial_profits",
+    "applied_professions_tax",
+)
+
+TEMPLATE_PATH = "templates/includes/withholding_certificate.html"
+
+CHUNK_SIZE = 5000
+
+
+# ============================================================================
+# SECTION 1: RENDERING (PROCESS POOL)
+# ============================================================================
+
+# wkhtmltopdf options of the PDF certificates
+PDF_OPTIONS = {
+    "encoding": "UTF-8",
+    "page-size": "A4",
+    "margin-top": "15mm",
+    "margin-bottom": "15mm",
+    "margin-left": "15mm",
+    "margin-right": "15mm",
+    "quiet": "",
+}
+
+_template = None
+_file_format = "HTML"
+
+
+def _init_renderer(template_source, file_format="HTML"):
+    global _template, _file_format
+    from jinja2 import Environment
+
+    # Customer names and descriptions come from user input
+    _template = Environment(autoescape=True).from_string(template_source)
+    _file_format = file_format
+
+
+def render_certificate(context):
+    """
+    Render one certificate (runs in a pool process, no frappe context)
+
+    PDF certificates are converted here with wkhtmltopdf through pdfkit, the
+    library behind frappe.utils.pdf.get_pdf, which needs a site context.
+
+    Args:
+        context: Certificate context with rows and totals
+
+    Returns:
+        tuple: (customer, quarter, content) with HTML text or PDF bytes
+    """
+    content = _template.render(**context)
+    if _file_format == "PDF":
+        import pdfkit
+
+        content = pdfkit.from_string(content, False, options=PDF_OPTIONS)
+
+    return context["customer"], context["quarter"], content
+
+
+# ============================================================================
+# SECTION 2: STREAMING
+# ============================================================================
+
+def stream_customer_rows(company, from_date, to_date, accounts, after_customer=None, db=None):
+    """
+    Yield (customer, rows) for each customer, reading tax rows in keyset chunks
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        accounts: Deduction accounts to include
+        after_customer: Resume after this customer (from the checkpoint)
+        db: Connection to read from (defaults to frappe.db)
+    """
+    db = db or frappe.db
+    # pe.name > NULL is never true, so a resumed run skips after_customer entirely
+    last_party, last_name = after_customer or "", None
+    current_customer, current_rows = None, []
+
+    while True:
+        chunk = db.sql(
+            """
+            select pe.party as customer, pe.name as payment_entry, pe.posting_date,
+                pe.base_paid_amount,
+                coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head) as account,
+                tax.base_tax_amount as amount
+            from `tabPayment Entry` pe
+            inner join `tabAdvance Taxes and Charges` tax
+                on tax.parent = pe.name and tax.parenttype = 'Payment Entry'
+            where pe.company = %(company)s
+                and pe.docstatus = 1
+                and pe.party_type = 'Customer'
+                and pe.posting_date between %(from_date)s and %(to_date)s
+                and coalesce(nullif(tax.custom_deduction_account, ''), tax.account_head) in %(accounts)s
+                and (pe.party > %(last_party)s or (pe.party = %(last_party)s and pe.name > %(last_name)s))
+            order by pe.party, pe.name
+            limit %(limit)s
+            """,
+            {
+                "company": company,
+                "from_date": from_date,
+                "to_date": to_date,
+                "accounts": tuple(accounts),
+                "last_party": last_party,
+                "last_name": last_name,
+                "limit": CHUNK_SIZE,
+            },
+            as_dict=True,
+        )
+
+        # A Payment Entry has several tax rows, re-read a partly read one
+        has_more = len(chunk) == CHUNK_SIZE
+        if has_more:
+            cut = chunk[-1].payment_entry
+            chunk = [row for row in chunk if row.payment_entry != cut] or chunk
+
+        for row in chunk:
+            if row.customer != current_customer:
+                if current_rows:
+                    yield current_customer, current_rows
+                current_customer, current_rows = row.customer, []
+            current_rows.append(row)
+
+        if not has_more:
+            break
+
+        last_party, last_name = chunk[-1].customer, chunk[-1].payment_entry
+
+    if current_rows:
+        yield current_customer, current_rows
+
+
+def get_quarter(posting_date):
+    posting_date = getdate(posting_date)
+    quarter = (posting_date.month - 1) // 3 + 1
+    return f"{posting_date.year}-Q{quarter}"
+
+
+def build_certificate_contexts(company, customer, rows, account_tax_types, customer_info):
+    """
+    Group a customer's tax rows by quarter into certificate contexts
+
+    Returns:
+        list: One render context per quarter
+    """
+    by_quarter = {}
+    for row in rows:
+        by_quarter.setdefault(get_quarter(row.posting_date), []).append(row)
+
+    contexts = []
+    for quarter, quarter_rows in sorted(by_quarter.items()):
+        first_date = getdate(quarter_rows[0].posting_date)
+        quarter_start = first_date.replace(month=(first_date.month - 1) // 3 * 3 + 1, day=1)
+
+        totals = {}
+        lines = []
+        for row in quarter_rows:
+            tax_type = account_tax_types.get(row.account)
+            totals[tax_type] = totals.get(tax_type, 0) + flt(row.amount)
+            lines.append({
+                "posting_date": str(row.posting_date),
+                "payment_entry": row.payment_entry,
+                "description": TAX_TYPE_LABELS.get(tax_type, row.account),
+                "paid_amount": flt(row.base_paid_amount),
+                "amount": flt(row.amount),
+            })
+
+        contexts.append({
+            "company": company,
+            "customer": customer,
+            "customer_name": customer_info.get("customer_name") or customer,
+            "tax_id": customer_info.get("tax_id"),
+            "quarter": quarter,
+            "from_date": str(quarter_start),
+            "to_date": str(add_days(add_months(quarter_start, 3), -1)),
+            "rows": lines,
+            "totals": [
+                (TAX_TYPE_LABELS.get(tax_type, tax_type), amount)
+                for tax_type, amount in totals.items()
+            ],
+            "total": sum(totals.values()),
+        })
+
+    return contexts
+
+
+# ============================================================================
+# SECTION 3: JOB
+# ============================================================================
+
+def generate_certificates(company, from_date, to_date, file_format="HTML", workers=None):
+    """
+    Background job: generate certificates for all customers of a company
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        file_format: "HTML" or "PDF"
+        workers: Number of render processes (defaults to CPU count)
+    """
+    checkpoint_key = f"{company}:{from_date}:{to_date}"
+    checkpoint = get_checkpoint(JOB_TYPE, checkpoint_key)
+    if checkpoint.status == "Completed":
+        return
+
+    save_checkpoint(checkpoint, status="Running", error=None)
+
+    account_tax_types = {
+        account: tax_type
+        for account, tax_type in get_account_tax_types(company).items()
+        if tax_type in CERTIFICATE_TAX_TYPES
+    }
+    if not account_tax_types:
+        save_checkpoint(checkpoint, status="Completed")
+        return
+
+    template_source = frappe.get_app_path("payment_taxes_deductions", TEMPLATE_PATH)
+    with open(template_source) as template_file:
+        template_source = template_file.read()
+
+    workers = cint(workers) or os.cpu_count() or 1
+    processed = cint(checkpoint.processed_count)
+
+    # Customers in flight; results are saved (and checkpointed) in stream order
+    pending = deque()
+
+    def flush(limit):
+        nonlocal processed
+        while len(pending) > limit:
+            customer, futures = pending.popleft()
+            for future in futures:
+                _customer, quarter, content = future.result()
+                save_certificate(customer, quarter, content, file_format)
+
+            processed += 1
+            save_checkpoint(checkpoint, last_value=customer, processed_count=processed)
+
+    try:
+        # spawn, so render processes never share the job's database connection
+        with replica_connection() as db, ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_renderer,
+            initargs=(template_source, file_format),
+        ) as pool:
+            for customer, rows in stream_customer_rows(
+                company, from_date, to_date, account_tax_types, checkpoint.last_value, db
+            ):
+                customer_info = frappe.db.get_value(
+                    "Customer", customer, ["customer_name", "tax_id"], as_dict=True
+                ) or {}
+                contexts = build_certificate_contexts(
+                    company, customer, rows, account_tax_types, customer_info
+                )
+                pending.append(
+                    (customer, [pool.submit(render_certificate, context) for context in contexts])
+                )
+
+                # Keep every process busy while bounding memory to a few customers each
+                flush(workers * 2)
+
+            flush(0)
+
+        save_checkpoint(checkpoint, status="Completed")
+
+    except Exception:
+        frappe.db.rollback()
+        save_checkpoint(checkpoint, status="Failed", error=frappe.get_traceback())
+        frappe.log_error(frappe.get_traceback(), _("Error generating withholding certificates"))
+        raise
+
+
+def save_certificate(customer, quarter, content, file_format="HTML"):
+    """
+    Store a rendered certificate as a private File attached to the Customer
+    An existing certificate of the same quarter is replaced
+    """
+    file_name = "withholding-certificate-{}-{}.{}".format(
+        frappe.scrub(customer), quarter, "pdf" if file_format == "PDF" else "html"
+    )
+
+    for existing in frappe.get_all(
+        "File",
+        filters={
+            "attached_to_doctype": "Customer",
+            "attached_to_name": customer,
+            "file_name": file_name,
+        },
+        pluck="name",
+    ):
+        frappe.delete_doc("File", existing, ignore_permissions=True)
+
+    frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "attached_to_doctype": "Customer",
+        "attached_to_name": customer,
+        "is_private": 1,
+        "content": content,
+    }).insert(ignore_permissions=True)
+
+
+# ============================================================================
+# SECTION 4: API METHODS
+# ============================================================================
+
+@frappe.whitelist()
+def enqueue_certificate_generation(company, from_date, to_date, file_format="HTML", restart=0):
+    """
+    Enqueue certificate generation for all customers of a company and period
+    Re-enqueueing an interrupted run resumes after the last finished customer
+
+    Args:
+        company: Company name
+        from_date: Period start
+        to_date: Period end
+        file_format: "HTML" or "PDF"
+        restart: Start over instead of resuming
+
+    Returns:
+        str: Name of the Deduction Job Checkpoint tracking progress
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+
+    checkpoint = get_checkpoint(JOB_TYPE, f"{company}:{from_date}:{to_date}")
+    if cint(restart):
+        save_checkpoint(
+            checkpoint, status="Queued", last_value=None, processed_count=0, error=None
+        )
+
+    frappe.enqueue(
+        "payment_taxes_deductions.payment_taxes_deductions.withholding_certificates.generate_certificates",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id="withholding-certificates-" + checkpoint.name,
+        deduplicate=True,
+        company=company,
+        from_date=from_date,
+        to_date=to_date,
+        file_format=file_format,
+    )
+
+    return checkpoint.name
@@ -38,6 +38,22 @@ function calculateTaxTotalAndNet(frm, paid_amount) {
 	frm.save();
 }
 
+/**
+ * Fetch supplier group when paying a Supplier, clear it otherwise
+ * @param {Object} frm - Frappe form object
+ */
+function setSupplierGroup(frm) {
+	if (frm.doc.payment_type === 'Pay' && frm.doc.party_type === 'Supplier' && frm.doc.party) {
+		frappe.db.get_value('Supplier', frm.doc.party, 'supplier_group', (r) => {
+			if (r && r.supplier_group && frm.doc.custom_supplier_group !== r.supplier_group) {
+				frm.set_value('custom_supplier_group', r.supplier_group);
+			}
+		});
+	} else if (frm.doc.custom_supplier_group) {
+		frm.set_value('custom_supplier_group', '');
+	}
+}
+
 // ============================================================================
 // SECTION 2: PAYMENT ENTRY FORM HANDLERS
 // ============================================================================
@@ -47,8 +63,10 @@ frappe.ui.form.on('Payment Entry', {
 	/**
 	 * Auto-fetch customer group when party (Customer) is selected
 	 * Only for payment_type = "Receive" and party_type = "Customer"
+	 * Supplier group is fetched for payment_type = "Pay" and party_type = "Supplier"
 	 */
 	party: function (frm) {
+		setSupplierGroup(frm);
 		if (
 			frm.doc.payment_type === 'Receive' &&
 			frm.doc.party_type === 'Customer' &&
@@ -72,6 +90,11 @@ frappe.ui.form.on('Payment Entry', {
 	 * Add button for deductions (only for draft documents)
 	 */
 	refresh: function (frm) {
+		// Update supplier group for Pay entries (draft only, it is read on save)
+		if (frm.doc.docstatus === 0) {
+			setSupplierGroup(frm);
+		}
+
 		// Update customer group on every refresh (regardless of docstatus)
 		if (
 			frm.doc.payment_type === 'Receive' &&
@@ -94,9 +117,10 @@ frappe.ui.form.on('Payment Entry', {
 		}
 
 		// Add button only for draft documents
-		// Only show button for draft documents and Receive payment type
-		if (frm.doc.docstatus === 0 && frm.doc.payment_type === 'Receive') {
-			// Add direct orange button to fetch deductions based on customer group
+		// Only show button for draft documents and Receive/Pay payment type
+		let is_pay = frm.doc.payment_type === 'Pay' && frm.doc.party_type === 'Supplier';
+		if (frm.doc.docstatus === 0 && (frm.doc.payment_type === 'Receive' || is_pay)) {
+			// Add direct orange button to fetch deductions based on customer/supplier group
 			frm.page.add_inner_button(
 				__('Download Stamps Taxes'),
 				function () {
@@ -106,7 +130,14 @@ frappe.ui.form.on('Payment Entry', {
 						return;
 					}
 
-					if (!frm.doc.custom_customer_group) {
+					if (is_pay && !frm.doc.custom_supplier_group) {
+						frappe.msgprint(
+							__('Supplier Group is required. Please select a Supplier first.'),
+						);
+						return;
+					}
+
+					if (!is_pay && !frm.doc.custom_customer_group) {
 						frappe.msgprint(
 							__('Customer Group is required. Please select a Customer first.'),
 						);
@@ -120,11 +151,18 @@ frappe.ui.form.on('Payment Entry', {
 
 					// Get taxes from server (in Advance Taxes and Charges format)
 					frappe.call({
-						method: 'payment_taxes_deductions.payment_taxes_deductions.payment_entry.get_deductions_by_customer_group',
+						method: is_pay
+							? 'payment_taxes_deductions.payment_taxes_deductions.payment_entry.get_deductions_by_supplier_group'
+							: 'payment_taxes_deductions.payment_taxes_deductions.payment_entry.get_deductions_by_customer_group',
 						args: {
 							company: frm.doc.company,
-							customer_group: frm.doc.custom_customer_group,
+							[is_pay ? 'supplier_group' : 'customer_group']: is_pay
+								? frm.doc.custom_supplier_group
+								: frm.doc.custom_customer_group,
 							paid_amount: frm.doc.paid_amount,
+							exchange_rate: frm.doc.source_exchange_rate,
+							paid_from_account_currency: frm.doc.paid_from_account_currency,
+							posting_date: frm.doc.posting_date,
 						},
 						callback: function (r) {
 							if (r.exc) {
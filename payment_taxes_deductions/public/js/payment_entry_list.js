@@ -0,0 +1,43 @@
+// ============================================================================
+// PAYMENT ENTRY LIST SCRIPT
+// ============================================================================
+// Adds "Batch Submit with Deductions" to the list Actions menu
+// Selected drafts are submitted in chunks by a background job; drafts whose
+// deduction fingerprint is still current are not recomputed
+
+frappe.listview_settings['Payment Entry'] = frappe.listview_settings['Payment Entry'] || {};
+
+const erpnextPaymentEntryOnload = frappe.listview_settings['Payment Entry'].onload;
+
+frappe.listview_settings['Payment Entry'].onload = function (listview) {
+	if (erpnextPaymentEntryOnload) {
+		erpnextPaymentEntryOnload(listview);
+	}
+
+	listview.page.add_actions_menu_item(__('Batch Submit with Deductions'), () => {
+		const names = listview
+			.get_checked_items()
+			.filter((item) => item.docstatus === 0)
+			.map((item) => item.name);
+
+		if (!names.length) {
+			frappe.msgprint(__('Select at least one draft Payment Entry'));
+			return;
+		}
+
+		frappe.confirm(__('Submit {0} Payment Entries?', [names.length]), () => {
+			frappe.call({
+				method: 'payment_taxes_deductions.payment_taxes_deductions.batch_submit.enqueue_batch_submit',
+				args: { names: names },
+				freeze: true,
+				callback: function () {
+					listview.clear_checked_items();
+					frappe.show_alert({
+						message: __('Submitting {0} Payment Entries in the background', [names.length]),
+						indicator: 'blue',
+					});
+				},
+			});
+		});
+	});
+};
@@ -0,0 +1,79 @@
+// ============================================================================
+// SALES INVOICE LIST SCRIPT
+// ============================================================================
+// Adds "Create Payment Entries with Deductions" to the list Actions menu
+// Selected invoices are sent in one call; drafts are built in a background job
+
+// ERPNext defines the Sales Invoice list settings; extend them instead of replacing
+frappe.listview_settings['Sales Invoice'] = frappe.listview_settings['Sales Invoice'] || {};
+
+const erpnextSalesInvoiceOnload = frappe.listview_settings['Sales Invoice'].onload;
+
+frappe.listview_settings['Sales Invoice'].onload = function (listview) {
+	if (erpnextSalesInvoiceOnload) {
+		erpnextSalesInvoiceOnload(listview);
+	}
+
+	listview.page.add_actions_menu_item(__('Create Payment Entries with Deductions'), () => {
+		createPaymentEntries(listview);
+	});
+};
+
+/**
+ * Ask for the payment details and enqueue one draft Payment Entry per customer
+ * Progress is shown by the job; drafts are listed in the final message
+ * @param {Object} listview - Sales Invoice list view
+ */
+function createPaymentEntries(listview) {
+	const invoices = listview.get_checked_items(true);
+	if (!invoices.length) {
+		frappe.msgprint(__('Select at least one Sales Invoice'));
+		return;
+	}
+
+	const dialog = new frappe.ui.Dialog({
+		title: __('Create Payment Entries with Deductions'),
+		fields: [
+			{
+				fieldname: 'posting_date',
+				fieldtype: 'Date',
+				label: __('Posting Date'),
+				default: frappe.datetime.get_today(),
+				reqd: 1,
+			},
+			{
+				fieldname: 'mode_of_payment',
+				fieldtype: 'Link',
+				label: __('Mode of Payment'),
+				options: 'Mode of Payment',
+			},
+			{
+				fieldname: 'reference_no',
+				fieldtype: 'Data',
+				label: __('Reference No'),
+			},
+			{
+				fieldname: 'reference_date',
+				fieldtype: 'Date',
+				label: __('Reference Date'),
+			},
+		],
+		primary_action_label: __('Create Drafts'),
+		primary_action(values) {
+			dialog.hide();
+			frappe.call({
+				method: 'payment_taxes_deductions.payment_taxes_deductions.bulk_payment_entries.enqueue_payment_entries_from_invoices',
+				args: Object.assign({ invoices: invoices }, values),
+				freeze: true,
+				callback: function () {
+					listview.clear_checked_items();
+					frappe.show_alert({
+						message: __('Creating Payment Entries for {0} invoices in the background', [invoices.length]),
+						indicator: 'blue',
+					});
+				},
+			});
+		},
+	});
+	dialog.show();
+}